@@ -2,81 +2,1359 @@
 
 import pandas as pd
 import numpy as np
+import argparse
+import csv
+import hashlib
+import io
+import json
 import os
-import re
+import pickle
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from tqdm import tqdm
 
+from columnar import write_columns
+from cube import build_sales_cube, cube_column_types
+from mansion_tax import (
+    BOOTSTRAP_METHODS, DEFAULT_BAND_LABELS, DEFAULT_CHARGES, DEFAULT_SCENARIO, DEFAULT_THRESHOLDS,
+    UPRATED_PRICES_DIR, bootstrap_revenue, finalize_uprated_prices, load_uprated_prices, reset_uprated_prices,
+    revenue_percentiles, uprated_prices_available, write_uprated_prices,
+)
+from inflation import (
+    latest_priced_quarter, load_inflation_factors, quarter_numbers, uprating_factors, uprating_factors_to
+)
+from postcodes import clean_addr_col, load_nspl_index, lookup_postcodes, postcode_positions
+from repeat_sales import (
+    REPEAT_SALES_CACHE_FILE, build_repeat_sales_index, last_index_quarter, load_repeat_sales_cache,
+    repeat_sales_cache_fingerprint, save_repeat_sales_cache,
+)
+from reference_data import CTSOP_SHEET, CTSOP_XLSX, HOUSE_PRICE_XLSX, read_reference_sheet
+from run_report import RunReport, add_report_arguments, peak_rss_text
+
+try:
+    import pyarrow as pa
+except ImportError:  # the cleaned-data cache is optional
+    pa = None
+
 # ==========================================
 # CONFIGURATION
 # ==========================================
 PPD_FILES = ['pp-complete.csv']
 NSPL_FILE = 'NSPL_FEB_2025_UK.csv'
-HOUSE_PRICE_XLSX = "housepricestatisticsparlicon.xlsx"
-
-# Sheets and rows for house price data
-HOUSE_PRICE_SHEET = "2b" # Updated to 2a based on common format, change to 2b if required
-HOUSE_PRICE_HEADER_ROW = 2 
 
+SCRIPT_NAME = '1_read_transaction_data_and_create_csvs'
 OUTPUT_FILE = 'constituency_sales_by_bracket.csv'
 POSTCODE_OUTPUT_FILE = 'postcode_sales_by_bracket.csv'
-CTSOP_FILE = 'CTSOP_tables.xlsx'
-CTSOP_SHEET = 'CTSOP2.0'
-CTSOP_SKIPROWS = 7
-
-BRACKETS = [0, 2_000_000, 2_500_000, 3_500_000, 5_000_000, float('inf')]
-LABELS = ['£0 - £2m', '£2m - £2.5m', '£2.5m - £3.5m', '£3.5m - £5m', '£5m+']
-
-def clean_addr_col(series):
-    """
-    Standardizes address strings: Upper case, removes special chars/spaces.
-    """
-    return (series.fillna('')
-            .astype(str)
-            .str.upper()
-            .str.replace(r'[^A-Z0-9]', '', regex=True))
-
-def load_and_prepare_inflation_data():
-    print("Loading and preparing house price inflation data...")
-    df = pd.read_excel(HOUSE_PRICE_XLSX, sheet_name=HOUSE_PRICE_SHEET, header=HOUSE_PRICE_HEADER_ROW)
-    df.rename(columns={'Area Code': 'pcon', 'Area Name': 'name'}, inplace=True)
-    
-    date_cols = [col for col in df.columns if 'Year ending' in str(col)]
-    id_vars = ['pcon', 'name']
-    df_long = pd.melt(df, id_vars=id_vars, value_vars=date_cols, var_name='Quarter', value_name='MedianPrice')
-    
-    def parse_quarter_string(q_str):
-        parts = q_str.split(' ')
-        year = int(parts[-1])
-        month_str = parts[-2]
-        month_map = {'Mar': 3, 'Jun': 6, 'Sep': 9, 'Dec': 12}
-        month = month_map.get(month_str, 12)
-        return pd.Timestamp(year, month, 1) + pd.offsets.MonthEnd(0)
-
-    df_long['QuarterEnd'] = df_long['Quarter'].apply(parse_quarter_string)
-    df_long.drop(columns=['Quarter'], inplace=True)
-    df_long['MedianPrice'] = pd.to_numeric(df_long['MedianPrice'], errors='coerce')
-    df_long.dropna(subset=['pcon', 'MedianPrice'], inplace=True)
-    return df_long
+# Bracket counts and revenue by postcode area/district/sector/unit and
+# constituency (see cube.py), in the columnar format
+SALES_CUBE_FILE = 'sales_cube.mtc'
+# Rows below the CTSOP header before the constituencies (the England and
+# Wales and England totals)
+CTSOP_TOTAL_ROWS = 2
+
+# Bands and charges are defined in mansion_tax.py
+BRACKETS = [0] + DEFAULT_THRESHOLDS + [float('inf')]
+LABELS = DEFAULT_BAND_LABELS
+# pcon (from NSPL) lets step 2 filter and attribute postcodes without a spatial join
+POSTCODE_CSV_COLUMNS = ['postcode_clean', 'postcode_label', 'lat', 'long'] + LABELS + ['Total Sales', 'rejected_multiple_transactions', 'pcon']
+
+# Price Paid CSV layout (the file has no header row)
+PPD_USECOLS = [0, 1, 2, 3, 4, 7, 8]
+PPD_NAMES = ['TransactionID', 'Price', 'Date', 'Postcode', 'PropertyType', 'PAON', 'SAON']
+PPD_DTYPES = {'TransactionID': 'str', 'Price': 'int64', 'Postcode': 'str', 'PropertyType': 'str', 'PAON': 'str', 'SAON': 'str'}
+PPD_STATUS_COLUMN = 15  # record status (A/C/D) in the monthly update files
+PPD_CHUNKSIZE = 1_000_000
+
+# Columns kept after cleaning, and the on-disk cache of them (Arrow IPC stream,
+# memory-mapped on reload). Bump the version whenever cleaning logic changes.
+PPD_CLEAN_COLUMNS = ['Price', 'Date', 'PropertyType', 'Postcode_Clean', 'Property_ID', 'TransactionKey']
+PPD_CACHE_DICT_COLUMNS = ['PropertyType', 'Postcode_Clean']
+PPD_CACHE_DIR = 'ppd_cache'
+PPD_CACHE_VERSION = 4
+
+# Incremental mode: every cleaned transaction, stored in postcode-sorted Arrow
+# segments, plus the per-postcode results they produced. Monthly update files
+# only touch the postcodes they mention.
+PPD_STATE_DIR = 'ppd_state'
+PPD_STATE_VERSION = 2
+PPD_STATE_COLUMNS = ['TransactionKey', 'Price', 'Date', 'Postcode_Clean', 'Property_ID']
+PPD_UPDATE_FILE = 'pp-monthly-update.csv'
+
+# Uprating factors come from the constituency median series (inflation.py),
+# or with --price-index repeat-sales from an index fitted to the repeat sales
+# in the Price Paid history (repeat_sales.py). That is fitted to the whole
+# file at once and cached until the file changes. Each uprates to its own
+# latest quarter: the median series' last priced quarter, or the last quarter
+# of sales in the Price Paid file, which is usually later.
+PRICE_INDEXES = ['median', 'repeat-sales']
+
+# As-of mode: the estimate as it stood at each year-end from --as-of onwards,
+# one row per (cutoff, constituency)
+AS_OF_FIRST_YEAR = 2010
+AS_OF_OUTPUT_FILE = 'constituency_sales_by_bracket_as_of.csv'
+
+# With --bootstrap, the constituency CSV gains these percentiles of the
+# Mansion Tax Estimate over resampled properties
+BOOTSTRAP_PERCENTILES = [5, 50, 95]
+
+# Streaming mode: rows are hash-partitioned by clean postcode and spilled to disk,
+# so every batch-sale group and every Property_ID lives in exactly one partition.
+STREAM_PARTITIONS = 32
+STREAM_SPILL_DIR = 'ppd_stream_spill'
+# With --workers, the CSV is parsed in byte ranges of about this size
+PPD_RANGE_BYTES = 128 * 1024 * 1024
+
+# --sample: the pipeline runs on a fixture drawn from the Price Paid file and
+# cached in SAMPLE_DIR. Every postcode with a sale at or above the keep price
+# is kept whole, and a seeded fraction of the other postcodes. The default
+# keep price is half the first threshold, so older sales that have since
+# doubled are kept too. A sample run writes its outputs (and its per-property
+# prices and repeat-sales index) to a directory beside the fixture, never
+# over the full run's.
+SAMPLE_DIR = 'ppd_sample'
+SAMPLE_VERSION = 1
+SAMPLE_FRACTION = 0.02
+SAMPLE_KEEP_PRICE = 1_000_000
+
+# ==========================================
+# INFLATION FACTORS
+# ==========================================
+def load_repeat_sales_index(use_cache=True, rebuild_cache=False, ppd_file=PPD_FILES[0], out_dir=''):
+    """
+    The repeat-sales index, from the .npz cache when it was fitted to the
+    current Price Paid file (same size and mtime), otherwise fitted to the
+    batch-sale corrected history and cached (in out_dir).
+    """
+    print("Loading repeat-sales price index...")
+    cache_file = os.path.join(out_dir, REPEAT_SALES_CACHE_FILE)
+    fingerprint = json.dumps(repeat_sales_cache_fingerprint(ppd_file), sort_keys=True)
+    index = load_repeat_sales_cache(cache_file, fingerprint)
+    if index is not None:
+        print(f"  > Using cached index from {cache_file}")
+        return index
+
+    df_ppd, _ = fix_batch_sales(load_clean_ppd(ppd_file, use_cache, rebuild_cache))
+    index = build_repeat_sales_index(
+        df_ppd['Postcode_Clean'], df_ppd['Property_ID'].to_numpy(), df_ppd['Date'].to_numpy(), df_ppd['Price'].to_numpy()
+    )
+    print(f"  > Fitted to {index['pairs']:,} repeat-sale pairs in {len(index['regions'])} regions")
+    save_repeat_sales_cache(cache_file, index, fingerprint)
+    return index
 
 def load_constituency_lookup():
     """
     Returns a Series mapping constituency codes to their names.
     """
-    df_lookup = pd.read_excel(
-        CTSOP_FILE,
-        sheet_name=CTSOP_SHEET,
-        usecols='C:D',
-        skiprows=CTSOP_SKIPROWS,
-        header=None,
-        names=['pcon', 'Constituency Name']
-    )
+    df_lookup = read_reference_sheet(CTSOP_XLSX, CTSOP_SHEET).iloc[CTSOP_TOTAL_ROWS:, [2, 3]]  # columns C:D
+    df_lookup.columns = ['pcon', 'Constituency Name']
     df_lookup.dropna(subset=['pcon'], inplace=True)
     df_lookup['pcon'] = df_lookup['pcon'].astype(str).str.strip()
     df_lookup['Constituency Name'] = df_lookup['Constituency Name'].astype(str).str.strip()
     df_lookup.drop_duplicates(subset=['pcon'], inplace=True)
     return df_lookup.set_index('pcon')['Constituency Name']
 
-def main():
+def read_ppd_chunks(ppd_file, chunksize=PPD_CHUNKSIZE):
+    """
+    Yields Price Paid chunks with parsed dates. Rows with unparseable dates and
+    'Other' property types are removed.
+    """
+    reader = pd.read_csv(
+        ppd_file, header=None,
+        usecols=PPD_USECOLS,
+        names=PPD_NAMES,
+        dtype=PPD_DTYPES,
+        chunksize=chunksize, encoding='latin1'
+    )
+    for chunk in reader:
+        chunk['Date'] = pd.to_datetime(chunk['Date'], errors='coerce')
+        chunk = chunk[chunk['PropertyType'] != 'O'] # Simple filter
+        yield chunk.dropna(subset=['Date'])
+
+def add_clean_keys(df):
+    """
+    Adds the cleaned postcode used for batch detection, the Property_ID key used
+    for deduplication and a key for the transaction ID (used to match
+    change/delete records), dropping the raw columns they replace.
+
+    Property_ID and TransactionKey are 64-bit hashes rather than strings: at
+    ~30M rows the chance of any collision is around one in 50,000.
+    """
+    df = df.copy()
+    df['Postcode_Clean'] = clean_addr_col(df['Postcode'])
+    address_parts = pd.DataFrame({
+        'postcode': df['Postcode_Clean'],
+        'paon': clean_addr_col(df['PAON']),
+        'saon': clean_addr_col(df['SAON']),
+    })
+    df['Property_ID'] = pd.util.hash_pandas_object(address_parts, index=False).to_numpy()
+    df['TransactionKey'] = pd.util.hash_array(df['TransactionID'].to_numpy(dtype=object))
+    return df.drop(columns=['TransactionID', 'Postcode', 'PAON', 'SAON'])
+
+# ==========================================
+# CLEANED PRICE PAID CACHE
+# ==========================================
+def file_sha256(path, block_size=16 * 1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def ppd_cache_paths(ppd_file):
+    """
+    The cache for a source file is a directory of Arrow fragments (one per
+    parsing task, read back in order) plus a JSON file describing the source.
+    """
+    stem = os.path.splitext(os.path.basename(ppd_file))[0]
+    data_dir = os.path.join(PPD_CACHE_DIR, stem)
+    return data_dir, data_dir + '.json'
+
+def ppd_cache_fragment(data_dir, fragment_id):
+    return os.path.join(data_dir, f'{fragment_id:05d}.arrows')
+
+def ppd_cache_is_valid(ppd_file):
+    """
+    True if the cache was built from this exact source file by this version of
+    the cleaning code. Size and mtime are checked first; if only the mtime has
+    changed (e.g. the file was re-downloaded) the content hash decides.
+    """
+    data_dir, meta_path = ppd_cache_paths(ppd_file)
+    if not (os.path.isdir(data_dir) and os.path.exists(meta_path)):
+        return False
+    with open(meta_path, encoding='utf-8') as f:
+        meta = json.load(f)
+    stat = os.stat(ppd_file)
+    if meta.get('version') != PPD_CACHE_VERSION or meta.get('size') != stat.st_size:
+        return False
+    if meta.get('mtime_ns') == stat.st_mtime_ns:
+        return True
+    if meta.get('sha256') != file_sha256(ppd_file):
+        return False
+    meta['mtime_ns'] = stat.st_mtime_ns
+    with open(meta_path, 'w', encoding='utf-8') as f:
+        json.dump(meta, f, indent=2)
+    return True
+
+def finalize_ppd_cache(ppd_file, tmp_dir):
+    """
+    Moves a fully written set of fragments into place and records the source
+    file fingerprint.
+    """
+    data_dir, meta_path = ppd_cache_paths(ppd_file)
+    stat = os.stat(ppd_file)
+    meta = {
+        'version': PPD_CACHE_VERSION,
+        'source': os.path.basename(ppd_file),
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'sha256': file_sha256(ppd_file),
+        'fragments': sorted(os.listdir(tmp_dir)),
+    }
+    shutil.rmtree(data_dir, ignore_errors=True)
+    os.replace(tmp_dir, data_dir)
+    with open(meta_path, 'w', encoding='utf-8') as f:
+        json.dump(meta, f, indent=2)
+    print(f"  > Cached cleaned data to {data_dir}/")
+
+def new_cache_tmp_dir(ppd_file):
+    data_dir, _ = ppd_cache_paths(ppd_file)
+    tmp_dir = data_dir + '.tmp'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    return tmp_dir
+
+def cache_fragment_paths(ppd_file):
+    data_dir, meta_path = ppd_cache_paths(ppd_file)
+    with open(meta_path, encoding='utf-8') as f:
+        fragments = json.load(f)['fragments']
+    return [os.path.join(data_dir, name) for name in fragments]
+
+def ppd_chunk_to_arrow(chunk):
+    table = pa.Table.from_pandas(chunk, preserve_index=False)
+    for name in PPD_CACHE_DICT_COLUMNS:
+        i = table.schema.get_field_index(name)
+        table = table.set_column(i, name, table.column(name).dictionary_encode())
+    return table
+
+def read_ppd_cache(ppd_file, decode_strings=False):
+    """
+    Yields cleaned chunks from the memory-mapped cache, one per record batch.
+    String columns arrive as pandas categoricals unless decode_strings is set.
+    """
+    for path in cache_fragment_paths(ppd_file):
+        with pa.memory_map(path, 'r') as source:
+            for batch in pa.ipc.open_stream(source):
+                if decode_strings:
+                    batch = pa.RecordBatch.from_arrays(
+                        [col.dictionary_decode() if pa.types.is_dictionary(col.type) else col for col in batch.columns],
+                        names=batch.schema.names
+                    )
+                yield batch.to_pandas()
+
+def iter_clean_ppd(ppd_file, use_cache=True, rebuild_cache=False, decode_strings=False):
+    """
+    Yields cleaned Price Paid chunks (PPD_CLEAN_COLUMNS), from the cache when it
+    is valid. Otherwise the CSV is parsed and, if pyarrow is available, the
+    cache is written alongside so the next run can skip parsing and cleaning.
+    """
+    if use_cache and pa is None:
+        print("  > pyarrow is not installed; the cleaned Price Paid cache is disabled.")
+        use_cache = False
+
+    if use_cache and not rebuild_cache and ppd_cache_is_valid(ppd_file):
+        print(f"  > Using cached cleaned data for {ppd_file}")
+        yield from tqdm(read_ppd_cache(ppd_file, decode_strings), desc="Reading cache", unit=" chunks")
+        return
+
+    if not use_cache:
+        for chunk in tqdm(read_ppd_chunks(ppd_file), desc="Reading CSV", unit=" chunks"):
+            yield add_clean_keys(chunk)
+        return
+
+    os.makedirs(PPD_CACHE_DIR, exist_ok=True)
+    tmp_dir = new_cache_tmp_dir(ppd_file)
+    writer = None
+    try:
+        for chunk in tqdm(read_ppd_chunks(ppd_file), desc="Reading CSV", unit=" chunks"):
+            chunk = add_clean_keys(chunk)
+            table = ppd_chunk_to_arrow(chunk)
+            if writer is None:
+                writer = pa.ipc.new_stream(ppd_cache_fragment(tmp_dir, 0), table.schema)
+            writer.write_table(table)
+            yield chunk
+        if writer is not None:
+            writer.close()
+            writer = None
+            finalize_ppd_cache(ppd_file, tmp_dir)
+    finally:
+        if writer is not None:
+            writer.close()
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+def load_clean_ppd(ppd_file, use_cache=True, rebuild_cache=False):
+    """
+    The whole cleaned Price Paid file as one frame. A valid cache is read in a
+    single memory-mapped pass, keeping its dictionary columns as categoricals.
+    """
+    if use_cache and pa is not None and not rebuild_cache and ppd_cache_is_valid(ppd_file):
+        print(f"  > Using cached cleaned data for {ppd_file}")
+        tables = []
+        for path in cache_fragment_paths(ppd_file):
+            with pa.memory_map(path, 'r') as source:
+                tables.append(pa.ipc.open_stream(source).read_all())
+        return pa.concat_tables(tables).to_pandas()
+    frames = list(iter_clean_ppd(ppd_file, use_cache, rebuild_cache))
+    return pd.concat(frames, ignore_index=True)
+
+def fix_batch_sales(df):
+    """
+    Portfolio/batch sales are recorded as one row per property, each carrying
+    the whole portfolio price. Rows sharing postcode, date and price are treated
+    as one batch and the price is split evenly between them.
+
+    Returns the corrected frame and a dict of stats for reporting.
+    """
+    # Group by: Postcode, Date, Price
+    # This identifies rows that look suspicious (Same location, same day, same price)
+    group_cols = ['Postcode_Clean', 'Date', 'Price']
+
+    # Calculate how many transactions share these details
+    batch_count = df.groupby(group_cols, observed=True)['Price'].transform('count')
+
+    # Identify rows that need fixing (count > 1)
+    mask_batch = batch_count > 1
+
+    df['Price'] = df['Price'].astype('float64')
+    stats = {
+        'affected_rows': int(mask_batch.sum()),
+        'original_value': float(df.loc[mask_batch, 'Price'].sum()),
+    }
+
+    # APPLY THE FIX: Divide Price by the Count
+    df.loc[mask_batch, 'Price'] = df.loc[mask_batch, 'Price'] / batch_count[mask_batch]
+
+    stats['fixed_value'] = float(df.loc[mask_batch, 'Price'].sum())
+    return df, stats
+
+def report_batch_stats(stats):
+    original_value_sum = stats['original_value']
+    fixed_value_sum = stats['fixed_value']
+    print(f"  > Found {stats['affected_rows']:,} transactions that were part of batch sales.")
+    print(f"  > Corrected total value from £{original_value_sum/1e9:.2f}bn to £{fixed_value_sum/1e9:.2f}bn.")
+    print(f"  > (Removed £{(original_value_sum - fixed_value_sum)/1e9:.2f}bn of phantom value)")
+
+def deduplicate_transactions(df):
+    """
+    Keeps the most recent transaction for each property.
+
+    Returns the deduplicated frame and a Series of rejected (older) transaction
+    counts per clean postcode.
+    """
+    # Row position of each property's latest sale. idxmax returns the first
+    # maximum, so a property sold twice on its latest date keeps the first
+    # row in file order.
+    dates = pd.Series(df['Date'].to_numpy())
+    latest = dates.groupby(df['Property_ID'].to_numpy(), sort=False).idxmax().to_numpy()
+    df_unique = df.iloc[latest]
+
+    pc_codes, pc_uniques = pd.factorize(df['Postcode_Clean'])
+    pre_dedupe_counts = np.bincount(pc_codes, minlength=len(pc_uniques))
+    post_dedupe_counts = np.bincount(pc_codes[latest], minlength=len(pc_uniques))
+    rejected_counts = pd.Series(pre_dedupe_counts - post_dedupe_counts, index=pc_uniques)
+    return df_unique, rejected_counts
+
+def load_nspl():
+    """
+    The memory-mapped NSPL postcode index, built on first use.
+    """
+    return load_nspl_index(NSPL_FILE)
+
+def merge_and_uprate(df_ppd, nspl_index, inflation):
+    """
+    Attaches constituency/location from the NSPL index and uprates each price
+    to the latest quarter using the constituency median price series.
+    """
+    positions = postcode_positions(nspl_index, df_ppd['Postcode_Clean'])
+    nspl_cols = lookup_postcodes(nspl_index, np.maximum(positions, 0))
+    # Rows with no NSPL match, or no constituency, are dropped
+    keep = (positions >= 0) & pd.notna(nspl_cols['pcon'])
+    merged_df = df_ppd[keep].reset_index(drop=True)
+    for name, values in nspl_cols.items():
+        merged_df[name] = values[keep]
+    # Columns read from the cache are categoricals; the tables below group on
+    # plain strings so they come out sorted by postcode
+    for col in merged_df.select_dtypes('category').columns:
+        merged_df[col] = merged_df[col].astype(object)
+
+    # UPRATE
+    merged_df['inflation_factor'] = uprating_factors(
+        inflation, merged_df['pcon'], merged_df['Postcode_Clean'], merged_df['Date'], merged_df['Price']
+    )
+    merged_df['Uprated_Price'] = merged_df['Price'] * merged_df['inflation_factor']
+    return merged_df
+
+def categorize_prices(merged_df):
+    merged_df['Price_Bracket'] = pd.cut(merged_df['Uprated_Price'], bins=BRACKETS, labels=LABELS, right=False)
+    return merged_df
+
+def count_by_constituency(merged_df):
+    """
+    Bracket counts per constituency, with a column for every bracket label.
+    Partial counts from separate partitions can simply be added together.
+    """
+    counts = merged_df.groupby(['pcon', 'Price_Bracket'], observed=False).size().unstack(fill_value=0)
+    return counts.reindex(columns=LABELS, fill_value=0)
+
+def build_constituency_table(counts, constituency_lookup):
+    # Match pd.crosstab, which omits brackets nobody falls into
+    bracket_cols = [label for label in LABELS if counts[label].sum() > 0]
+    constituency_table = counts[bracket_cols].copy()
+    constituency_table.columns.name = 'Price_Bracket'
+    constituency_table['Total Sales'] = constituency_table.sum(axis=1)
+
+    if '£5m+' in constituency_table.columns:
+        constituency_table.sort_values(by='£5m+', ascending=False, inplace=True)
+
+    # Append metadata columns without disturbing existing brackets/total ordering
+    constituency_table['Constituency Name'] = constituency_table.index.map(constituency_lookup)
+
+    def get_bracket_counts(label):
+        return constituency_table[label] if label in constituency_table.columns else pd.Series(0, index=constituency_table.index)
+
+    constituency_table['Mansion Tax Estimate'] = sum(
+        get_bracket_counts(label) * charge for label, charge in zip(LABELS[1:], DEFAULT_CHARGES)
+    )
+    return constituency_table
+
+def build_postcode_table(merged_df, rejected_counts):
+    postcode_table = pd.crosstab(merged_df['Postcode_Clean'], merged_df['Price_Bracket'])
+    postcode_table['Total Sales'] = postcode_table.sum(axis=1)
+    for label in LABELS:
+        if label not in postcode_table.columns:
+            postcode_table[label] = 0
+    postcode_table = postcode_table[LABELS + ['Total Sales']]
+
+    postcode_meta = merged_df.groupby('Postcode_Clean').agg(
+        postcode_label=('pcds', 'first'),
+        lat=('lat', 'first'),
+        long=('long', 'first'),
+        pcon=('pcon', 'first')
+    )
+    postcode_table = postcode_table.join(postcode_meta, how='left')
+    postcode_table.reset_index(inplace=True)
+    postcode_table.rename(columns={'Postcode_Clean': 'postcode_clean'}, inplace=True)
+    postcode_table['rejected_multiple_transactions'] = (
+        postcode_table['postcode_clean'].map(rejected_counts).fillna(0).astype(int)
+    )
+    postcode_table['postcode_label'] = postcode_table['postcode_label'].fillna(postcode_table['postcode_clean'])
+    postcode_table['lat'] = pd.to_numeric(postcode_table['lat'], errors='coerce')
+    postcode_table['long'] = pd.to_numeric(postcode_table['long'], errors='coerce')
+
+    return postcode_table[POSTCODE_CSV_COLUMNS]
+
+def export_tables(constituency_table, postcode_table, out_dir=''):
+    output_file = os.path.join(out_dir, OUTPUT_FILE)
+    constituency_table.to_csv(output_file)
+    print(f"\nSaved to {output_file}")
+    print("Top 5 Constituencies by £5m+ Sales:")
+    print(constituency_table.head(5))
+    postcode_output_file = os.path.join(out_dir, POSTCODE_OUTPUT_FILE)
+    postcode_table[POSTCODE_CSV_COLUMNS].to_csv(postcode_output_file, index=False)
+    print(f"\nSaved to {postcode_output_file} with {len(postcode_table):,} postcodes.")
+    cube = build_sales_cube(postcode_table, LABELS, DEFAULT_CHARGES)
+    sales_cube_file = os.path.join(out_dir, SALES_CUBE_FILE)
+    write_columns(sales_cube_file, cube, cube_column_types(LABELS))
+    print(f"Saved to {sales_cube_file} with {len(cube):,} rows.")
+
+def add_bootstrap_intervals(replicates, method, seed, workers, out_dir=''):
+    """
+    Resamples the per-property uprated prices the run just cached and adds
+    percentile columns of the Mansion Tax Estimate to the constituency CSV.
+    """
+    print(f"\nBootstrapping the Mansion Tax Estimate ({replicates:,} {method} replicates)...")
+    prices = load_uprated_prices(os.path.join(out_dir, UPRATED_PRICES_DIR))
+    samples = bootstrap_revenue(prices, DEFAULT_SCENARIO, replicates, method, seed, workers)
+    intervals = revenue_percentiles(samples, BOOTSTRAP_PERCENTILES)
+    output_file = os.path.join(out_dir, OUTPUT_FILE)
+    constituency_table = pd.read_csv(output_file, index_col=0)
+    # Whole pounds, like the estimate itself (counts times whole-pound charges)
+    for column in intervals.columns:
+        interval = intervals[column].reindex(constituency_table.index).round().astype('Int64')
+        constituency_table[f'Mansion Tax Estimate {column}'] = interval
+    constituency_table.to_csv(output_file)
+    totals = np.percentile(samples.sum(axis=1), BOOTSTRAP_PERCENTILES)
+    print("  > National total: " + ", ".join(f"p{p} £{t / 1e6:,.1f}m" for p, t in zip(BOOTSTRAP_PERCENTILES, totals)))
+    print(f"  > Added {', '.join(intervals.columns)} columns to {output_file}")
+    return len(constituency_table)
+
+def load_reference_data(price_index='median', use_cache=True, rebuild_cache=False, ppd_file=PPD_FILES[0],
+                        out_dir=''):
+    """
+    Returns (inflation factors, constituency_lookup). With the repeat-sales
+    price index, the factors also hold it (as 'repeat_sales'), and
+    merge_and_uprate uprates with it.
+    """
+    inflation = load_inflation_factors()
+    if price_index == 'repeat-sales':
+        inflation['repeat_sales'] = load_repeat_sales_index(use_cache, rebuild_cache, ppd_file, out_dir)
+        target, medians = last_index_quarter(inflation['repeat_sales']), latest_priced_quarter(inflation)
+        print(f"  > Uprating to {target // 4} Q{target % 4 + 1}, the last quarter of Price Paid sales"
+              + ("" if medians is None or medians == target else
+                 f" (the median series ends in {medians // 4} Q{medians % 4 + 1})"))
+    try:
+        constituency_lookup = load_constituency_lookup()
+    except FileNotFoundError:
+        print(f"Warning: Could not find {CTSOP_XLSX}. Constituency names will be left blank.")
+        constituency_lookup = pd.Series(dtype='object')
+    return inflation, constituency_lookup
+
+# ==========================================
+# STREAMING MODE
+# ==========================================
+def postcode_partition(postcodes, n_partitions):
+    """
+    Stable partition number for each clean postcode.
+    """
+    hashes = pd.util.hash_array(postcodes.to_numpy(dtype=object))
+    return hashes % np.uint64(n_partitions)
+
+def spill_path(spill_dir, partition, source_id):
+    return os.path.join(spill_dir, f'part_{partition:03d}_{source_id:05d}.pkl')
+
+def spill_chunk(chunk, handles, spill_dir, n_partitions, source_id=0):
+    """
+    Appends a cleaned chunk's rows to per-partition pickle streams, opening each
+    partition's file for this source on first use.
+    """
+    chunk = chunk.drop(columns=['PropertyType'])
+    part = postcode_partition(chunk['Postcode_Clean'], n_partitions)
+    for p, part_df in chunk.groupby(part, sort=False):
+        p = int(p)
+        if p not in handles:
+            handles[p] = open(spill_path(spill_dir, p, source_id), 'wb')
+        pickle.dump(part_df, handles[p], protocol=pickle.HIGHEST_PROTOCOL)
+
+def spill_partitions(ppd_file, spill_dir, n_partitions, use_cache=True, rebuild_cache=False):
+    """
+    Single pass over the cleaned Price Paid data, appending each chunk's rows
+    to one pickle stream per postcode partition. Returns the spill files for
+    each partition and the number of rows kept.
+    """
+    os.makedirs(spill_dir, exist_ok=True)
+    handles = {}
+    rows = 0
+    try:
+        for chunk in iter_clean_ppd(ppd_file, use_cache, rebuild_cache, decode_strings=True):
+            rows += len(chunk)
+            spill_chunk(chunk, handles, spill_dir, n_partitions)
+    finally:
+        for handle in handles.values():
+            handle.close()
+    paths = [[spill_path(spill_dir, p, 0)] if p in handles else [] for p in range(n_partitions)]
+    return paths, rows
+
+def ppd_byte_ranges(ppd_file, range_bytes=PPD_RANGE_BYTES):
+    """
+    Splits the CSV into (start, stop) byte ranges that begin and end on line
+    boundaries, for parsing in parallel.
+    """
+    size = os.path.getsize(ppd_file)
+    bounds = [0]
+    with open(ppd_file, 'rb') as f:
+        while bounds[-1] < size:
+            f.seek(bounds[-1] + range_bytes)
+            f.readline()
+            bounds.append(min(f.tell(), size))
+    return list(zip(bounds[:-1], bounds[1:]))
+
+def spill_byte_range(task):
+    """
+    Process-pool task: parses and cleans one byte range of the Price Paid CSV,
+    writes it as a cache fragment if asked, and spills its rows by postcode
+    partition. Returns (rows kept, partitions written).
+    """
+    ppd_file, range_id, start, stop, spill_dir, n_partitions, cache_dir = task
+    with open(ppd_file, 'rb') as f:
+        f.seek(start)
+        data = io.BytesIO(f.read(stop - start))
+    handles = {}
+    writer = None
+    rows = 0
+    try:
+        for chunk in read_ppd_chunks(data):
+            chunk = add_clean_keys(chunk)
+            if cache_dir is not None:
+                table = ppd_chunk_to_arrow(chunk)
+                if writer is None:
+                    writer = pa.ipc.new_stream(ppd_cache_fragment(cache_dir, range_id), table.schema)
+                writer.write_table(table)
+            rows += len(chunk)
+            spill_chunk(chunk, handles, spill_dir, n_partitions, range_id)
+    finally:
+        if writer is not None:
+            writer.close()
+        for handle in handles.values():
+            handle.close()
+    return rows, sorted(handles)
+
+def spill_partitions_parallel(ppd_file, spill_dir, n_partitions, workers, use_cache=True):
+    """
+    Parallel version of spill_partitions for when the CSV has to be parsed:
+    byte ranges are parsed and cleaned in a process pool. Each partition's
+    spill files are listed in range order, so rows stay in file order.
+    """
+    os.makedirs(spill_dir, exist_ok=True)
+    ranges = ppd_byte_ranges(ppd_file)
+    cache_dir = None
+    if use_cache and pa is not None:
+        os.makedirs(PPD_CACHE_DIR, exist_ok=True)
+        cache_dir = new_cache_tmp_dir(ppd_file)
+    tasks = [
+        (ppd_file, range_id, start, stop, spill_dir, n_partitions, cache_dir)
+        for range_id, (start, stop) in enumerate(ranges)
+    ]
+    paths = [[] for _ in range(n_partitions)]
+    rows = 0
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = executor.map(spill_byte_range, tasks)
+            for range_id, (range_rows, written) in enumerate(
+                tqdm(results, total=len(tasks), desc="Reading CSV", unit=" ranges")
+            ):
+                rows += range_rows
+                for p in written:
+                    paths[p].append(spill_path(spill_dir, p, range_id))
+        if cache_dir is not None:
+            finalize_ppd_cache(ppd_file, cache_dir)
+    finally:
+        if cache_dir is not None:
+            shutil.rmtree(cache_dir, ignore_errors=True)
+    return paths, rows
+
+def read_spilled_partition(paths):
+    frames = []
+    for path in paths:
+        with open(path, 'rb') as handle:
+            while True:
+                try:
+                    frames.append(pickle.load(handle))
+                except EOFError:
+                    break
+    if not frames:
+        return None
+    return pd.concat(frames, ignore_index=True)
+
+def process_partition(df_part, nspl_index, inflation, prices_part=None, replaces=None,
+                      prices_dir=UPRATED_PRICES_DIR):
+    """
+    Runs batch-sale fixing, deduplication, uprating and aggregation on one
+    postcode partition. Returns (constituency counts, postcode table,
+    batch stats, unique property count). With prices_part, the uprated
+    prices are also written as that part of the per-property price cache
+    in prices_dir.
+    """
+    df_part, batch_stats = fix_batch_sales(df_part)
+    df_unique, rejected_counts = deduplicate_transactions(df_part)
+    merged_df = merge_and_uprate(df_unique, nspl_index, inflation)
+    if prices_part is not None:
+        write_uprated_prices(merged_df, prices_part, prices_dir, replaces=replaces)
+    merged_df = categorize_prices(merged_df)
+    counts = count_by_constituency(merged_df)
+    postcode_table = build_postcode_table(merged_df, rejected_counts) if len(merged_df) else None
+    return counts, postcode_table, batch_stats, len(df_unique)
+
+def process_spilled_partition(task, inflation):
+    """
+    Process-pool task: loads one partition's spill files and runs
+    process_partition on it, first writing it as an incremental-state segment
+    when build_state is set. Returns None for an empty partition, otherwise
+    process_partition's results plus the segment's postcode index.
+    """
+    paths, partition, build_state, prices_dir = task
+    df_part = read_spilled_partition(paths)
+    if df_part is None:
+        return None
+    state_index = None
+    if build_state:
+        df_part = df_part.sort_values('Postcode_Clean', kind='stable', ignore_index=True)
+        state_index = write_state_segment(df_part, partition)
+    return process_partition(df_part, load_nspl(), inflation, prices_part=partition,
+                             prices_dir=prices_dir) + (state_index,)
+
+def run_streaming(report, n_partitions, use_cache=True, rebuild_cache=False, build_state=False, workers=1,
+                  price_index='median', ppd_file=PPD_FILES[0], out_dir=''):
+    """
+    Bounded-memory equivalent of the default pipeline: only one postcode
+    partition (plus the memory-mapped NSPL index and the inflation factor
+    matrix) is held in memory per process at a time. With workers > 1, CSV
+    parsing and partition processing run in a process pool. With build_state,
+    each partition is also persisted as a segment of the incremental-update
+    state. The repeat-sales price index, if used, is fitted to the whole file
+    in memory when it is not already cached. Returns True once the outputs
+    are written.
+    """
+    steps = [
+        "Loading Inflation Data",
+        "Loading NSPL Data",
+        "Partitioning Price Paid Data",
+        "Processing Partitions",
+        "Aggregating Data",
+        "Exporting CSV"
+    ]
+
+    with tqdm(total=len(steps), desc="Overall Progress") as pbar:
+        with report.stage(steps[0], pbar) as stage:
+            inflation, constituency_lookup = load_reference_data(price_index, use_cache, rebuild_cache, ppd_file, out_dir)
+            stage['rows_out'] = len(inflation['pcons'])
+            stage['price_index'] = price_index
+
+        with report.stage(steps[1], pbar) as stage:
+            print(f"\nLoading NSPL...")
+            stage['rows_out'] = len(load_nspl()['postcode'])
+            print(f"  > Peak RSS: {peak_rss_text()}")
+
+        with report.stage(steps[2], pbar) as stage:
+            print(f"\nPartitioning Price Paid Data into {n_partitions} postcode partitions...")
+            cache_ready = use_cache and pa is not None and not rebuild_cache and ppd_cache_is_valid(ppd_file)
+            try:
+                if workers > 1 and not cache_ready:
+                    paths, rows = spill_partitions_parallel(ppd_file, STREAM_SPILL_DIR, n_partitions, workers, use_cache)
+                else:
+                    paths, rows = spill_partitions(ppd_file, STREAM_SPILL_DIR, n_partitions, use_cache, rebuild_cache)
+            except FileNotFoundError:
+                print(f"Error: Could not find {ppd_file}")
+                shutil.rmtree(STREAM_SPILL_DIR, ignore_errors=True)
+                stage['status'] = f"failed: {ppd_file} not found"
+                return
+            stage['rows_out'] = rows
+            print(f"  > Spilled {rows:,} transactions to {STREAM_SPILL_DIR}/")
+            print(f"  > Peak RSS: {peak_rss_text()}")
+
+        with report.stage(steps[3], pbar) as stage:
+            count_frames = []
+            postcode_frames = []
+            index_frames = []
+            batch_totals = {'affected_rows': 0, 'original_value': 0.0, 'fixed_value': 0.0}
+            unique_properties = 0
+            if build_state:
+                reset_state_dir()
+            prices_dir = os.path.join(out_dir, UPRATED_PRICES_DIR)
+            reset_uprated_prices(prices_dir)
+            price_parts = []
+            tasks = [(paths[p], p, build_state, prices_dir) for p in range(n_partitions)]
+            task_fn = partial(
+                process_spilled_partition,
+                inflation=inflation
+            )
+            executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+            try:
+                results = executor.map(task_fn, tasks) if executor else map(task_fn, tasks)
+                results = tqdm(results, total=len(tasks), desc="Partitions", unit=" parts")
+                for (_, partition, _, _), result in zip(tasks, results):
+                    if result is None:
+                        continue
+                    price_parts.append(partition)
+                    counts, postcode_part, batch_stats, n_unique, state_index = result
+                    count_frames.append(counts)
+                    if postcode_part is not None:
+                        postcode_frames.append(postcode_part)
+                    if state_index is not None:
+                        index_frames.append(state_index)
+                    for key in batch_totals:
+                        batch_totals[key] += batch_stats[key]
+                    unique_properties += n_unique
+            finally:
+                if executor:
+                    executor.shutdown()
+                shutil.rmtree(STREAM_SPILL_DIR, ignore_errors=True)
+
+            print("\nChecking for Portfolio/Batch sale anomalies...")
+            report_batch_stats(batch_totals)
+            print(f"  > Kept {unique_properties:,} unique properties.")
+            stage['rows_in'] = rows
+            stage['rows_out'] = unique_properties
+            print(f"  > Peak RSS: {peak_rss_text()}")
+            if workers > 1:
+                print(f"  > Peak RSS of largest worker: {peak_rss_text(children=True)}")
+
+        with report.stage(steps[4], pbar) as stage:
+            counts = pd.concat(count_frames).groupby(level=0).sum()
+            constituency_table = build_constituency_table(counts, constituency_lookup)
+            postcode_table = pd.concat(postcode_frames, ignore_index=True)
+            postcode_table = postcode_table.sort_values('postcode_clean', kind='stable', ignore_index=True)
+            finalize_uprated_prices(price_parts, prices_dir)
+            if build_state:
+                save_state(pd.concat(index_frames).sort_index(), postcode_table, counts, n_partitions, updates=[],
+                           price_index=price_index)
+                print(f"  > Incremental state written to {PPD_STATE_DIR}/")
+            stage['rows_in'] = unique_properties
+            stage['rows_out'] = len(postcode_table)
+
+        with report.stage(steps[5], pbar) as stage:
+            export_tables(constituency_table, postcode_table, out_dir)
+            stage['rows_out'] = len(constituency_table) + len(postcode_table)
+            print(f"  > Peak RSS: {peak_rss_text()}")
+    return True
+
+# ==========================================
+# INCREMENTAL MONTHLY UPDATES
+# ==========================================
+def state_path(name):
+    return os.path.join(PPD_STATE_DIR, name)
+
+def segment_path(segment_id):
+    return state_path(f'segment_{segment_id:05d}.arrow')
+
+def reference_fingerprints():
+    """
+    Size/mtime of the reference files the stored results depend on. If any of
+    these change the state must be rebuilt from scratch.
+    """
+    fingerprints = {}
+    for path in [NSPL_FILE, HOUSE_PRICE_XLSX]:
+        stat = os.stat(path)
+        fingerprints[path] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+    return fingerprints
+
+def reset_state_dir():
+    if pa is None:
+        raise RuntimeError("pyarrow is required to build the incremental state.")
+    shutil.rmtree(PPD_STATE_DIR, ignore_errors=True)
+    os.makedirs(PPD_STATE_DIR)
+
+def write_state_segment(df, segment_id):
+    """
+    Writes transactions (already sorted by clean postcode) as one Arrow segment
+    and returns its index: clean postcode -> (segment, start row, stop row).
+    """
+    table = pa.Table.from_pandas(df[PPD_STATE_COLUMNS], preserve_index=False)
+    with pa.OSFile(segment_path(segment_id), 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+
+    postcodes = df['Postcode_Clean'].to_numpy(dtype=object)
+    boundaries = np.flatnonzero(postcodes[1:] != postcodes[:-1]) + 1
+    starts = np.concatenate([[0], boundaries]).astype('int64')
+    stops = np.concatenate([boundaries, [len(postcodes)]]).astype('int64')
+    return pd.DataFrame(
+        {'segment': segment_id, 'start': starts, 'stop': stops},
+        index=pd.Index(postcodes[starts], name='Postcode_Clean')
+    )
+
+def save_state(postcode_index, postcode_table, counts, next_segment, updates, price_index='median'):
+    postcode_index.to_pickle(state_path('postcode_index.pkl'))
+    postcode_table.to_pickle(state_path('postcode_results.pkl'))
+    counts.to_pickle(state_path('constituency_counts.pkl'))
+    meta = {
+        'version': PPD_STATE_VERSION,
+        'next_segment': next_segment,
+        'references': reference_fingerprints(),
+        'price_index': price_index,
+        'updates': updates,
+    }
+    with open(state_path('state.json'), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, indent=2)
+
+def load_state():
+    meta_file = state_path('state.json')
+    if not os.path.exists(meta_file):
+        raise RuntimeError(
+            f"No incremental state in {PPD_STATE_DIR}/. Run a full build with --build-state first."
+        )
+    with open(meta_file, encoding='utf-8') as f:
+        meta = json.load(f)
+    if meta.get('version') != PPD_STATE_VERSION:
+        raise RuntimeError("Incremental state was written by an older version. Rebuild it with --build-state.")
+    if meta.get('references') != reference_fingerprints():
+        raise RuntimeError(
+            f"{NSPL_FILE} or {HOUSE_PRICE_XLSX} has changed since the state was built, "
+            "so every postcode needs recomputing. Rebuild it with --build-state."
+        )
+    postcode_index = pd.read_pickle(state_path('postcode_index.pkl'))
+    postcode_table = pd.read_pickle(state_path('postcode_results.pkl'))
+    counts = pd.read_pickle(state_path('constituency_counts.pkl'))
+    return meta, postcode_index, postcode_table, counts
+
+def gather_state_rows(postcode_index, postcodes):
+    """
+    All stored transactions for the given clean postcodes, read from the
+    memory-mapped segments by row position.
+    """
+    entries = postcode_index[postcode_index.index.isin(postcodes)]
+    frames = []
+    for segment_id, seg in entries.groupby('segment'):
+        starts = seg['start'].to_numpy()
+        lengths = seg['stop'].to_numpy() - starts
+        # Expand each [start, stop) range into explicit row numbers
+        offsets = np.repeat(starts - np.concatenate([[0], np.cumsum(lengths)[:-1]]), lengths)
+        rows = offsets + np.arange(lengths.sum())
+        with pa.memory_map(segment_path(int(segment_id)), 'r') as source:
+            table = pa.ipc.open_file(source).read_all()
+            frames.append(table.take(pa.array(rows)).to_pandas())
+    if not frames:
+        return pd.DataFrame(columns=PPD_STATE_COLUMNS)
+    return pd.concat(frames, ignore_index=True)
+
+def find_postcodes_for_keys(postcode_index, keys):
+    """
+    Fallback for change/delete records whose stored postcode differs from the
+    one in the update file: scans every live segment for the transaction keys.
+    """
+    found = set()
+    for segment_id in postcode_index['segment'].unique():
+        with pa.memory_map(segment_path(int(segment_id)), 'r') as source:
+            table = pa.ipc.open_file(source).read_all()
+            hit = np.isin(table.column('TransactionKey').to_numpy(), keys)
+            found.update(table.column('Postcode_Clean').filter(pa.array(hit)).to_pylist())
+    # Stale rows in superseded segments may match too; only live postcodes count
+    return found & set(postcode_index.index)
+
+def read_ppd_update(update_file):
+    """
+    Reads and cleans a Land Registry monthly update file, keeping the record
+    status (A = add, C = change, D = delete).
+    """
+    df = pd.read_csv(
+        update_file, header=None,
+        usecols=PPD_USECOLS + [PPD_STATUS_COLUMN],
+        names=PPD_NAMES + ['RecordStatus'],
+        dtype={**PPD_DTYPES, 'RecordStatus': 'str'},
+        encoding='latin1'
+    )
+    df['Date'] = pd.to_datetime(df['Date'], errors='coerce')
+    df['RecordStatus'] = df['RecordStatus'].str.strip().str.upper()
+    return add_clean_keys(df)
+
+def run_incremental(report, update_file):
+    """
+    Applies one monthly update file to the persisted state and rewrites both
+    CSVs. Only postcodes named in the update (or holding a changed/deleted
+    transaction) are recomputed. Returns True once the outputs are written.
+    """
+    steps = [
+        "Loading Incremental State",
+        "Applying Monthly Update",
+        "Loading Inflation Data",
+        "Loading NSPL Data",
+        "Recomputing Touched Postcodes",
+        "Exporting CSV"
+    ]
+
+    with tqdm(total=len(steps), desc="Overall Progress") as pbar:
+        with report.stage(steps[0], pbar) as stage:
+            meta, postcode_index, postcode_table, counts = load_state()
+            update_hash = file_sha256(update_file)
+            if any(u['sha256'] == update_hash for u in meta['updates']):
+                print(f"{update_file} has already been applied; nothing to do.")
+                stage['status'] = "skipped: update already applied"
+                return
+            stage['rows_out'] = len(postcode_table)
+
+        with report.stage(steps[1], pbar) as stage:
+            df_update = read_ppd_update(update_file)
+            status = df_update['RecordStatus']
+            removed_keys = df_update.loc[status.isin(['C', 'D']), 'TransactionKey'].to_numpy()
+            new_rows = df_update[
+                status.isin(['A', 'C'])
+                & (df_update['PropertyType'] != 'O')
+                & df_update['Date'].notna()
+            ]
+
+            touched = set(df_update['Postcode_Clean'])
+            state_rows = gather_state_rows(postcode_index, touched)
+            missing = np.setdiff1d(removed_keys, state_rows['TransactionKey'].to_numpy())
+            if len(missing):
+                extra = find_postcodes_for_keys(postcode_index, missing) - touched
+                if extra:
+                    touched |= extra
+                    state_rows = pd.concat([state_rows, gather_state_rows(postcode_index, extra)], ignore_index=True)
+
+            state_rows = state_rows[~state_rows['TransactionKey'].isin(removed_keys)]
+            updated_rows = pd.concat([state_rows, new_rows[PPD_STATE_COLUMNS]], ignore_index=True)
+            updated_rows = updated_rows.sort_values('Postcode_Clean', kind='stable', ignore_index=True)
+
+            segment_id = meta['next_segment']
+            postcode_index = postcode_index[~postcode_index.index.isin(touched)]
+            if len(updated_rows):
+                postcode_index = pd.concat([postcode_index, write_state_segment(updated_rows, segment_id)]).sort_index()
+            print(f"  > {len(df_update):,} update records touched {len(touched):,} postcodes "
+                  f"({len(updated_rows):,} stored transactions).")
+            stage['rows_in'] = len(df_update)
+            stage['rows_out'] = len(updated_rows)
+
+        with report.stage(steps[2], pbar) as stage:
+            # Touched postcodes are uprated as the rest of the state was
+            price_index = meta.get('price_index', 'median')
+            inflation, constituency_lookup = load_reference_data(price_index)
+            stage['rows_out'] = len(inflation['pcons'])
+            stage['price_index'] = price_index
+
+        with report.stage(steps[3], pbar) as stage:
+            nspl_index = load_nspl()
+            stage['rows_out'] = len(nspl_index['postcode'])
+
+        with report.stage(steps[4], pbar) as stage:
+            # Recomputed postcodes are appended to the per-property price cache
+            # as a part that supersedes their earlier rows
+            prices_cached = uprated_prices_available()
+            if not prices_cached:
+                print(f"Note: no per-property price cache in {UPRATED_PRICES_DIR}/; it is only written by full runs.")
+            touched_mask = postcode_table['postcode_clean'].isin(touched)
+            old_counts = postcode_table[touched_mask].groupby('pcon')[LABELS].sum()
+            postcode_table = postcode_table[~touched_mask]
+            if len(updated_rows):
+                new_counts, postcode_part, _, _ = process_partition(
+                    updated_rows.copy(), nspl_index, inflation,
+                    prices_part=segment_id if prices_cached else None, replaces=touched
+                )
+                counts = counts.sub(old_counts, fill_value=0).add(new_counts, fill_value=0)
+                if postcode_part is not None:
+                    postcode_table = pd.concat([postcode_table, postcode_part], ignore_index=True)
+            else:
+                counts = counts.sub(old_counts, fill_value=0)
+            counts = counts.astype('int64')
+            counts = counts[counts.sum(axis=1) > 0].sort_index()
+            postcode_table = postcode_table.sort_values('postcode_clean', kind='stable', ignore_index=True)
+
+            if prices_cached:
+                if not len(updated_rows):
+                    empty = pd.DataFrame({'Postcode_Clean': [], 'pcon': [], 'Uprated_Price': []})
+                    write_uprated_prices(empty, segment_id, replaces=touched)
+                finalize_uprated_prices([segment_id], append=True)
+            meta['updates'].append({'file': os.path.basename(update_file), 'sha256': update_hash})
+            save_state(postcode_index, postcode_table, counts, segment_id + 1, meta['updates'], price_index)
+            constituency_table = build_constituency_table(counts, constituency_lookup)
+            stage['rows_in'] = len(updated_rows)
+            stage['rows_out'] = len(postcode_table)
+
+        with report.stage(steps[5], pbar) as stage:
+            export_tables(constituency_table, postcode_table)
+            stage['rows_out'] = len(constituency_table) + len(postcode_table)
+            print(f"  > Peak RSS: {peak_rss_text()}")
+    return True
+
+# ==========================================
+# DEVELOPMENT SAMPLE
+# ==========================================
+def sample_paths(ppd_file, fraction, seed, keep_price):
+    stem = os.path.splitext(os.path.basename(ppd_file))[0]
+    name = f'{stem}-sample-f{fraction:g}-s{seed}-p{keep_price}'
+    return os.path.join(SAMPLE_DIR, name + '.csv'), os.path.join(SAMPLE_DIR, name + '.json')
+
+def sample_output_dir(sample_file):
+    """
+    Where a run on sample_file writes its outputs and run-specific caches,
+    so a sample run never replaces the full run's.
+    """
+    return os.path.splitext(sample_file)[0]
+
+def sampled_postcodes(postcodes, fraction, seed):
+    """
+    True for each clean postcode drawn into the sample. The draw is a seeded
+    hash of the postcode, so it does not depend on file order or chunking and
+    every sale in a postcode is in or out together.
+    """
+    hashes = pd.util.hash_array(np.asarray(postcodes, dtype=object), hash_key=f'{seed % 2**64:016x}')
+    return (hashes >> np.uint64(11)) < np.uint64(round(fraction * 2**53))
+
+def high_value_postcodes(ppd_file, keep_price):
+    """
+    The clean postcodes with any sale at or above keep_price.
+    """
+    reader = pd.read_csv(
+        ppd_file, header=None, usecols=[1, 3], names=['Price', 'Postcode'],
+        dtype={'Price': PPD_DTYPES['Price'], 'Postcode': PPD_DTYPES['Postcode']},
+        chunksize=PPD_CHUNKSIZE, encoding='latin1'
+    )
+    postcodes = set()
+    for chunk in tqdm(reader, desc="Finding high-value postcodes", unit=" chunks"):
+        postcodes.update(clean_addr_col(chunk.loc[chunk['Price'] >= keep_price, 'Postcode']).unique())
+    return postcodes
+
+def write_ppd_sample(ppd_file, sample_file, high_value, fraction, seed):
+    """
+    Copies the rows of high-value postcodes and of drawn postcodes from
+    ppd_file to sample_file, in file order and in the same CSV format.
+    Because whole postcodes are kept, every batch-sale group and every
+    property's history is either complete in the sample or absent, so the
+    sample's results for a postcode are the same as the full run's. Returns
+    the row and postcode counts of each stratum.
+    """
+    reader = pd.read_csv(ppd_file, header=None, dtype=str, keep_default_na=False,
+                         chunksize=PPD_CHUNKSIZE, encoding='latin1')
+    high_value_rows = other_rows = other_rows_kept = 0
+    other_postcodes, other_postcodes_kept = set(), set()
+    tmp_path = sample_file + '.tmp'
+    with open(tmp_path, 'w', encoding='latin1', newline='') as f:
+        for chunk in tqdm(reader, desc="Writing sample", unit=" chunks"):
+            codes, uniques = pd.factorize(clean_addr_col(chunk[3]))
+            unique_high = np.fromiter((postcode in high_value for postcode in uniques), dtype=bool, count=len(uniques))
+            unique_drawn = sampled_postcodes(uniques, fraction, seed) & ~unique_high
+            high, drawn = unique_high[codes], unique_drawn[codes]
+            chunk[high | drawn].to_csv(f, header=False, index=False, quoting=csv.QUOTE_ALL, lineterminator='\n')
+
+            high_value_rows += int(high.sum())
+            other_rows += int((~high).sum())
+            other_rows_kept += int(drawn.sum())
+            other_postcodes.update(uniques[~unique_high])
+            other_postcodes_kept.update(uniques[unique_drawn])
+    os.replace(tmp_path, sample_file)
+    return {
+        'high_value': {'postcodes': len(high_value), 'rows': high_value_rows},
+        'sampled': {
+            'postcodes': len(other_postcodes), 'postcodes_kept': len(other_postcodes_kept),
+            'rows': other_rows, 'rows_kept': other_rows_kept,
+        },
+    }
+
+def sample_scale_factors(strata):
+    """
+    What to multiply a count from each stratum of the sample by to estimate
+    the full file's: 1 for the high-value postcodes, which are complete, and
+    the realised rows ratio for the drawn ones (about 1 / fraction).
+    """
+    sampled = strata['sampled']
+    return {
+        'high_value': 1.0,
+        'sampled': sampled['rows'] / sampled['rows_kept'] if sampled['rows_kept'] else None,
+    }
+
+def load_ppd_sample(ppd_file, fraction, seed, keep_price, rebuild=False):
+    """
+    Path of the sample fixture for these settings, and its metadata (strata
+    counts and scale factors). The fixture is reused while the source file
+    keeps its size and mtime; otherwise it is drawn again with two streaming
+    passes over ppd_file.
+    """
+    sample_file, meta_path = sample_paths(ppd_file, fraction, seed, keep_price)
+    stat = os.stat(ppd_file)
+    source = {'version': SAMPLE_VERSION, 'source': os.path.basename(ppd_file),
+              'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+    if not rebuild and os.path.exists(sample_file) and os.path.exists(meta_path):
+        with open(meta_path, encoding='utf-8') as f:
+            meta = json.load(f)
+        if all(meta.get(key) == value for key, value in source.items()):
+            print(f"  > Using cached sample {sample_file}")
+            return sample_file, meta
+
+    print(f"  > Drawing a {fraction:g} sample of postcodes (seed {seed}), keeping every postcode with a sale "
+          f"of £{keep_price:,} or more")
+    os.makedirs(SAMPLE_DIR, exist_ok=True)
+    high_value = high_value_postcodes(ppd_file, keep_price)
+    strata = write_ppd_sample(ppd_file, sample_file, high_value, fraction, seed)
+    meta = {
+        **source,
+        'fraction': fraction,
+        'seed': seed,
+        'keep_price': keep_price,
+        'strata': strata,
+        'scale_factors': sample_scale_factors(strata),
+    }
+    with open(meta_path, 'w', encoding='utf-8') as f:
+        json.dump(meta, f, indent=2)
+    return sample_file, meta
+
+def report_sample(meta, out_dir):
+    strata, scale = meta['strata'], meta['scale_factors']
+    high, sampled = strata['high_value'], strata['sampled']
+    rows = high['rows'] + sampled['rows']
+    rows_kept = high['rows'] + sampled['rows_kept']
+    print(f"  > Sample: {rows_kept:,} of {rows:,} rows ({rows_kept / max(rows, 1):.1%})")
+    print(f"  > High-value postcodes: {high['postcodes']:,} kept whole, {high['rows']:,} rows (scale x1)")
+    scale_text = f"x{scale['sampled']:,.2f}" if scale['sampled'] else "none kept"
+    print(f"  > Other postcodes: {sampled['postcodes_kept']:,} of {sampled['postcodes']:,}, "
+          f"{sampled['rows_kept']:,} of {sampled['rows']:,} rows (scale {scale_text})")
+    print(f"  > Outputs go to {out_dir}/. Their counts are the sample's own; scale the other postcodes' share to "
+          "estimate the full file.")
+
+# ==========================================
+# AS-OF ESTIMATES
+# ==========================================
+def year_end_cutoffs(first_year, last_sale, inflation):
+    """
+    (cutoff date, quarter) for each year-end from first_year that both the
+    transactions and the median price series reach.
+    """
+    latest_quarter = latest_priced_quarter(inflation)
+    cutoffs = []
+    for year in range(first_year, pd.Timestamp(last_sale).year + 1):
+        cutoff = pd.Timestamp(year, 12, 31)
+        quarter = int(quarter_numbers(year, 12))
+        if cutoff <= last_sale and latest_quarter is not None and quarter <= latest_quarter:
+            cutoffs.append((cutoff, quarter))
+    return cutoffs
+
+def as_of_counts(df, nspl_index, inflation, cutoffs):
+    """
+    Bracket counts per (cutoff, constituency) for every (date, quarter) in
+    cutoffs, in one pass over the transaction history. For each cutoff, each
+    property's latest sale on or before it is uprated to the cutoff's
+    quarter.
+
+    The history is sorted once by property and date. A sale is then the
+    property's latest for exactly the cutoffs from its own date up to (not
+    including) the property's next sale, so one searchsorted of both dates
+    into the cutoffs finds them all. Sales on the same day are ordered so
+    that the first in file order wins, as in deduplicate_transactions.
+    """
+    positions = postcode_positions(nspl_index, df['Postcode_Clean'])
+    pcon = lookup_postcodes(nspl_index, np.maximum(positions, 0))['pcon']
+    keep = (positions >= 0) & pd.notna(pcon)
+    pcon_codes, pcons = pd.factorize(pcon[keep])
+    property_codes = pd.factorize(df['Property_ID'].to_numpy()[keep])[0]
+    dates = df['Date'].to_numpy()[keep]
+    prices = df['Price'].to_numpy(dtype='float64')[keep]
+
+    order = np.lexsort((-np.arange(len(dates)), dates, property_codes))
+    property_codes, dates, prices, pcon_codes = (
+        property_codes[order], dates[order], prices[order], pcon_codes[order]
+    )
+    same_property = np.append(property_codes[1:] == property_codes[:-1], False)
+    next_dates = np.where(same_property, np.append(dates[1:], dates[-1:]), np.datetime64('NaT'))
+
+    cutoff_dates = np.array([cutoff for cutoff, _ in cutoffs], dtype='datetime64[ns]')
+    first = np.searchsorted(cutoff_dates, dates, side='left')
+    last = np.where(same_property, np.searchsorted(cutoff_dates, next_dates, side='left'), len(cutoffs))
+    rows = pd.Index(inflation['pcons']).get_indexer(pcons)[pcon_codes]
+
+    n_labels = len(LABELS)
+    frames = []
+    for k, (cutoff, quarter) in enumerate(cutoffs):
+        current = np.flatnonzero((first <= k) & (k < last))
+        uprated = prices[current] * uprating_factors_to(inflation, rows[current], dates[current], quarter)
+        brackets = np.searchsorted(DEFAULT_THRESHOLDS, uprated, side='right')
+        counts = np.bincount(pcon_codes[current] * n_labels + brackets, minlength=len(pcons) * n_labels)
+        frame = pd.DataFrame(counts.reshape(len(pcons), n_labels), index=pd.Index(pcons, name='pcon'),
+                             columns=LABELS)
+        frame = frame[frame.sum(axis=1) > 0].sort_index()
+        frames.append(frame.assign(cutoff=cutoff.date()).set_index('cutoff', append=True).swaplevel())
+    if not frames:
+        empty_index = pd.MultiIndex.from_arrays([[], []], names=['cutoff', 'pcon'])
+        return pd.DataFrame(0, index=empty_index, columns=LABELS)
+    return pd.concat(frames)
+
+def build_as_of_table(counts, constituency_lookup):
+    as_of_table = counts.copy()
+    as_of_table['Total Sales'] = as_of_table[LABELS].sum(axis=1)
+    as_of_table['Constituency Name'] = as_of_table.index.get_level_values('pcon').map(constituency_lookup)
+    as_of_table['Mansion Tax Estimate'] = sum(
+        as_of_table[label] * charge for label, charge in zip(LABELS[1:], DEFAULT_CHARGES)
+    )
+    return as_of_table
+
+def run_as_of(report, first_year, use_cache=True, rebuild_cache=False, ppd_file=PPD_FILES[0], out_dir=''):
+    """
+    The estimate as of each year-end from first_year, from the whole
+    transaction history in one pass. Writes AS_OF_OUTPUT_FILE (in out_dir) only.
+    """
+    steps = [
+        "Loading Inflation Data",
+        "Loading Price Paid Data",
+        "Fixing Portfolio/Batch Sales",
+        "Loading NSPL Data",
+        "Computing As-Of Estimates",
+        "Exporting CSV"
+    ]
+
+    with tqdm(total=len(steps), desc="Overall Progress") as pbar:
+        with report.stage(steps[0], pbar) as stage:
+            inflation, constituency_lookup = load_reference_data()
+            stage['rows_out'] = len(inflation['pcons'])
+
+        with report.stage(steps[1], pbar) as stage:
+            print("\nLoading Price Paid Data...")
+            try:
+                df_ppd = load_clean_ppd(ppd_file, use_cache, rebuild_cache)
+            except FileNotFoundError:
+                print(f"Error: Could not find {ppd_file}")
+                stage['status'] = f"failed: {ppd_file} not found"
+                return
+            stage['rows_out'] = len(df_ppd)
+
+        with report.stage(steps[2], pbar) as stage:
+            print("\nChecking for Portfolio/Batch sale anomalies...")
+            df_ppd, batch_stats = fix_batch_sales(df_ppd)
+            report_batch_stats(batch_stats)
+            stage['rows_in'] = stage['rows_out'] = len(df_ppd)
+
+        with report.stage(steps[3], pbar) as stage:
+            print(f"\nLoading NSPL...")
+            nspl_index = load_nspl()
+            stage['rows_out'] = len(nspl_index['postcode'])
+
+        with report.stage(steps[4], pbar) as stage:
+            cutoffs = year_end_cutoffs(first_year, df_ppd['Date'].max(), inflation)
+            if not cutoffs:
+                latest_quarter = latest_priced_quarter(inflation)
+                last_priced = 'none' if latest_quarter is None else f"{latest_quarter // 4} Q{latest_quarter % 4 + 1}"
+                print(f"Error: No year-end from {first_year} is covered by both the transactions (last sale "
+                      f"{df_ppd['Date'].max():%Y-%m-%d}) and the median price series (last priced quarter "
+                      f"{last_priced}); choose an earlier --as-of year.")
+                stage['status'] = "failed: no year-ends in range"
+                return
+            print(f"\nComputing estimates as of {len(cutoffs)} year-ends "
+                  f"({', '.join(str(cutoff.year) for cutoff, _ in cutoffs[:1] + cutoffs[-1:])})...")
+            as_of_table = build_as_of_table(as_of_counts(df_ppd, nspl_index, inflation, cutoffs),
+                                            constituency_lookup)
+            stage['rows_in'] = len(df_ppd)
+            stage['rows_out'] = len(as_of_table)
+            stage['cutoffs'] = len(cutoffs)
+
+        with report.stage(steps[5], pbar) as stage:
+            as_of_file = os.path.join(out_dir, AS_OF_OUTPUT_FILE)
+            as_of_table.to_csv(as_of_file)
+            print(f"\nSaved to {as_of_file}")
+            print("Mansion Tax Estimate by year-end (£m):")
+            print((as_of_table.groupby(level='cutoff')['Mansion Tax Estimate'].sum() / 1e6).round(1).to_string())
+            stage['rows_out'] = len(as_of_table)
+            print(f"  > Peak RSS: {peak_rss_text()}")
+
+def run_batch(report, use_cache=True, rebuild_cache=False, price_index='median', ppd_file=PPD_FILES[0],
+              out_dir=''):
+    """
+    The default in-memory pipeline. Returns True once the outputs are written.
+    """
     steps = [
         "Loading Inflation Data",
         "Loading Price Paid Data",
@@ -89,226 +1367,206 @@ def main():
         "Exporting CSV"
     ]
 
-    rejected_counts = pd.Series(dtype='int64')
-    postcode_table = pd.DataFrame()
-
     with tqdm(total=len(steps), desc="Overall Progress") as pbar:
         # 1. LOAD INFLATION
-        pbar.set_description(steps[0])
-        df_inflation = load_and_prepare_inflation_data()
-        latest_quarter_date = df_inflation['QuarterEnd'].max()
-        df_latest_prices = df_inflation[df_inflation['QuarterEnd'] == latest_quarter_date]
-        latest_price_lookup = df_latest_prices.set_index('pcon')['MedianPrice']
-        try:
-            constituency_lookup = load_constituency_lookup()
-        except FileNotFoundError:
-            print(f"Warning: Could not find {CTSOP_FILE}. Constituency names will be left blank.")
-            constituency_lookup = pd.Series(dtype='object')
-        pbar.update(1)
+        with report.stage(steps[0], pbar) as stage:
+            inflation, constituency_lookup = load_reference_data(price_index, use_cache, rebuild_cache, ppd_file, out_dir)
+            stage['rows_out'] = len(inflation['pcons'])
+            stage['price_index'] = price_index
 
         # 2. LOAD PPD
-        pbar.set_description(steps[1])
-        print("\nLoading Price Paid Data...")
-        ppd_frames = []
-        chunksize = 1_000_000
-        ppd_file = PPD_FILES[0]
-
-        try:
-            reader = pd.read_csv(
-                ppd_file, header=None,
-                usecols=[1, 2, 3, 4, 7, 8],
-                names=['Price', 'Date', 'Postcode', 'PropertyType', 'PAON', 'SAON'],
-                dtype={'Price': 'int64', 'Postcode': 'str', 'PropertyType': 'str', 'PAON': 'str', 'SAON': 'str'},
-                chunksize=chunksize, encoding='latin1'
-            )
-            for chunk in tqdm(reader, desc="Reading CSV", unit=" chunks"):
-                ppd_frames.append(chunk)
-            df_ppd = pd.concat(ppd_frames, ignore_index=True)
-        except FileNotFoundError:
-            print(f"Error: Could not find {ppd_file}")
-            return
+        with report.stage(steps[1], pbar) as stage:
+            print("\nLoading Price Paid Data...")
 
-        df_ppd['Date'] = pd.to_datetime(df_ppd['Date'], errors='coerce')
-        df_ppd = df_ppd[df_ppd['PropertyType'] != 'O'].copy() # Simple filter
-        pbar.update(1)
+            try:
+                df_ppd = load_clean_ppd(ppd_file, use_cache, rebuild_cache)
+            except FileNotFoundError:
+                print(f"Error: Could not find {ppd_file}")
+                stage['status'] = f"failed: {ppd_file} not found"
+                return
+            stage['rows_out'] = len(df_ppd)
 
         # ---------------------------------------------------------
         # 3a. FIX PORTFOLIO/BATCH TRANSACTIONS (NEW BLOCK)
         # ---------------------------------------------------------
-        pbar.set_description(steps[2])
-        print("\nChecking for Portfolio/Batch sale anomalies...")
-        
-        # We need a clean postcode to group by, but we haven't done the main cleaning yet.
-        # Let's create a temporary clean postcode for this specific check.
-        df_ppd['temp_pc'] = clean_addr_col(df_ppd['Postcode'])
-        
-        # Group by: Postcode, Date, Price
-        # This identifies rows that look suspicious (Same location, same day, same price)
-        group_cols = ['temp_pc', 'Date', 'Price']
-        
-        # Calculate how many transactions share these details
-        df_ppd['batch_count'] = df_ppd.groupby(group_cols)['Price'].transform('count')
-        
-        # Identify rows that need fixing (count > 1)
-        mask_batch = df_ppd['batch_count'] > 1
-        
-        # STATS TRACKING
-        affected_rows = mask_batch.sum()
-        original_value_sum = df_ppd.loc[mask_batch, 'Price'].sum()
-        
-        # APPLY THE FIX: Divide Price by the Count
-        df_ppd.loc[mask_batch, 'Price'] = df_ppd.loc[mask_batch, 'Price'] / df_ppd.loc[mask_batch, 'batch_count']
-        
-        fixed_value_sum = df_ppd.loc[mask_batch, 'Price'].sum()
-        
-        print(f"  > Found {affected_rows:,} transactions that were part of batch sales.")
-        print(f"  > Corrected total value from £{original_value_sum/1e9:.2f}bn to £{fixed_value_sum/1e9:.2f}bn.")
-        print(f"  > (Removed £{(original_value_sum - fixed_value_sum)/1e9:.2f}bn of phantom value)")
-        
-        # Clean up
-        df_ppd.drop(columns=['temp_pc', 'batch_count'], inplace=True)
-        pbar.update(1)
+        with report.stage(steps[2], pbar) as stage:
+            print("\nChecking for Portfolio/Batch sale anomalies...")
+            df_ppd, batch_stats = fix_batch_sales(df_ppd)
+            report_batch_stats(batch_stats)
+            stage['rows_in'] = stage['rows_out'] = len(df_ppd)
+            stage['batch_sale_rows'] = int(batch_stats['affected_rows'])
 
         # ---------------------------------------------------------
         # 3b. DEDUPLICATE TRANSACTIONS (STANDARD)
         # ---------------------------------------------------------
-        pbar.set_description(steps[3])
-        print("\nGenerating unique property keys...")
-        
-        df_ppd.dropna(subset=['Date'], inplace=True)
-        
-        # Robust Cleaning
-        df_ppd['PAON_clean'] = clean_addr_col(df_ppd['PAON'])
-        df_ppd['SAON_clean'] = clean_addr_col(df_ppd['SAON'])
-        df_ppd['Postcode_clean'] = clean_addr_col(df_ppd['Postcode'])
-
-        df_ppd['Property_ID'] = (
-            df_ppd['Postcode_clean'] + "_" + 
-            df_ppd['PAON_clean'] + "_" + 
-            df_ppd['SAON_clean']
-        )
-        
-        # Keep clean postcode for later merging
-        df_ppd['Postcode_Clean'] = df_ppd['Postcode_clean'] 
-        
-        # Create a copy for total transaction counts (historical context) before we drop duplicates
-        df_all_transactions = df_ppd.copy()
-
-        df_ppd.sort_values('Date', ascending=False, inplace=True)
-        df_ppd_unique = df_ppd.drop_duplicates(subset=['Property_ID'], keep='first').copy()
-        
-        # Free memory
-        df_ppd_unique.drop(columns=['PAON_clean', 'SAON_clean', 'Postcode_clean'], inplace=True)
-        df_ppd = df_ppd_unique
-
-        pre_dedupe_counts = df_all_transactions.groupby('Postcode_Clean').size()
-        post_dedupe_counts = df_ppd.groupby('Postcode_Clean').size()
-        rejected_counts = (pre_dedupe_counts - post_dedupe_counts).fillna(0)
-        rejected_counts[rejected_counts < 0] = 0
-        rejected_counts = rejected_counts.astype(int)
-        
-        print(f"  > Kept {len(df_ppd):,} unique properties.")
-        pbar.update(1)
+        with report.stage(steps[3], pbar) as stage:
+            print("\nGenerating unique property keys...")
+            stage['rows_in'] = len(df_ppd)
+            df_ppd, rejected_counts = deduplicate_transactions(df_ppd)
+            stage['rows_out'] = len(df_ppd)
+            print(f"  > Kept {len(df_ppd):,} unique properties.")
 
         # 4. LOAD NSPL
-        pbar.set_description(steps[4])
-        print(f"\nLoading NSPL...")
-        # (Simplified loading for brevity - assumes previous logic)
-        try:
-             df_nspl = pd.read_csv(NSPL_FILE, usecols=['pcds', 'pcon', 'lat', 'long'], 
-                                  dtype={'pcds': 'str', 'pcon': 'str'}, low_memory=False)
-        except:
-             df_nspl = pd.read_csv(NSPL_FILE, usecols=['pcd', 'pcon', 'lat', 'long'], 
-                                  dtype={'pcd': 'str', 'pcon': 'str'}, low_memory=False).rename(columns={'pcd': 'pcds'})
-        
-        df_nspl['Postcode_Clean'] = clean_addr_col(df_nspl['pcds'])
-        df_nspl.drop_duplicates(subset=['Postcode_Clean'], inplace=True)
-        pbar.update(1)
+        with report.stage(steps[4], pbar) as stage:
+            print(f"\nLoading NSPL...")
+            nspl_index = load_nspl()
+            stage['rows_out'] = len(nspl_index['postcode'])
 
         # 5. MERGE & UPRATE
-        pbar.set_description(steps[5])
-        print("\nMerging and Uprating...")
-        
-        nspl_merge_cols = ['Postcode_Clean', 'pcon', 'pcds', 'lat', 'long']
-        merged_df = pd.merge(df_ppd, df_nspl[nspl_merge_cols], on='Postcode_Clean', how='left')
-        merged_df.dropna(subset=['pcon'], inplace=True)
-        
-        # Prepare Inflation Merge
-        merged_df['QuarterEnd'] = (merged_df['Date'].dt.to_period('Q').dt.end_time).dt.normalize()
-        
-        merged_df = pd.merge(merged_df, df_inflation, on=['pcon', 'QuarterEnd'], how='left')
-        merged_df.rename(columns={'MedianPrice': 'MedianPrice_historical'}, inplace=True)
-        
-        merged_df['MedianPrice_latest'] = merged_df['pcon'].map(latest_price_lookup)
-        merged_df['inflation_factor'] = merged_df['MedianPrice_latest'] / merged_df['MedianPrice_historical']
-        merged_df['inflation_factor'] = merged_df['inflation_factor'].fillna(1)
-        
-        # UPRATE
-        merged_df['Uprated_Price'] = merged_df['Price'] * merged_df['inflation_factor']
-        pbar.update(1)
+        with report.stage(steps[5], pbar) as stage:
+            print("\nMerging and Uprating...")
+            merged_df = merge_and_uprate(df_ppd, nspl_index, inflation)
+            stage['rows_in'] = len(df_ppd)
+            stage['rows_out'] = len(merged_df)
+            prices_dir = os.path.join(out_dir, UPRATED_PRICES_DIR)
+            reset_uprated_prices(prices_dir)
+            write_uprated_prices(merged_df, 0, prices_dir)
+            finalize_uprated_prices([0], prices_dir)
 
         # 6. CATEGORIZE
-        pbar.set_description(steps[6])
-        merged_df['Price_Bracket'] = pd.cut(merged_df['Uprated_Price'], bins=BRACKETS, labels=LABELS, right=False)
-        pbar.update(1)
+        with report.stage(steps[6], pbar) as stage:
+            merged_df = categorize_prices(merged_df)
+            stage['rows_in'] = stage['rows_out'] = len(merged_df)
 
         # 7. AGGREGATE
-        pbar.set_description(steps[7])
-        constituency_table = pd.crosstab(merged_df['pcon'], merged_df['Price_Bracket'])
-        constituency_table['Total Sales'] = constituency_table.sum(axis=1)
-        
-        if '£5m+' in constituency_table.columns:
-            constituency_table.sort_values(by='£5m+', ascending=False, inplace=True)
-        
-        # Append metadata columns without disturbing existing brackets/total ordering
-        constituency_table['Constituency Name'] = constituency_table.index.map(constituency_lookup)
-
-        def get_bracket_counts(label):
-            return constituency_table[label] if label in constituency_table.columns else pd.Series(0, index=constituency_table.index)
-
-        constituency_table['Mansion Tax Estimate'] = (
-            get_bracket_counts('£2m - £2.5m') * 2_500 +
-            get_bracket_counts('£2.5m - £3.5m') * 3_500 +
-            get_bracket_counts('£3.5m - £5m') * 5_000 +
-            get_bracket_counts('£5m+') * 7_500
-        )
+        with report.stage(steps[7], pbar) as stage:
+            constituency_table = build_constituency_table(count_by_constituency(merged_df), constituency_lookup)
+            postcode_table = build_postcode_table(merged_df, rejected_counts)
+            stage['rows_in'] = len(merged_df)
+            stage['rows_out'] = len(postcode_table)
 
-        postcode_table = pd.crosstab(merged_df['Postcode_Clean'], merged_df['Price_Bracket'])
-        postcode_table['Total Sales'] = postcode_table.sum(axis=1)
-        for label in LABELS:
-            if label not in postcode_table.columns:
-                postcode_table[label] = 0
-        postcode_table = postcode_table[LABELS + ['Total Sales']]
-
-        postcode_meta = merged_df.groupby('Postcode_Clean').agg(
-            postcode_label=('pcds', 'first'),
-            lat=('lat', 'first'),
-            long=('long', 'first')
-        )
-        postcode_table = postcode_table.join(postcode_meta, how='left')
-        postcode_table.reset_index(inplace=True)
-        postcode_table.rename(columns={'Postcode_Clean': 'postcode_clean'}, inplace=True)
-        postcode_table['rejected_multiple_transactions'] = (
-            postcode_table['postcode_clean'].map(rejected_counts).fillna(0).astype(int)
-        )
-        postcode_table['postcode_label'] = postcode_table['postcode_label'].fillna(postcode_table['postcode_clean'])
-        postcode_table['lat'] = pd.to_numeric(postcode_table['lat'], errors='coerce')
-        postcode_table['long'] = pd.to_numeric(postcode_table['long'], errors='coerce')
+        # 8. EXPORT
+        with report.stage(steps[8], pbar) as stage:
+            export_tables(constituency_table, postcode_table, out_dir)
+            stage['rows_out'] = len(constituency_table) + len(postcode_table)
+            print(f"  > Peak RSS: {peak_rss_text()}")
+    return True
 
-        postcode_col_order = ['postcode_clean', 'postcode_label', 'lat', 'long'] + LABELS + ['Total Sales', 'rejected_multiple_transactions']
-        postcode_table = postcode_table[postcode_col_order]
+def main(streaming=False, partitions=STREAM_PARTITIONS, use_cache=True, rebuild_cache=False,
+         build_state=False, incremental=None, workers=1, report_path=None, profiler=None,
+         bootstrap=0, bootstrap_method='multinomial', bootstrap_seed=0, bootstrap_workers=1, as_of=None,
+         price_index='median', sample=None, sample_seed=0, sample_keep_price=SAMPLE_KEEP_PRICE):
+    if (build_state or workers > 1) and not streaming and not incremental:
+        print("Note: --build-state and --workers run the streaming pipeline.")
+        streaming = True
+    if as_of is not None and (streaming or incremental or bootstrap):
+        print("Note: --as-of runs on its own; --streaming, --incremental and --bootstrap are ignored.")
+    if price_index != 'median' and (as_of is not None or incremental):
+        print("Note: --as-of uprates with the median index, --incremental with the one the state was built with; "
+              "--price-index is ignored.")
+    if sample is not None and not 0 < sample <= 1:
+        raise SystemExit("--sample FRACTION must be greater than 0 and at most 1")
+    if sample is not None and incremental:
+        print("Note: --incremental applies the update to the persisted state; --sample is ignored.")
+        sample = None
+    if sample is not None and build_state:
+        print("Note: the incremental state is only built from the full file; --build-state is ignored with --sample.")
+        build_state = False
+    mode = 'as-of' if as_of is not None else 'incremental' if incremental else 'streaming' if streaming else 'batch'
+    inputs = ([incremental] if incremental else PPD_FILES) + [NSPL_FILE, HOUSE_PRICE_XLSX, CTSOP_XLSX]
 
-        pbar.update(1)
+    with RunReport(SCRIPT_NAME, inputs=inputs, report_path=report_path, profiler=profiler, mode=mode) as report:
+        ppd_file = PPD_FILES[0]
+        out_dir = ''
+        if sample is not None:
+            with report.stage("Sampling Price Paid Data") as stage:
+                print("\nPreparing development sample...")
+                try:
+                    ppd_file, sample_meta = load_ppd_sample(ppd_file, sample, sample_seed, sample_keep_price,
+                                                            rebuild_cache)
+                except FileNotFoundError:
+                    print(f"Error: Could not find {ppd_file}")
+                    stage['status'] = f"failed: {ppd_file} not found"
+                    return report
+                out_dir = sample_output_dir(ppd_file)
+                os.makedirs(out_dir, exist_ok=True)
+                report_sample(sample_meta, out_dir)
+                strata = sample_meta['strata']
+                stage['rows_in'] = strata['high_value']['rows'] + strata['sampled']['rows']
+                stage['rows_out'] = strata['high_value']['rows'] + strata['sampled']['rows_kept']
+                stage['sample_file'] = ppd_file
+                stage['output_dir'] = out_dir
+                stage['strata'] = strata
+                stage['scale_factors'] = sample_meta['scale_factors']
 
-        # 8. EXPORT
-        pbar.set_description(steps[8])
-        constituency_table.to_csv(OUTPUT_FILE)
-        print(f"\nSaved to {OUTPUT_FILE}")
-        print("Top 5 Constituencies by £5m+ Sales:")
-        print(constituency_table.head(5))
-        postcode_table.to_csv(POSTCODE_OUTPUT_FILE, index=False)
-        print(f"\nSaved to {POSTCODE_OUTPUT_FILE} with {len(postcode_table):,} postcodes.")
-        pbar.update(1)
+        if as_of is not None:
+            run_as_of(report, as_of, use_cache, rebuild_cache, ppd_file, out_dir)
+            return report
+        if incremental:
+            completed = run_incremental(report, incremental)
+        elif streaming:
+            completed = run_streaming(report, partitions, use_cache, rebuild_cache, build_state, workers, price_index,
+                                      ppd_file, out_dir)
+        else:
+            completed = run_batch(report, use_cache, rebuild_cache, price_index, ppd_file, out_dir)
+
+        if bootstrap:
+            with report.stage("Bootstrapping Estimates") as stage:
+                stage['replicates'] = bootstrap
+                prices_dir = os.path.join(out_dir, UPRATED_PRICES_DIR)
+                if not completed:
+                    print("\nError: --bootstrap was not run because the pipeline did not write new outputs.")
+                    stage['status'] = "failed: pipeline did not complete"
+                elif not uprated_prices_available(prices_dir):
+                    print(f"\nError: --bootstrap needs the per-property price cache in {prices_dir}/, which this "
+                          "run did not have; run a full build first.")
+                    stage['status'] = "failed: no per-property price cache"
+                else:
+                    stage['rows_out'] = add_bootstrap_intervals(bootstrap, bootstrap_method, bootstrap_seed,
+                                                                bootstrap_workers, out_dir)
+    return report
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Build constituency and postcode sales-by-bracket CSVs from Price Paid data.")
+    parser.add_argument('--streaming', action='store_true',
+                        help="Process the Price Paid file in postcode partitions spilled to disk, with bounded memory.")
+    parser.add_argument('--partitions', type=int, default=STREAM_PARTITIONS,
+                        help=f"Number of postcode partitions in streaming mode (default {STREAM_PARTITIONS}).")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="Processes for parsing/cleaning and for partition processing (implies --streaming).")
+    parser.add_argument('--no-cache', dest='use_cache', action='store_false',
+                        help=f"Neither read nor write the cleaned Price Paid cache in {PPD_CACHE_DIR}/.")
+    parser.add_argument('--rebuild-cache', action='store_true',
+                        help="Re-parse the Price Paid CSV and overwrite the cleaned cache even if it looks valid.")
+    parser.add_argument('--build-state', action='store_true',
+                        help=f"Persist per-postcode transaction state in {PPD_STATE_DIR}/ for later --incremental runs.")
+    parser.add_argument('--incremental', nargs='?', const=PPD_UPDATE_FILE, metavar='UPDATE_CSV',
+                        help=f"Apply a Land Registry monthly update file (default {PPD_UPDATE_FILE}) to the persisted state.")
+    parser.add_argument('--bootstrap', type=int, default=0, metavar='N',
+                        help="Add p5/p50/p95 columns of the Mansion Tax Estimate from N bootstrap replicates.")
+    parser.add_argument('--bootstrap-method', choices=BOOTSTRAP_METHODS, default='multinomial',
+                        help="Resample properties within each constituency (multinomial, default) or with "
+                             "Poisson(1) weights.")
+    parser.add_argument('--bootstrap-seed', type=int, default=0)
+    parser.add_argument('--bootstrap-workers', type=int, default=os.cpu_count() or 1,
+                        help="Processes for the bootstrap replicates (default: all cores).")
+    parser.add_argument('--as-of', nargs='?', type=int, const=AS_OF_FIRST_YEAR, metavar='FIRST_YEAR',
+                        help=f"Instead of the usual outputs, write {AS_OF_OUTPUT_FILE}: the estimate as of each "
+                             f"year-end from FIRST_YEAR (default {AS_OF_FIRST_YEAR}).")
+    parser.add_argument('--price-index', choices=PRICE_INDEXES, default='median',
+                        help="Uprate by the ratio of constituency median prices (median, default) or by a "
+                             "region and price-tier index fitted to repeat sales (repeat-sales, cached in "
+                             f"{REPEAT_SALES_CACHE_FILE}).")
+    parser.add_argument('--sample', nargs='?', type=float, const=SAMPLE_FRACTION, metavar='FRACTION',
+                        help=f"Run on a development sample cached in {SAMPLE_DIR}/: every postcode with a sale at or "
+                             f"above --sample-keep-price, plus FRACTION (default {SAMPLE_FRACTION:g}) of the other "
+                             f"postcodes, each kept whole. Outputs go to a directory in {SAMPLE_DIR}/ rather than "
+                             "replacing the full run's. Prints the factors to scale the counts by.")
+    parser.add_argument('--sample-seed', type=int, default=0, help="Seed for the postcodes drawn by --sample.")
+    parser.add_argument('--sample-keep-price', type=int, default=SAMPLE_KEEP_PRICE, metavar='PRICE',
+                        help=f"Sale price at or above which --sample keeps a postcode (default {SAMPLE_KEEP_PRICE:,}).")
+    add_report_arguments(parser)
+    return parser.parse_args()
 
 if __name__ == "__main__":
-    main()
+    args = parse_args()
+    # Exit non-zero when a stage failed, so build.py does not record the run as built
+    report = main(streaming=args.streaming, partitions=args.partitions,
+                  use_cache=args.use_cache, rebuild_cache=args.rebuild_cache,
+                  build_state=args.build_state, incremental=args.incremental, workers=args.workers,
+                  report_path=args.report, profiler=args.profile_stages,
+                  bootstrap=args.bootstrap, bootstrap_method=args.bootstrap_method, bootstrap_seed=args.bootstrap_seed,
+                  bootstrap_workers=args.bootstrap_workers, as_of=args.as_of, price_index=args.price_index,
+                  sample=args.sample, sample_seed=args.sample_seed, sample_keep_price=args.sample_keep_price)
+    if report.failed:
+        raise SystemExit(1)
@@ -2,16 +2,27 @@
 
 # © Tax Policy Associates 2025
 
+import argparse
 import json
 import os
+import time
 
+import numpy as np
 import pandas as pd
 import geopandas as gpd
+import shapely
 from tqdm import tqdm
 
+from columnar import write_columns
+from mansion_tax import DEFAULT_BAND_LABELS, DEFAULT_CHARGES
+from reference_data import CTSOP_SHEET, CTSOP_XLSX, HOUSE_PRICE_XLSX, read_reference_sheet
+from run_report import RunReport, add_report_arguments
+from tiles import build_cluster_tiles
+from topology import write_topojson_levels
+from web_artifacts import publish_artifact
+
 # ---------- CONFIG ----------
-CTSOP_XLSX = "CTSOP_tables.xlsx"
-CTSOP_SHEET = "CTSOP2.0"
+SCRIPT_NAME = "2_build_data_for_webapp"
 
 # Use the July 2024 boundaries GPKG
 BOUNDARIES_FILE = "Westminster_Parliamentary_Constituencies_July_2024_Boundaries_UK_BGC_-753850996617870270.gpkg"
@@ -23,20 +34,63 @@ BOUNDARY_CODE_FIELD = "PCON24CD"
 
 OUTPUT_GEOJSON = "constituency_council_tax_bands.geojson"
 
+# The same layer as shared-arc, quantized TopoJSON at several resolutions.
+# Each level is simplified by tolerance_m and quantized to a grid of
+# quantization cells per axis; max_zoom is the deepest zoom it looks right at.
+TOPOJSON_OUTPUT_TEMPLATE = "constituency_council_tax_bands.{level}.topojson"
+TOPOJSON_OBJECT = "constituencies"
+TOPOJSON_LEVELS = [
+    {"name": "low", "tolerance_m": 150, "quantization": 10_000, "max_zoom": 9},
+    {"name": "medium", "tolerance_m": 30, "quantization": 50_000, "max_zoom": 12},
+    {"name": "high", "tolerance_m": 0, "quantization": 100_000, "max_zoom": None},
+]
+
 # postcode inputs/outputs
 POSTCODE_TX_CSV = "postcode_sales_by_bracket.csv"
 POSTCODE_OUTPUT_GEOJSON = "postcode_sales_by_bracket.geojson"
 MANIFEST_OUTPUT = "map_data_manifest.json"
 
+# How postcodes are limited to England and given a constituency: "code" looks
+# up the NSPL pcon code step 1 writes to the CSV; "geometry" tests each point
+# against the boundary polygons (used automatically for CSVs without pcon)
+POSTCODE_FILTER_METHODS = ["code", "geometry"]
+
+# The same points in the binary columnar layout (see columnar.py), which the
+# app decodes into typed arrays without parsing JSON
+POSTCODE_OUTPUT_COLUMNAR = "postcode_sales_by_bracket.mtc"
+POSTCODE_COLUMN_TYPES = {
+    "long": "float32",
+    "lat": "float32",
+    "postcode_clean": "string",
+    "postcode_label": "string",
+    "pcon_code": "string",
+    "hv_count": "int32",
+    **{label: "int32" for label in DEFAULT_BAND_LABELS},
+    "Total Sales": "int32",
+    "rejected_multiple_transactions": "int32",
+}
+
+# The same points pre-clustered per zoom level as a z/x/y pyramid of JSON
+# tiles, so the app only fetches what is in view. Below the detail zoom,
+# postcodes are grouped into square cells of POSTCODE_CLUSTER_CELL_PX pixels.
+# Each build's tiles go in a subdirectory named by their hash (see tiles.py).
+POSTCODE_TILES_DIR = "postcode_tiles"
+POSTCODE_TILE_MIN_ZOOM = 4
+POSTCODE_TILE_DETAIL_ZOOM = 15
+POSTCODE_CLUSTER_CELL_PX = 64
+POSTCODE_TILE_SUM_COLUMNS = ["hv_count"] + DEFAULT_BAND_LABELS + ["Total Sales"]
+POSTCODE_TILE_POINT_COLUMNS = [
+    "postcode_clean", "postcode_label", "pcon_code", "hv_count",
+] + DEFAULT_BAND_LABELS + ["Total Sales", "rejected_multiple_transactions"]
+
 COL_GEOG = "Geography [note 1]"
 COL_CODE = "ONS area code [note 3]"
 COL_NAME = "ONS area name"
 
 BAND_COLUMNS = ["A", "B", "C", "D", "E", "F", "G", "H", "I"]
 
-HOUSE_PRICE_XLSX = "housepricestatisticsparlicon.xlsx"
+# The workbooks' file names and header rows are in reference_data.py
 HOUSE_PRICE_SHEET = "2a"
-HOUSE_PRICE_HEADER_ROW = 2  # zero-indexed header row
 HOUSE_PRICE_CODE_COL = "Area Code"
 HOUSE_PRICE_1995_COL = "Year ending Dec 1995"
 HOUSE_PRICE_2025_COL = "Year ending Mar 2025"
@@ -53,11 +107,7 @@ TX_COLS = {
 
 
 def load_ctsop_pcon():
-    df = pd.read_excel(
-        CTSOP_XLSX,
-        sheet_name=CTSOP_SHEET,
-        header=4  # A5 is the header row
-    )
+    df = read_reference_sheet(CTSOP_XLSX, CTSOP_SHEET)
 
     df_pcon = df[df[COL_GEOG] == "PCON"].copy()
 
@@ -79,11 +129,7 @@ def load_ctsop_pcon():
 
 
 def load_house_prices():
-    df_prices = pd.read_excel(
-        HOUSE_PRICE_XLSX,
-        sheet_name=HOUSE_PRICE_SHEET,
-        header=HOUSE_PRICE_HEADER_ROW
-    )
+    df_prices = read_reference_sheet(HOUSE_PRICE_XLSX, HOUSE_PRICE_SHEET)
 
     cols = [
         HOUSE_PRICE_CODE_COL,
@@ -203,6 +249,8 @@ def load_postcode_points():
 
     # Drop rows without coordinates
     df_pc = df_pc.dropna(subset=["lat", "long"])
+    if "pcon" in df_pc.columns:
+        df_pc["pcon"] = df_pc["pcon"].astype("string").str.strip()
     if df_pc.empty:
         print("Warning: no postcode rows with coordinates and hv_count > 0 found.")
         return gpd.GeoDataFrame(columns=df_pc.columns.tolist() + ["geometry"], crs="EPSG:4326")
@@ -217,31 +265,129 @@ def load_postcode_points():
     return gdf_pc
 
 
-def build_manifest_entry(path):
-    if not path:
-        return {"file": "", "bytes": 0, "available": False}
-    exists = os.path.exists(path)
-    size = os.path.getsize(path) if exists else 0
+def postcodes_in_england_by_code(postcode_gdf, constituency_codes):
+    """
+    Keeps postcodes whose NSPL constituency is one of constituency_codes.
+    Returns the matching row positions and their constituency codes.
+    """
+    codes = postcode_gdf["pcon"].to_numpy(dtype=object)
+    rows = np.flatnonzero(pd.Series(codes).isin(constituency_codes).to_numpy())
+    return rows, codes[rows]
+
+
+def postcodes_in_england_by_geometry(postcode_gdf, boundaries):
+    """
+    Keeps postcodes that fall within one of the boundary polygons, with one
+    bulk STRtree query against prepared geometries. Returns the matching row
+    positions and the code of the polygon each falls in.
+    """
+    polygons = boundaries.geometry.to_numpy()
+    shapely.prepare(polygons)
+    tree = shapely.STRtree(polygons)
+    point_rows, polygon_rows = tree.query(postcode_gdf.geometry.to_numpy(), predicate="within")
+    # Constituencies do not overlap, but keep one match per point regardless
+    point_rows, first = np.unique(point_rows, return_index=True)
+    return point_rows, boundaries["pcon_code"].to_numpy(dtype=object)[polygon_rows[first]]
+
+
+def filter_postcodes_to_england(postcode_gdf, boundaries, method):
+    """
+    Limits the postcode points to the constituencies in boundaries and sets
+    their pcon_code. Returns (filtered points, method actually used).
+    """
+    if method == "code" and "pcon" not in postcode_gdf.columns:
+        print(f"Note: {POSTCODE_TX_CSV} has no pcon column (rerun step 1); filtering postcodes by geometry.")
+        method = "geometry"
+    if method == "code":
+        rows, pcon_codes = postcodes_in_england_by_code(postcode_gdf, boundaries["pcon_code"])
+    else:
+        rows, pcon_codes = postcodes_in_england_by_geometry(postcode_gdf, boundaries)
+    filtered = postcode_gdf.iloc[rows].drop(columns=["pcon"], errors="ignore")
+    filtered["pcon_code"] = pcon_codes
+    return filtered, method
+
+
+def surcharge_rates():
+    """
+    Annual charge per transaction-count field, so the web app's revenue
+    estimate uses the same schedule as step 1.
+    """
+    return {
+        TX_COLS[label]: charge
+        for label, charge in zip(DEFAULT_BAND_LABELS[1:], DEFAULT_CHARGES)
+    }
+
+
+def build_topojson_manifest_entry(levels):
+    """
+    Manifest entry for the multi-resolution TopoJSON, with each level's
+    published (hashed, precompressed) file.
+    """
+    levels = [{**level, **publish_artifact(level["file"])} for level in levels or []]
     return {
-        "file": path,
-        "bytes": int(size),
-        "available": bool(exists),
+        "format": "topojson",
+        "object": TOPOJSON_OBJECT,
+        "available": any(level["available"] for level in levels),
+        "levels": levels,
     }
 
 
-def write_data_manifest(constituency_path, postcode_path):
+def write_postcode_tiles(postcode_gdf):
+    """
+    Writes the clustered postcode tile pyramid and returns its scheme.
+    """
+    point_cols = [c for c in POSTCODE_TILE_POINT_COLUMNS if c in postcode_gdf.columns]
+    return build_cluster_tiles(
+        pd.DataFrame(postcode_gdf.drop(columns="geometry")),
+        POSTCODE_TILES_DIR,
+        lon_col="long",
+        lat_col="lat",
+        sum_cols=POSTCODE_TILE_SUM_COLUMNS,
+        point_cols=point_cols,
+        min_zoom=POSTCODE_TILE_MIN_ZOOM,
+        detail_zoom=POSTCODE_TILE_DETAIL_ZOOM,
+        cell_px=POSTCODE_CLUSTER_CELL_PX,
+    )
+
+
+def write_postcode_columns(postcode_gdf):
+    """
+    Writes the postcode points in the columnar format and returns the
+    manifest fields describing the file.
+    """
+    column_types = {name: kind for name, kind in POSTCODE_COLUMN_TYPES.items() if name in postcode_gdf.columns}
+    return write_columns(POSTCODE_OUTPUT_COLUMNAR, postcode_gdf, column_types)
+
+
+def write_data_manifest(constituency_path, postcode_path, topojson_levels=None, postcode_tiles=None,
+                        postcode_columns=None):
+    """
+    Publishes every dataset under its content-hashed name (see
+    web_artifacts.py) and writes the manifest the app loads first. The
+    manifest itself keeps a fixed name and should be served uncached.
+    """
     manifest = {
         "datasets": {
-            "constituency": build_manifest_entry(constituency_path),
-            "postcode": build_manifest_entry(postcode_path),
-        }
+            "constituency": publish_artifact(constituency_path),
+            "constituency_topojson": build_topojson_manifest_entry(topojson_levels),
+            "postcode": publish_artifact(postcode_path),
+            "postcode_columnar": (
+                {**publish_artifact(POSTCODE_OUTPUT_COLUMNAR), **postcode_columns}
+                if postcode_columns else publish_artifact(None)
+            ),
+            "postcode_tiles": (
+                {**postcode_tiles, "index": publish_artifact(postcode_tiles["index"]), "available": True}
+                if postcode_tiles else {"available": False}
+            ),
+        },
+        "surcharge_rates": surcharge_rates(),
     }
     with open(MANIFEST_OUTPUT, "w", encoding="utf-8") as f:
         json.dump(manifest, f, indent=2)
     print(f"Data manifest written to {MANIFEST_OUTPUT}")
 
 
-def main():
+def main(report_path=None, profiler=None, topojson=True, postcode_filter="code"):
     steps = [
         "Loading CTSOP data",
         "Loading house price data",
@@ -251,115 +397,172 @@ def main():
         "Loading constituency boundaries",
         "Merging boundaries",
         "Writing constituency GeoJSON",
+        "Writing constituency TopoJSON",
         "Loading postcode transactions",
         "Writing postcode GeoJSON",
+        "Writing postcode columns",
+        "Writing postcode tiles",
+        "Publishing web artifacts",
     ]
+    inputs = [CTSOP_XLSX, HOUSE_PRICE_XLSX, RECENT_TX_CSV, BOUNDARIES_FILE, POSTCODE_TX_CSV]
 
-    with tqdm(total=len(steps), desc="Processing data") as pbar:
+    with RunReport(SCRIPT_NAME, inputs=inputs, report_path=report_path, profiler=profiler) as report, \
+            tqdm(total=len(steps), desc="Processing data") as pbar:
         # ---- Constituency data pipeline ----
-        pbar.set_description(steps[0])
-        df_pcon = load_ctsop_pcon()
-        pbar.update(1)
-
-        pbar.set_description(steps[1])
-        house_prices = load_house_prices()
-        pbar.update(1)
-
-        pbar.set_description(steps[2])
-        df_pcon = df_pcon.merge(house_prices, on="pcon_code", how="left")
-        pbar.update(1)
-
-        pbar.set_description(steps[3])
-        recent_tx = load_recent_transactions()
-        pbar.update(1)
-
-        pbar.set_description(steps[4])
-        df_pcon = df_pcon.merge(recent_tx, on="pcon_code", how="left")
-        pbar.update(1)
-
-        pbar.set_description(steps[5])
-        gdf = gpd.read_file(BOUNDARIES_FILE)
-        pbar.update(1)
-
-        if BOUNDARY_CODE_FIELD not in gdf.columns:
-            raise RuntimeError(
-                f"Boundary code field '{BOUNDARY_CODE_FIELD}' not found. "
-                f"Available columns: {list(gdf.columns)}"
-            )
-
-        if gdf.crs is not None:
-            if gdf.crs.to_epsg() != 4326:
-                gdf = gdf.to_crs(epsg=4326)
-        else:
-            print("Warning: boundary CRS is None; set it manually if needed.")
-
-        gdf["pcon_code"] = gdf[BOUNDARY_CODE_FIELD].astype(str).str.strip()
-        df_pcon["pcon_code"] = df_pcon["pcon_code"].astype(str).str.strip()
-        gdf = gdf[gdf["pcon_code"].str.startswith("E")]
-
-        pbar.set_description(steps[6])
-        merged = gdf.merge(df_pcon, on="pcon_code", how="left")
-        pbar.update(1)
-
-        missing = merged[merged["band_F"].isna()]
-        if not missing.empty:
-            print(
-                f"Warning: {len(missing)} constituencies missing CTSOP band data."
-            )
-
-        desired_prop_cols = [
-            "pcon_code",
-            "name",
-            # Council Tax bands
-            "band_A", "band_B", "band_C", "band_D", "band_E",
-            "band_F", "band_G", "band_H", "band_I",
-            # Median prices
-            "median_price_1995",
-            "median_price_2025",
-            "median_price_change_pct",
-            # transaction counts
-            "tx_2m_to_2_5m_count",
-            "tx_2_5m_to_3_5m_count",
-            "tx_3_5m_to_5m_count",
-            "tx_over_5m_count",
-            "tx_2m_plus_count",  # total for mansion tax
-        ]
-        desired_prop_cols = [c for c in desired_prop_cols if c in merged.columns]
-
-        merged = merged[desired_prop_cols + ["geometry"]]
-
-        pbar.set_description(steps[7])
-        merged.to_file(OUTPUT_GEOJSON, driver="GeoJSON")
-        pbar.update(1)
+        with report.stage(steps[0], pbar) as stage:
+            df_pcon = load_ctsop_pcon()
+            stage["rows_out"] = len(df_pcon)
+
+        with report.stage(steps[1], pbar) as stage:
+            house_prices = load_house_prices()
+            stage["rows_out"] = len(house_prices)
+
+        with report.stage(steps[2], pbar) as stage:
+            stage["rows_in"] = len(df_pcon)
+            df_pcon = df_pcon.merge(house_prices, on="pcon_code", how="left")
+            stage["rows_out"] = len(df_pcon)
+
+        with report.stage(steps[3], pbar) as stage:
+            recent_tx = load_recent_transactions()
+            stage["rows_out"] = len(recent_tx)
+
+        with report.stage(steps[4], pbar) as stage:
+            stage["rows_in"] = len(df_pcon)
+            df_pcon = df_pcon.merge(recent_tx, on="pcon_code", how="left")
+            stage["rows_out"] = len(df_pcon)
+
+        with report.stage(steps[5], pbar) as stage:
+            gdf = gpd.read_file(BOUNDARIES_FILE)
+            stage["rows_out"] = len(gdf)
+
+            if BOUNDARY_CODE_FIELD not in gdf.columns:
+                raise RuntimeError(
+                    f"Boundary code field '{BOUNDARY_CODE_FIELD}' not found. "
+                    f"Available columns: {list(gdf.columns)}"
+                )
+
+            if gdf.crs is not None:
+                if gdf.crs.to_epsg() != 4326:
+                    gdf = gdf.to_crs(epsg=4326)
+            else:
+                print("Warning: boundary CRS is None; set it manually if needed.")
+
+            gdf["pcon_code"] = gdf[BOUNDARY_CODE_FIELD].astype(str).str.strip()
+            df_pcon["pcon_code"] = df_pcon["pcon_code"].astype(str).str.strip()
+            gdf = gdf[gdf["pcon_code"].str.startswith("E")]
+
+        with report.stage(steps[6], pbar) as stage:
+            stage["rows_in"] = len(gdf)
+            merged = gdf.merge(df_pcon, on="pcon_code", how="left")
+            stage["rows_out"] = len(merged)
+
+            missing = merged[merged["band_F"].isna()]
+            if not missing.empty:
+                print(
+                    f"Warning: {len(missing)} constituencies missing CTSOP band data."
+                )
+
+            desired_prop_cols = [
+                "pcon_code",
+                "name",
+                # Council Tax bands
+                "band_A", "band_B", "band_C", "band_D", "band_E",
+                "band_F", "band_G", "band_H", "band_I",
+                # Median prices
+                "median_price_1995",
+                "median_price_2025",
+                "median_price_change_pct",
+                # transaction counts
+                "tx_2m_to_2_5m_count",
+                "tx_2_5m_to_3_5m_count",
+                "tx_3_5m_to_5m_count",
+                "tx_over_5m_count",
+                "tx_2m_plus_count",  # total for mansion tax
+            ]
+            desired_prop_cols = [c for c in desired_prop_cols if c in merged.columns]
+
+            merged = merged[desired_prop_cols + ["geometry"]]
+
+        with report.stage(steps[7], pbar) as stage:
+            merged.to_file(OUTPUT_GEOJSON, driver="GeoJSON")
+            stage["rows_out"] = len(merged)
+
+        with report.stage(steps[8], pbar) as stage:
+            topojson_levels = None
+            if topojson:
+                topojson_levels = write_topojson_levels(
+                    merged, desired_prop_cols, TOPOJSON_OUTPUT_TEMPLATE, TOPOJSON_LEVELS, TOPOJSON_OBJECT
+                )
+                for level in topojson_levels:
+                    print(f"TopoJSON ({level['name']}) written to {level['file']}: "
+                          f"{os.path.getsize(level['file']):,} bytes")
+            stage["rows_out"] = len(merged)
 
         # ---- Postcode point layer ----
-        pbar.set_description(steps[8])
-        postcode_gdf = load_postcode_points()
-        pbar.update(1)
-
-        pbar.set_description(steps[9])
-        if not postcode_gdf.empty:
-            try:
-                english_bounds = merged[["pcon_code", "geometry"]].dropna(subset=["geometry"]).copy()
-                english_bounds = english_bounds.reset_index(drop=True)
-                english_bounds = gpd.GeoDataFrame(english_bounds, geometry="geometry", crs=merged.crs)
-                joined = gpd.sjoin(postcode_gdf, english_bounds, how="inner", predicate="within")
-                postcode_gdf = joined.drop(columns=[col for col in ["index_right"] if col in joined.columns])
-            except Exception as exc:
-                print(f"Warning: failed to spatially filter postcode data to England: {exc}")
+        with report.stage(steps[9], pbar) as stage:
+            postcode_gdf = load_postcode_points()
+            stage["rows_out"] = len(postcode_gdf)
+
+        with report.stage(steps[10], pbar) as stage:
+            stage["rows_in"] = len(postcode_gdf)
             if not postcode_gdf.empty:
-                postcode_gdf.to_file(POSTCODE_OUTPUT_GEOJSON, driver="GeoJSON")
-                print(f"Postcode GeoJSON written to {POSTCODE_OUTPUT_GEOJSON}")
+                english_bounds = merged[["pcon_code", "geometry"]].dropna(subset=["geometry"]).reset_index(drop=True)
+                filter_start = time.perf_counter()
+                postcode_gdf, method = filter_postcodes_to_england(postcode_gdf, english_bounds, postcode_filter)
+                stage["england_filter"] = method
+                stage["england_filter_s"] = round(time.perf_counter() - filter_start, 3)
+                print(f"Filtered postcodes to England by {method} in {stage['england_filter_s']:.2f}s: "
+                      f"{len(postcode_gdf):,} of {stage['rows_in']:,} kept")
+                if not postcode_gdf.empty:
+                    postcode_gdf.to_file(POSTCODE_OUTPUT_GEOJSON, driver="GeoJSON")
+                    print(f"Postcode GeoJSON written to {POSTCODE_OUTPUT_GEOJSON}")
+                else:
+                    print("No postcode GeoJSON written (no postcode data after filtering).")
             else:
-                print("No postcode GeoJSON written (no postcode data after filtering).")
-        else:
-            print("No postcode GeoJSON written (no postcode data).")
-        pbar.update(1)
+                print("No postcode GeoJSON written (no postcode data).")
+            stage["rows_out"] = len(postcode_gdf)
 
-        write_data_manifest(OUTPUT_GEOJSON, POSTCODE_OUTPUT_GEOJSON)
+        with report.stage(steps[11], pbar) as stage:
+            stage["rows_in"] = len(postcode_gdf)
+            postcode_columns = None
+            if not postcode_gdf.empty:
+                postcode_columns = write_postcode_columns(postcode_gdf)
+                print(f"Postcode columns written to {POSTCODE_OUTPUT_COLUMNAR}: "
+                      f"{os.path.getsize(POSTCODE_OUTPUT_COLUMNAR):,} bytes")
+                stage["rows_out"] = postcode_columns["rows"]
+            else:
+                print("No postcode columns written (no postcode data).")
+
+        with report.stage(steps[12], pbar) as stage:
+            stage["rows_in"] = len(postcode_gdf)
+            postcode_tiles = None
+            if not postcode_gdf.empty:
+                postcode_tiles = write_postcode_tiles(postcode_gdf)
+                print(f"Postcode tiles written to {POSTCODE_TILES_DIR}/{postcode_tiles['version']}/: "
+                      f"{postcode_tiles['tiles']:,} tiles, {postcode_tiles['bytes']:,} bytes")
+                stage["tiles"] = postcode_tiles["tiles"]
+            else:
+                print("No postcode tiles written (no postcode data).")
+
+        with report.stage(steps[13], pbar):
+            write_data_manifest(OUTPUT_GEOJSON, POSTCODE_OUTPUT_GEOJSON, topojson_levels, postcode_tiles,
+                                postcode_columns)
 
     print("Done.")
 
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="Build the constituency and postcode GeoJSON layers for the web app.")
+    parser.add_argument("--no-topojson", dest="topojson", action="store_false",
+                        help="Only write the full-resolution constituency GeoJSON.")
+    parser.add_argument("--postcode-filter", choices=POSTCODE_FILTER_METHODS, default="code",
+                        help="Limit postcodes to England by their NSPL constituency code (default) "
+                             "or by testing each point against the boundary polygons.")
+    add_report_arguments(parser)
+    return parser.parse_args()
+
+
 if __name__ == "__main__":
-    main()
+    args = parse_args()
+    main(report_path=args.report, profiler=args.profile_stages, topojson=args.topojson,
+         postcode_filter=args.postcode_filter)
@@ -3,11 +3,21 @@ import json
 from pathlib import Path
 import pandas as pd
 
+from columnar import read_columns
+from web_artifacts import publish_artifact
+
 INPUT_FILE = Path("constituency_sales_by_bracket.csv")
 OUTPUT_FILE = Path("mansion_tax_treemap.json")
+# Points the embed at the content-hashed copy of OUTPUT_FILE
+MANIFEST_FILE = Path("mansion_tax_treemap.manifest.json")
 
 MAX_TO_PLOT = 300
 
+# Step 1's aggregate cube (see cube.py). When it is present, each
+# constituency can be clicked to show its largest postcode sectors.
+SALES_CUBE_FILE = Path("sales_cube.mtc")
+MAX_SECTORS_PER_CONSTITUENCY = 10
+
 # A subtle, professional palette (Blues/Teals/Greys)
 # "Nice" rather than "Garish"
 PALETTE = [
@@ -23,19 +33,46 @@ PALETTE = [
     "#2e4053", # Deep Navy
 ]
 
+def load_sector_children():
+    """
+    Treemap children for each constituency code: its largest postcode
+    sectors by estimate (£m), plus the rest as "Other sectors".
+    """
+    if not SALES_CUBE_FILE.exists():
+        return {}
+    cube = read_columns(SALES_CUBE_FILE)
+    sectors = cube[(cube["level"] == "sector") & (cube["pcon"] != "")].copy()
+    sectors["value"] = sectors["Mansion Tax Estimate"] / 1e6
+    sectors = sectors[sectors["value"] > 0].sort_values(["pcon", "value", "key"], ascending=[True, False, True])
+
+    children = {}
+    for pcon, group in sectors.groupby("pcon", sort=False):
+        top = group.head(MAX_SECTORS_PER_CONSTITUENCY)
+        nodes = [{"name": key, "value": round(value, 2)} for key, value in zip(top["key"], top["value"])]
+        rest = group.iloc[MAX_SECTORS_PER_CONSTITUENCY:]
+        if not rest.empty:
+            nodes.append({
+                "name": f"Other sectors ({len(rest)})",
+                "value": round(rest["value"].sum(), 2),
+                "itemStyle": {"color": "#999999"},
+            })
+        children[pcon] = nodes
+    return children
+
 def main():
     if not INPUT_FILE.exists():
         print(f"File {INPUT_FILE} not found.")
-        return
+        raise SystemExit(1)
 
     # Read constituency name and mansion tax estimate from CSV, convert to £m
-    df = pd.read_csv(INPUT_FILE, usecols=["Constituency Name", "Mansion Tax Estimate"])
+    df = pd.read_csv(INPUT_FILE, usecols=["pcon", "Constituency Name", "Mansion Tax Estimate"])
 
-    if len(df.columns) < 2:
+    if len(df.columns) < 3:
         print("Error: Could not find expected columns in constituency_sales_by_bracket.csv")
-        return
+        raise SystemExit(1)
 
-    df.columns = ["name", "value"]
+    df.columns = ["pcon", "name", "value"]
+    sector_children = load_sector_children()
 
     # Clean data
     # Force numeric, convert to millions, coerce errors to NaN, then fill with 0
@@ -58,13 +95,16 @@ def main():
         val = row["value"]
         if val <= 0: continue
         
-        treemap_data.append({
+        node = {
             "name": row["name"],
             "value": val,
             "itemStyle": {
                 "color": PALETTE[i % len(PALETTE)] # type: ignore
             }
-        })
+        }
+        if row["pcon"] in sector_children:
+            node["children"] = sector_children[row["pcon"]]
+        treemap_data.append(node)
 
     # 2. Add "Other" category if there is remaining data
     if not rest_df.empty:
@@ -121,8 +161,20 @@ def main():
         ]
     }
 
+    if sector_children:
+        # Show constituencies first; clicking one zooms into its sectors
+        option["series"][0].update({
+            "leafDepth": 1,
+            "nodeClick": "zoomToNode",
+            "breadcrumb": {"show": True, "bottom": 5},
+        })
+
     OUTPUT_FILE.write_text(json.dumps(option, indent=2), encoding="utf-8")
     print(f"Treemap JSON written to {OUTPUT_FILE}")
 
+    manifest = {"datasets": {"treemap": publish_artifact(str(OUTPUT_FILE))}}
+    MANIFEST_FILE.write_text(json.dumps(manifest, indent=2), encoding="utf-8")
+    print(f"Treemap manifest written to {MANIFEST_FILE}")
+
 if __name__ == "__main__":
     main()
@@ -68,6 +68,7 @@ const TRANSACTION_METRIC_MAP = TRANSACTION_METRICS.reduce((acc, metric) => {
   return acc;
 }, {});
 
+// Defaults, replaced by the surcharge_rates in the data manifest (mansion_tax.py)
 const SURCHARGE_RATE_MAP = {
   tx_2m_to_2_5m_count: 2500,
   tx_2_5m_to_3_5m_count: 3500,
@@ -185,13 +186,26 @@ const BAND_LABELS = {
 };
 
 const POSTCODE_GEOJSON_URL = "postcode_sales_by_bracket.geojson";
+const POSTCODE_COLUMNAR_FORMAT = "mtc-columnar";
+const COLUMNAR_MAGIC = "MTC1";
 const CONSTITUENCY_GEOJSON_URL = "constituency_council_tax_bands.geojson";
 const DATA_MANIFEST_URL = "map_data_manifest.json";
+// Extra zoom levels a boundary resolution should still look right at, beyond
+// the initial England-wide view
+const BOUNDARY_ZOOM_HEADROOM = { small: 3, large: 5 };
+const SMALL_SCREEN_QUERY = "(max-width: 768px)";
 
 let geojsonData = null;
+let constituencyDataUrl = CONSTITUENCY_GEOJSON_URL;
+let constituencyTopologyObject = null;
 let geojsonLayer = null;
 let postcodeGeojsonData = null;
+let postcodeDataUrl = POSTCODE_GEOJSON_URL;
+let postcodeDataIsColumnar = false;
 let postcodeClusterLayer = null;
+// Tiling scheme for the pre-clustered postcode pyramid, from the data manifest
+let postcodeTileScheme = null;
+let postcodeSearchIndexPromise = null;
 let breaks = null;
 let constituencyIndex = [];
 let constituencyPropsByCode = new Map();
@@ -241,6 +255,9 @@ const datasetSizeHints = {
   [CONSTITUENCY_GEOJSON_URL]: 0,
   [POSTCODE_GEOJSON_URL]: 0,
 };
+// Per-encoding sizes of each dataset, from the manifest
+const datasetEncodedSizes = {};
+const ACCEPTED_ENCODINGS = ["br", "gzip"];
 let byteProgressEnabled = false;
 let expectedTotalBytes = 0;
 let totalBytesLoaded = 0;
@@ -363,15 +380,43 @@ function applyDataManifest(manifest) {
   if (!manifest || typeof manifest !== "object") return;
   const datasets = manifest.datasets || {};
   let total = 0;
+  // Dataset files are content-hashed, so the names come from the manifest
+  if (datasets.constituency && datasets.constituency.available && datasets.constituency.file) {
+    constituencyDataUrl = datasets.constituency.file;
+  }
+  if (datasets.postcode && datasets.postcode.available && datasets.postcode.file) {
+    postcodeDataUrl = datasets.postcode.file;
+  }
+  const boundaryLevel = chooseBoundaryLevel(datasets.constituency_topojson);
+  if (boundaryLevel) {
+    constituencyDataUrl = boundaryLevel.file;
+    constituencyTopologyObject = datasets.constituency_topojson.object;
+  }
+  const columnar = datasets.postcode_columnar;
+  if (columnar && columnar.available && columnar.file && columnar.format === POSTCODE_COLUMNAR_FORMAT) {
+    postcodeDataUrl = columnar.file;
+    postcodeDataIsColumnar = true;
+  }
+  const tiles = datasets.postcode_tiles;
+  if (tiles && tiles.available && tiles.url_template && tiles.index && tiles.index.file) {
+    postcodeTileScheme = tiles;
+  }
   const manifestMap = [
-    { key: "constituency", url: CONSTITUENCY_GEOJSON_URL },
-    { key: "postcode", url: POSTCODE_GEOJSON_URL },
+    { manifestEntry: boundaryLevel || datasets.constituency, url: constituencyDataUrl },
+    postcodeTileScheme
+      ? { manifestEntry: postcodeTileScheme.index, url: postcodeTileScheme.index.file }
+      : { manifestEntry: postcodeDataIsColumnar ? columnar : datasets.postcode, url: postcodeDataUrl },
   ];
 
   manifestMap.forEach(entry => {
-    const manifestEntry = datasets[entry.key];
+    const manifestEntry = entry.manifestEntry;
     if (!manifestEntry) return;
-    const bytes = Number(manifestEntry.bytes);
+    if (manifestEntry.encodings) {
+      datasetEncodedSizes[entry.url] = Object.fromEntries(
+        Object.entries(manifestEntry.encodings).map(([encoding, variant]) => [encoding, Number(variant.bytes)])
+      );
+    }
+    const bytes = expectedTransferBytes(manifestEntry);
     if (Number.isFinite(bytes) && bytes > 0) {
       datasetSizeHints[entry.url] = bytes;
       total += bytes;
@@ -384,10 +429,156 @@ function applyDataManifest(manifest) {
     totalBytesLoaded = 0;
     updateByteProgress();
   }
+
+  // Charges come from the pipeline's schedule (mansion_tax.py) when present
+  const rates = manifest.surcharge_rates || {};
+  Object.keys(SURCHARGE_RATE_MAP).forEach(key => {
+    const rate = Number(rates[key]);
+    if (Number.isFinite(rate) && rate >= 0) {
+      SURCHARGE_RATE_MAP[key] = rate;
+    }
+  });
+}
+
+// Bytes a dataset is expected to take on the wire: the smallest precompressed
+// variant the browser accepts, or the raw size without variants.
+function expectedTransferBytes(manifestEntry) {
+  const encodings = manifestEntry.encodings || {};
+  for (const encoding of ACCEPTED_ENCODINGS) {
+    const bytes = Number(encodings[encoding] && encodings[encoding].bytes);
+    if (Number.isFinite(bytes) && bytes > 0) return bytes;
+  }
+  return Number(manifestEntry.bytes);
+}
+
+// Response bodies are read decompressed, so when the server sent a
+// precompressed variant each decoded byte counts for less on the wire.
+function transferRatio(url, response) {
+  const sizes = datasetEncodedSizes[url];
+  const encoding = (response.headers.get("content-encoding") || "").trim().toLowerCase();
+  if (!sizes || !encoding || !sizes[encoding] || !sizes.identity) return 1;
+  return sizes[encoding] / sizes.identity;
+}
+
+// Picks the coarsest TopoJSON boundary level that still holds up a few zoom
+// levels in from the initial view (fewer on small screens or with Save-Data).
+function chooseBoundaryLevel(entry) {
+  if (!entry || !Array.isArray(entry.levels)) return null;
+  const levels = entry.levels.filter(level => level && level.available && level.file);
+  if (!levels.length) return null;
+  const connection = navigator.connection || {};
+  if (connection.saveData) return levels[0];
+  const smallScreen = typeof window.matchMedia === "function" && window.matchMedia(SMALL_SCREEN_QUERY).matches;
+  const headroom = smallScreen ? BOUNDARY_ZOOM_HEADROOM.small : BOUNDARY_ZOOM_HEADROOM.large;
+  const targetZoom = map.getBoundsZoom(ENGLAND_BOUNDS) + headroom;
+  const suitable = levels.find(level => {
+    const maxZoom = level.max_zoom;
+    return maxZoom === null || maxZoom === undefined || Number(maxZoom) >= targetZoom;
+  });
+  return suitable || levels[levels.length - 1];
+}
+
+function decodeTopologyArcs(topology) {
+  const transform = topology.transform;
+  return (topology.arcs || []).map(arc => {
+    if (!transform) return arc;
+    let x = 0;
+    let y = 0;
+    return arc.map(([dx, dy]) => {
+      x += dx;
+      y += dy;
+      return [
+        x * transform.scale[0] + transform.translate[0],
+        y * transform.scale[1] + transform.translate[1],
+      ];
+    });
+  });
+}
+
+// Expands one object of a TopoJSON topology into a GeoJSON FeatureCollection.
+function topologyToGeoJSON(topology, objectName) {
+  const arcs = decodeTopologyArcs(topology);
+  const objects = topology.objects || {};
+  const object = objects[objectName] || objects[Object.keys(objects)[0]] || { geometries: [] };
+
+  const ring = arcIndexes => {
+    const points = [];
+    arcIndexes.forEach(index => {
+      const arc = index >= 0 ? arcs[index] : arcs[~index].slice().reverse();
+      // Consecutive arcs share their junction point
+      points.push(...(points.length ? arc.slice(1) : arc));
+    });
+    return points;
+  };
+
+  const features = (object.geometries || []).map(geometry => {
+    let geoJsonGeometry = null;
+    if (geometry.type === "Polygon") {
+      geoJsonGeometry = { type: "Polygon", coordinates: geometry.arcs.map(ring) };
+    } else if (geometry.type === "MultiPolygon") {
+      geoJsonGeometry = { type: "MultiPolygon", coordinates: geometry.arcs.map(polygon => polygon.map(ring)) };
+    }
+    return { type: "Feature", properties: geometry.properties || {}, geometry: geoJsonGeometry };
+  });
+  return { type: "FeatureCollection", features };
+}
+
+// Reads the binary columnar layout written by columnar.py: a small JSON
+// header followed by little-endian column buffers. Numeric columns become
+// typed-array views on the payload; string columns are int32 codes into a
+// string table of offsets and UTF-8 bytes.
+function decodeColumnar(buffer) {
+  const view = new DataView(buffer);
+  const bytes = new Uint8Array(buffer);
+  const decoder = new TextDecoder();
+  if (decoder.decode(bytes.subarray(0, 4)) !== COLUMNAR_MAGIC) {
+    throw new Error("Not a columnar data file");
+  }
+  const headerLength = view.getUint32(4, true);
+  const header = JSON.parse(decoder.decode(bytes.subarray(8, 8 + headerLength)));
+  const arrayAt = (Type, [offset, length]) => new Type(buffer, offset, length / Type.BYTES_PER_ELEMENT);
+
+  const columns = {};
+  header.columns.forEach(column => {
+    if (column.type === "string") {
+      const offsets = arrayAt(Int32Array, column.offsets);
+      const data = bytes.subarray(column.data[0], column.data[0] + column.data[1]);
+      const table = [];
+      for (let i = 0; i + 1 < offsets.length; i++) {
+        table.push(decoder.decode(data.subarray(offsets[i], offsets[i + 1])));
+      }
+      columns[column.name] = { codes: arrayAt(Int32Array, column.codes), table };
+    } else {
+      const Type = { float32: Float32Array, float64: Float64Array }[column.type] || Int32Array;
+      columns[column.name] = arrayAt(Type, column.values);
+    }
+  });
+  return { rows: header.rows, columns };
+}
+
+// Expands the decoded postcode columns into the GeoJSON shape the postcode
+// layer and search index are built from.
+function columnarToGeoJSON(table) {
+  const names = Object.keys(table.columns);
+  const features = [];
+  for (let row = 0; row < table.rows; row++) {
+    const properties = {};
+    names.forEach(name => {
+      const column = table.columns[name];
+      properties[name] = column.table ? column.table[column.codes[row]] : column[row];
+    });
+    features.push({
+      type: "Feature",
+      properties,
+      geometry: { type: "Point", coordinates: [properties.long, properties.lat] },
+    });
+  }
+  return { type: "FeatureCollection", features };
 }
 
 function fetchDataManifest() {
-  return fetch(DATA_MANIFEST_URL)
+  // The manifest is the one file that changes name-in-place between deploys
+  return fetch(DATA_MANIFEST_URL, { cache: "no-cache" })
     .then(response => {
       if (!response.ok) {
         throw new Error(`Failed to load data manifest: ${response.statusText}`);
@@ -1353,44 +1544,147 @@ function createPostcodeClusterLayer(data) {
   const clusterGroup = L.markerClusterGroup({
     showCoverageOnHover: false,
     spiderfyDistanceMultiplier: 1.2,
-    iconCreateFunction: cluster => {
-      const count = cluster.getChildCount();
-      const size = getClusterMarkerSize(count);
-      return L.divIcon({
-        html: `<span class="postcode-cluster" style="width:${size}px;height:${size}px;"><span class="postcode-cluster-count">${formatCount(count)}</span></span>`,
-        className: "postcode-cluster-wrapper",
-        iconSize: [size, size],
-        iconAnchor: [size / 2, size / 2],
-      });
-    }
+    iconCreateFunction: cluster => getClusterMarkerIcon(cluster.getChildCount())
   });
 
   const pointLayer = L.geoJSON(data, {
-    pointToLayer: (feature, latlng) => {
-      const props = feature.properties || {};
-      const label = getPostcodeDisplayName(props);
-      const hvCount = toNumberOrNull(props.hv_count);
-      const marker = L.marker(latlng, {
-        title: label,
-        riseOnHover: true,
-        icon: getPostcodeMarkerIcon(hvCount),
-      });
-      const tooltipContent = `
-        <strong>${label}</strong><br/>
-        ${formatCount(hvCount)} mansion tax properties
-      `;
-      marker.bindTooltip(tooltipContent, { direction: "top" });
-      marker.on("click", () => {
-        setSelectedPostcode(props);
-      });
-      return marker;
-    }
+    pointToLayer: (feature, latlng) => createPostcodeMarker(latlng, feature.properties || {})
   });
 
   clusterGroup.addLayer(pointLayer);
   return clusterGroup;
 }
 
+function createPostcodeMarker(latlng, props) {
+  const label = getPostcodeDisplayName(props);
+  const hvCount = toNumberOrNull(props.hv_count);
+  const marker = L.marker(latlng, {
+    title: label,
+    riseOnHover: true,
+    icon: getPostcodeMarkerIcon(hvCount),
+  });
+  const tooltipContent = `
+    <strong>${label}</strong><br/>
+    ${formatCount(hvCount)} mansion tax properties
+  `;
+  marker.bindTooltip(tooltipContent, { direction: "top" });
+  marker.on("click", () => {
+    setSelectedPostcode(props);
+  });
+  return marker;
+}
+
+// Postcode layer backed by the pre-clustered tile pyramid written by step 2:
+// only the tiles covering the viewport at the current zoom are fetched, and
+// each tile's markers are built once and kept for reuse.
+function createPostcodeTileLayer(scheme, tileIndex) {
+  const layer = L.layerGroup();
+  const tileSize = Number(scheme.tile_size) || 256;
+  const minZoom = Number(scheme.min_zoom);
+  const maxZoom = Number(scheme.max_zoom);
+  const tiles = new Map();
+  let visibleKeys = new Set();
+
+  function rowToObject(columns, row) {
+    const obj = {};
+    columns.forEach((column, i) => {
+      obj[column] = row[i];
+    });
+    return obj;
+  }
+
+  function buildTileLayer(tile) {
+    const group = L.layerGroup();
+    (tile.clusters || []).forEach(row => {
+      const cluster = rowToObject(scheme.cluster_columns, row);
+      const latlng = L.latLng(cluster.lat, cluster.long);
+      const marker = L.marker(latlng, { icon: getClusterMarkerIcon(cluster.points) });
+      marker.bindTooltip(`
+        <strong>${formatCount(cluster.points)} postcodes</strong><br/>
+        ${formatCount(cluster.hv_count)} mansion tax properties
+      `, { direction: "top" });
+      marker.on("click", () => {
+        map.setView(latlng, Math.min(map.getZoom() + 2, map.getMaxZoom()), { animate: true });
+      });
+      group.addLayer(marker);
+    });
+    (tile.points || []).forEach(row => {
+      const props = rowToObject(scheme.point_columns, row);
+      group.addLayer(createPostcodeMarker(L.latLng(props.lat, props.long), props));
+    });
+    return group;
+  }
+
+  function loadTile(key) {
+    if (!tiles.has(key)) {
+      const url = scheme.url_template.replace("{z}", key.z).replace("{x}", key.x).replace("{y}", key.y);
+      const entry = { layer: null };
+      entry.promise = fetch(url)
+        .then(response => {
+          if (!response.ok) throw new Error(`Failed to load postcode tile ${url}: ${response.statusText}`);
+          return response.json();
+        })
+        .then(tile => {
+          entry.layer = buildTileLayer(tile);
+          return entry.layer;
+        })
+        .catch(err => {
+          console.warn(err);
+          tiles.delete(key.id);
+          return null;
+        });
+      tiles.set(key.id, entry);
+    }
+    return tiles.get(key.id).promise;
+  }
+
+  function update() {
+    const z = Math.max(minZoom, Math.min(maxZoom, Math.floor(map.getZoom())));
+    const bounds = map.getBounds();
+    const topLeft = map.project(bounds.getNorthWest(), z).divideBy(tileSize).floor();
+    const bottomRight = map.project(bounds.getSouthEast(), z).divideBy(tileSize).floor();
+    const zoomIndex = tileIndex[String(z)] || {};
+    const wanted = new Set();
+    for (let x = topLeft.x; x <= bottomRight.x; x++) {
+      const ys = zoomIndex[String(x)];
+      if (!ys) continue;
+      ys.forEach(y => {
+        if (y >= topLeft.y && y <= bottomRight.y) {
+          wanted.add(`${z}/${x}/${y}`);
+        }
+      });
+    }
+
+    visibleKeys.forEach(id => {
+      const entry = tiles.get(id);
+      if (!wanted.has(id) && entry && entry.layer) {
+        layer.removeLayer(entry.layer);
+      }
+    });
+    visibleKeys = wanted;
+    wanted.forEach(id => {
+      const [tz, tx, ty] = id.split("/");
+      loadTile({ id, z: tz, x: tx, y: ty }).then(tileLayer => {
+        // The view may have moved on while the tile was loading
+        if (tileLayer && visibleKeys.has(id) && map.hasLayer(layer)) {
+          layer.addLayer(tileLayer);
+        }
+      });
+    });
+  }
+
+  layer.on("add", () => {
+    map.on("moveend", update);
+    update();
+  });
+  layer.on("remove", () => {
+    map.off("moveend", update);
+    layer.clearLayers();
+    visibleKeys = new Set();
+  });
+  return layer;
+}
+
 function getPostcodeMarkerIcon(count) {
   const baseSize = 36;
   const size = count > 25 ? 50 : count > 10 ? 42 : baseSize;
@@ -1403,6 +1697,16 @@ function getPostcodeMarkerIcon(count) {
   });
 }
 
+function getClusterMarkerIcon(count) {
+  const size = getClusterMarkerSize(count);
+  return L.divIcon({
+    html: `<span class="postcode-cluster" style="width:${size}px;height:${size}px;"><span class="postcode-cluster-count">${formatCount(count)}</span></span>`,
+    className: "postcode-cluster-wrapper",
+    iconSize: [size, size],
+    iconAnchor: [size / 2, size / 2],
+  });
+}
+
 function getClusterMarkerSize(count) {
   if (count > 200) return 80;
   if (count > 100) return 68;
@@ -1702,6 +2006,31 @@ function buildPostcodeIndex() {
     .filter(Boolean);
 }
 
+// With the tiled postcode layer the full postcode GeoJSON is only needed for
+// search, so it is fetched the first time someone searches.
+function ensurePostcodeSearchIndex() {
+  if (!postcodeSearchIndexPromise) {
+    postcodeSearchIndexPromise = postcodeGeojsonData
+      ? Promise.resolve()
+      : fetch(postcodeDataUrl)
+        .then(response => {
+          if (!response.ok) throw new Error(`Failed to load postcode data: ${response.statusText}`);
+          return postcodeDataIsColumnar
+            ? response.arrayBuffer().then(buffer => columnarToGeoJSON(decodeColumnar(buffer)))
+            : response.json();
+        })
+        .then(data => {
+          postcodeGeojsonData = data;
+          buildPostcodeIndex();
+        })
+        .catch(err => {
+          console.warn(err);
+          postcodeSearchIndexPromise = null;
+        });
+  }
+  return postcodeSearchIndexPromise;
+}
+
 function updateSearchResults(term) {
   if (selectedDataset === "mansion_tax_postcodes") {
     updatePostcodeSearchResults(term);
@@ -1765,6 +2094,17 @@ function updatePostcodeSearchResults(term) {
     return;
   }
 
+  if (postcodeTileScheme && !postcodeGeojsonData) {
+    currentSearchMatches = [buildMessageResult("Loading postcodes…")];
+    renderSearchResults(currentSearchMatches);
+    ensurePostcodeSearchIndex().then(() => {
+      if (postcodeGeojsonData && searchInput.value.trim().toLowerCase() === query) {
+        updatePostcodeSearchResults(searchInput.value);
+      }
+    });
+    return;
+  }
+
   const exactMatch = postcodeIndex.find(entry => entry.clean.toLowerCase() === query || entry.label.toLowerCase() === query);
   if (exactMatch) {
     focusOnPostcodeEntry(exactMatch, { zoom: true });
@@ -2312,6 +2652,7 @@ function fetchJsonWithProgress(url, label) {
     }
     const contentLength = Number(response.headers.get("content-length"));
     const expectedSize = Number.isFinite(contentLength) ? contentLength : sizeHint;
+    const ratio = transferRatio(url, response);
     const supportsStreaming = response.body && typeof response.body.getReader === "function" && typeof TextDecoder !== "undefined";
 
     if (!supportsStreaming) {
@@ -2320,7 +2661,7 @@ function fetchJsonWithProgress(url, label) {
         .then(text => {
           stopSyntheticProgress(syntheticProgress);
           const parsed = text ? JSON.parse(text) : {};
-          const byteLength = estimateByteLengthFromText(text);
+          const byteLength = Math.round(estimateByteLengthFromText(text) * ratio);
           if (byteLength > 0) {
             recordBytesLoaded(byteLength);
           }
@@ -2346,9 +2687,63 @@ function fetchJsonWithProgress(url, label) {
           return JSON.parse(text);
         }
         if (value && value.length) {
-          datasetLoaded += value.length;
+          datasetLoaded += value.length * ratio;
           text += decoder.decode(value, { stream: true });
-          recordBytesLoaded(value.length);
+          recordBytesLoaded(value.length * ratio);
+        }
+        return readChunk();
+      });
+    }
+
+    return readChunk();
+  });
+}
+
+function fetchArrayBufferWithProgress(url, label) {
+  const sizeHint = Number(datasetSizeHints[url]) || 0;
+  return fetch(url).then(response => {
+    if (!response.ok) {
+      throw new Error(`Failed to load ${label}: ${response.statusText}`);
+    }
+    const contentLength = Number(response.headers.get("content-length"));
+    const expectedSize = Number.isFinite(contentLength) ? contentLength : sizeHint;
+    const ratio = transferRatio(url, response);
+
+    if (!response.body || typeof response.body.getReader !== "function") {
+      const syntheticProgress = startSyntheticProgress(expectedSize || sizeHint);
+      return response.arrayBuffer()
+        .then(buffer => {
+          stopSyntheticProgress(syntheticProgress);
+          const byteLength = Math.round(buffer.byteLength * ratio);
+          recordBytesLoaded(byteLength);
+          finalizeDatasetProgress(byteLength, expectedSize);
+          return buffer;
+        })
+        .catch(err => {
+          stopSyntheticProgress(syntheticProgress);
+          throw err;
+        });
+    }
+
+    const reader = response.body.getReader();
+    const chunks = [];
+
+    function readChunk() {
+      return reader.read().then(({ done, value }) => {
+        if (done) {
+          const byteLength = chunks.reduce((sum, chunk) => sum + chunk.length, 0);
+          finalizeDatasetProgress(byteLength * ratio, expectedSize);
+          const bytes = new Uint8Array(byteLength);
+          let offset = 0;
+          chunks.forEach(chunk => {
+            bytes.set(chunk, offset);
+            offset += chunk.length;
+          });
+          return bytes.buffer;
+        }
+        if (value && value.length) {
+          chunks.push(value);
+          recordBytesLoaded(value.length * ratio);
         }
         return readChunk();
       });
@@ -2358,14 +2753,29 @@ function fetchJsonWithProgress(url, label) {
   });
 }
 
+function fetchPostcodeData() {
+  if (postcodeDataIsColumnar) {
+    return fetchArrayBufferWithProgress(postcodeDataUrl, "postcode data")
+      .then(buffer => columnarToGeoJSON(decodeColumnar(buffer)));
+  }
+  return fetchJsonWithProgress(postcodeDataUrl, "postcode data");
+}
+
 function loadPrimaryDatasets() {
   Promise.all([
-    fetchJsonWithProgress(CONSTITUENCY_GEOJSON_URL, "constituency map data"),
-    fetchJsonWithProgress(POSTCODE_GEOJSON_URL, "postcode data")
+    fetchJsonWithProgress(constituencyDataUrl, "constituency map data")
+      .then(data => (data && data.type === "Topology" ? topologyToGeoJSON(data, constituencyTopologyObject) : data)),
+    postcodeTileScheme
+      ? fetchJsonWithProgress(postcodeTileScheme.index.file, "postcode tile index")
+      : fetchPostcodeData()
   ])
     .then(([constituencyData, postcodeData]) => {
       geojsonData = constituencyData;
-      postcodeGeojsonData = postcodeData;
+      if (postcodeTileScheme) {
+        postcodeClusterLayer = createPostcodeTileLayer(postcodeTileScheme, postcodeData);
+      } else {
+        postcodeGeojsonData = postcodeData;
+      }
       computeGlobalStatMaximums();
 
       geojsonLayer = L.geoJSON(geojsonData, {
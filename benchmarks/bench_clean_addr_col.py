@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+
+# © Tax Policy Associates 2025
+#
+# Micro-benchmark for clean_addr_col: checks the unique-value/translate
+# implementation against the original per-row regex on a synthetic address
+# column, then times both. Exits with status 1, before timing anything, if
+# the two disagree on any value.
+#
+#   python benchmarks/bench_clean_addr_col.py --rows 5000000
+
+import argparse
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+import common  # noqa: F401  (puts the repo root on sys.path)
+import postcodes
+
+# Awkward values the two implementations must agree on: punctuation, lower
+# case, latin1 accents (removed), and characters whose upper() expands.
+EDGE_CASES = ["flat 1/2", "  12a ", "sw1a 1aa", "Café", "straße", "½", "NO. 7-9", "", None, np.nan]
+
+
+def clean_addr_col_regex(series):
+    """The original implementation, kept here as the reference."""
+    return (series.fillna('')
+            .astype(str)
+            .str.upper()
+            .str.replace(r'[^A-Z0-9]', '', regex=True))
+
+
+def synthetic_column(rows, distinct, seed=0):
+    rng = np.random.default_rng(seed)
+    letters = np.array(list("ABCDEFGHJKLMNPRSTUWYZ"))
+    pool = [
+        f"{rng.choice(letters)}{rng.choice(letters).lower()}{rng.integers(1, 30)} {rng.integers(0, 10)}{rng.choice(letters)}{rng.choice(letters)}"
+        for _ in range(distinct)
+    ]
+    pool = np.array(pool + EDGE_CASES, dtype=object)
+    return pd.Series(pool[rng.integers(0, len(pool), rows)])
+
+
+def check_equivalent(series):
+    """
+    Exits with status 1, listing a few of the values, if clean_addr_col and
+    the reference disagree anywhere in series.
+    """
+    expected = clean_addr_col_regex(series)
+    actual = postcodes.clean_addr_col(series)
+    differ = actual.to_numpy(dtype=object) != expected.to_numpy(dtype=object)
+    if len(actual) != len(expected) or differ.any():
+        print(f"FAIL: clean_addr_col differs from the regex on {differ.sum():,} of {len(series):,} rows, e.g.:")
+        for value, got, want in list(zip(series[differ], actual[differ], expected[differ]))[:10]:
+            print(f"  {value!r}: {got!r}, expected {want!r}")
+        sys.exit(1)
+    print(f"Equivalent on {len(series):,} rows ({series.nunique():,} distinct values).")
+
+
+def best_of(func, series, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(series)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--distinct", type=int, default=50_000,
+                        help="Number of distinct values in the column (postcodes repeat heavily).")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    series = synthetic_column(args.rows, args.distinct)
+    unique_series = synthetic_column(args.rows // 4, args.rows // 4, seed=1).drop_duplicates()
+    check_equivalent(pd.Series(EDGE_CASES, dtype=object))
+    check_equivalent(series)
+    check_equivalent(unique_series)
+
+    baseline = best_of(clean_addr_col_regex, series, args.repeat)
+    optimised = best_of(postcodes.clean_addr_col, series, args.repeat)
+    print(f"regex per row:       {baseline:8.3f}s")
+    print(f"unique + translate:  {optimised:8.3f}s  ({baseline / optimised:.1f}x)")
+
+    # NSPL-like column: every value distinct, so only the translate path helps
+    baseline = best_of(clean_addr_col_regex, unique_series, args.repeat)
+    optimised = best_of(postcodes.clean_addr_col, unique_series, args.repeat)
+    print(f"all-distinct column ({len(unique_series):,} rows):")
+    print(f"regex per row:       {baseline:8.3f}s")
+    print(f"unique + translate:  {optimised:8.3f}s  ({baseline / optimised:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
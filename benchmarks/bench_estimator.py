@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+
+# © Tax Policy Associates 2025
+#
+# Throughput of the batch estimator (estimator.py). Writes a CSV of --rows
+# properties with postcodes drawn from the NSPL in --data-dir (some in lower
+# case or without the space, about 1% unknown), then times scoring it in
+# memory with PropertyEstimator.estimate and end to end (read, score, write)
+# with estimate_csv, and reports rows per second for each:
+#
+#   python benchmarks/synthetic_data.py --out benchmarks/data/100k
+#   python benchmarks/bench_estimator.py --data-dir benchmarks/data/100k --rows 5000000
+#
+# --threads limits pyarrow's CSV reader and writer (default 1, to measure
+# one core).
+
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+import common  # noqa: F401  (puts the repo root on sys.path)
+import estimator
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+
+def synthetic_portfolio(postcodes, n_rows, seed=0):
+    """
+    A DataFrame of n_rows properties (id, postcode, price, date) with
+    postcodes drawn from postcodes.
+    """
+    rng = np.random.default_rng(seed)
+    chosen = pd.Series(postcodes[rng.integers(0, len(postcodes), n_rows)], dtype=object)
+    variant = rng.random(n_rows)
+    chosen[variant < 0.1] = chosen[variant < 0.1].str.lower()
+    chosen[(variant >= 0.1) & (variant < 0.2)] = chosen[(variant >= 0.1) & (variant < 0.2)].str.replace(" ", "")
+    chosen[variant >= 0.99] = "ZZ99 9ZZ"
+    days = rng.integers(0, 365 * 30, n_rows)
+    return pd.DataFrame({
+        "id": np.arange(n_rows),
+        "postcode": chosen.to_numpy(),
+        "price": np.round(np.exp(rng.normal(12.8, 0.8, n_rows)), -2),
+        "date": (np.datetime64("1995-01-01") + days).astype(str),
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--data-dir", required=True,
+                        help="Directory with the NSPL CSV and house price workbook (e.g. synthetic_data.py output).")
+    parser.add_argument("--rows", type=int, default=5_000_000)
+    parser.add_argument("--batch-rows", type=int, default=estimator.ESTIMATE_BATCH_ROWS)
+    parser.add_argument("--threads", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    os.chdir(args.data_dir)
+    if pa is not None:
+        pa.set_cpu_count(args.threads)
+        pa.set_io_thread_count(args.threads)
+
+    start = time.perf_counter()
+    scorer = estimator.PropertyEstimator.load()
+    print(f"Loaded the NSPL index and inflation factors in {time.perf_counter() - start:.2f}s")
+
+    portfolio = synthetic_portfolio(scorer.nspl_index["pcds"].astype(str), args.rows, args.seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        input_path = os.path.join(tmp, "portfolio.csv")
+        output_path = os.path.join(tmp, "portfolio_scored.csv")
+        portfolio.to_csv(input_path, index=False)
+        size = os.path.getsize(input_path)
+        print(f"Wrote {args.rows:,} rows ({size / 1e6:.0f} MB)")
+
+        start = time.perf_counter()
+        scored = scorer.estimate(portfolio["postcode"], portfolio["price"].to_numpy(),
+                                 portfolio["date"].to_numpy(dtype="datetime64[D]"))
+        elapsed = time.perf_counter() - start
+        print(f"estimate():     {elapsed:.2f}s, {args.rows / elapsed:,.0f} rows/s")
+        print("  " + ", ".join(f"{status} {count:,}" for status, count in scored["status"].value_counts().items()))
+
+        start = time.perf_counter()
+        rows = estimator.estimate_csv(scorer, input_path, output_path, batch_rows=args.batch_rows)
+        elapsed = time.perf_counter() - start
+        engine = "pyarrow" if pa is not None else "pandas"
+        print(f"estimate_csv(): {elapsed:.2f}s, {rows / elapsed:,.0f} rows/s, {size / elapsed / 1e6:.0f} MB/s "
+              f"in ({engine}, {args.threads} thread(s))")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+
+# © Tax Policy Associates 2025
+#
+# End-to-end benchmark: runs main() of the three pipeline scripts against the
+# synthetic inputs from synthetic_data.py and records each stage's wall time,
+# CPU time and peak RSS (from the scripts' run reports). Results are saved to
+# benchmarks/results/ tagged with the git commit, so runs on different
+# commits can be compared:
+#
+#   python benchmarks/bench_pipeline.py --scale 1m --repeat 3
+#   python benchmarks/bench_pipeline.py --compare results/A.json results/B.json
+#
+# Each script runs in its own process so peak RSS is per script. Inputs are
+# generated on first use and kept in benchmarks/data/<scale>/. Nothing needs
+# the network.
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+from datetime import datetime, timezone
+from pathlib import Path
+
+import common
+from common import REPO_ROOT, PIPELINE_SCRIPTS
+from synthetic_data import transactions_for
+
+BENCH_DIR = Path(__file__).resolve().parent
+DATA_DIR = BENCH_DIR / "data"
+RESULTS_DIR = BENCH_DIR / "results"
+
+# Caches and outputs the pipeline leaves in its working directory; cleared
+# before each cold run
+PIPELINE_STATE = ["ppd_cache", "ppd_stream_spill", "ppd_state", "nspl_index", "uprated_prices",
+                  "inflation_factors.npz", "repeat_sales_index.npz", "reference_cache", "postcode_tiles", "run_reports"]
+STAGE_FIELDS = ["wall_s", "cpu_s", "cpu_children_s", "peak_rss_mb", "rows_in", "rows_out"]
+
+
+def run_main(key, report_path, use_cache):
+    """
+    Runs one script's main() in this process. The treemap script has no run
+    report of its own, so it is timed as a single stage.
+    """
+    from run_report import RunReport
+
+    module = common.load_script(key)
+    if key == "read_transactions":
+        module.main(use_cache=use_cache, report_path=report_path)
+    elif key == "build_webapp_data":
+        module.main(report_path=report_path)
+    else:
+        with RunReport(PIPELINE_SCRIPTS[key], report_path=report_path) as report:
+            with report.stage("Writing treemap JSON"):
+                module.main()
+
+
+def run_script(key, work_dir, report_path, use_cache):
+    command = [sys.executable, str(Path(__file__).resolve()), "--run-main", key, "--report", str(report_path)]
+    if not use_cache:
+        command.append("--no-cache")
+    log_path = report_path.with_suffix(".log")
+    with open(log_path, "w", encoding="utf-8") as log:
+        result = subprocess.run(command, cwd=work_dir, stdout=log, stderr=subprocess.STDOUT)
+    if result.returncode != 0:
+        raise RuntimeError(f"{PIPELINE_SCRIPTS[key]} failed; see {log_path}")
+    with open(report_path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def clear_pipeline_state(work_dir):
+    for name in PIPELINE_STATE:
+        path = work_dir / name
+        if path.is_dir():
+            shutil.rmtree(path)
+        elif path.exists():
+            path.unlink()
+
+
+def git_revision():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT,
+                                capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=REPO_ROOT,
+                                    capture_output=True, text=True, check=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown", None
+    return commit, dirty
+
+
+def best_stages(reports):
+    """
+    Per stage, the fastest of the repeats (stages are matched by name).
+    """
+    stages = {}
+    for report in reports:
+        for stage in report["stages"]:
+            record = {field: stage.get(field) for field in STAGE_FIELDS}
+            best = stages.get(stage["stage"])
+            if best is None or record["wall_s"] < best["wall_s"]:
+                stages[stage["stage"]] = record
+    return [{"stage": name, **record} for name, record in stages.items()]
+
+
+def run_benchmark(scale, repeat, scripts, cache, seed):
+    work_dir = DATA_DIR / scale.lower()
+    transactions = transactions_for(scale)
+    if not (work_dir / "pp-complete.csv").exists():
+        print(f"Generating synthetic inputs ({transactions:,} transactions) in {work_dir}/...")
+        # In a child process, so its memory does not count towards the
+        # scripts' peak RSS (Linux carries ru_maxrss across exec)
+        subprocess.run([sys.executable, str(BENCH_DIR / "synthetic_data.py"), str(transactions),
+                        "--out", str(work_dir), "--seed", str(seed)], check=True)
+
+    commit, dirty = git_revision()
+    started = datetime.now(timezone.utc)
+    run_dir = RESULTS_DIR / f"{scale.lower()}-{commit}-{started.strftime('%Y%m%dT%H%M%SZ')}"
+    run_dir.mkdir(parents=True)
+
+    reports = {key: [] for key in scripts}
+    for i in range(repeat):
+        if cache != "warm" or i == 0:
+            clear_pipeline_state(work_dir)
+        if cache == "warm" and i == 0:
+            # Populate the caches once without timing it
+            run_script("read_transactions", work_dir, run_dir / "warmup.json", use_cache=True)
+        for key in scripts:
+            print(f"[{i + 1}/{repeat}] {PIPELINE_SCRIPTS[key]}...")
+            report = run_script(key, work_dir, run_dir / f"{key}-{i + 1}.json", use_cache=cache != "off")
+            peak = report["peak_rss_mb"]
+            print(f"    {report['wall_s']:.2f}s, peak RSS " + ("unavailable" if peak is None else f"{peak:.0f} MB"))
+            reports[key].append(report)
+
+    result = {
+        "commit": commit,
+        "dirty": dirty,
+        "scale": scale.lower(),
+        "transactions": transactions,
+        "seed": seed,
+        "cache": cache,
+        "repeat": repeat,
+        "started": started.isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "scripts": {
+            key: {
+                "script": PIPELINE_SCRIPTS[key],
+                "wall_s": min(r["wall_s"] for r in runs),
+                "peak_rss_mb": min((r["peak_rss_mb"] for r in runs if r["peak_rss_mb"] is not None), default=None),
+                "stages": best_stages(runs),
+            }
+            for key, runs in reports.items()
+        },
+    }
+    result_path = run_dir.with_suffix(".json")
+    with open(result_path, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2)
+    print(f"Results written to {result_path}")
+    return result
+
+
+def compare(path_a, path_b):
+    with open(path_a, encoding="utf-8") as f:
+        a = json.load(f)
+    with open(path_b, encoding="utf-8") as f:
+        b = json.load(f)
+    if (a["scale"], a["cache"]) != (b["scale"], b["cache"]):
+        print(f"Note: comparing {a['scale']}/{a['cache']} with {b['scale']}/{b['cache']}.")
+    print(f"{'stage':<48} {a['commit']:>10} {b['commit']:>10} {'ratio':>7}")
+    for key in [key for key in a["scripts"] if key in b["scripts"]]:
+        print(f"-- {a['scripts'][key]['script']}")
+        before = {stage["stage"]: stage for stage in a["scripts"][key]["stages"]}
+        after = {stage["stage"]: stage for stage in b["scripts"][key]["stages"]}
+        rows = [(name, before.get(name), after.get(name)) for name in list(before) + [n for n in after if n not in before]]
+        rows.append(("total", a["scripts"][key], b["scripts"][key]))
+        for name, x, y in rows:
+            x_s = f"{x['wall_s']:.2f}s" if x else "-"
+            y_s = f"{y['wall_s']:.2f}s" if y else "-"
+            ratio = f"{y['wall_s'] / x['wall_s']:.2f}x" if x and y and x["wall_s"] > 0 else ""
+            print(f"{name[:48]:<48} {x_s:>10} {y_s:>10} {ratio:>7}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Time the pipeline scripts on synthetic data.")
+    parser.add_argument("--scale", default="100k", help="100k, 1m, 10m or a number of transactions.")
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per script; the fastest is kept per stage.")
+    parser.add_argument("--scripts", nargs="+", choices=list(PIPELINE_SCRIPTS), default=list(PIPELINE_SCRIPTS))
+    parser.add_argument("--cache", choices=["cold", "warm", "off"], default="cold",
+                        help="cold: clear the pipeline's caches before each run (default); warm: keep them "
+                             "populated; off: run step 1 with --no-cache.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for generating the synthetic inputs.")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"),
+                        help="Print a stage-by-stage comparison of two result files and exit.")
+    # Used internally to run one script's main() in a child process
+    parser.add_argument("--run-main", choices=list(PIPELINE_SCRIPTS), help=argparse.SUPPRESS)
+    parser.add_argument("--report", help=argparse.SUPPRESS)
+    parser.add_argument("--no-cache", dest="use_cache", action="store_false", help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.run_main:
+        run_main(args.run_main, args.report, args.use_cache)
+    elif args.compare:
+        compare(*args.compare)
+    else:
+        run_benchmark(args.scale, args.repeat, args.scripts, args.cache, args.seed)
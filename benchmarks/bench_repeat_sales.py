@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+
+# © Tax Policy Associates 2025
+#
+# Times the repeat-sales index (repeat_sales.py) on a synthetic sales history
+# with a known index: each property's log price is the true log index of its
+# region and tier plus a fixed property effect and noise on every sale.
+# Reports the pair count, timings and the error of the fitted quarterly
+# index changes against the truth:
+#
+#   python benchmarks/bench_repeat_sales.py --properties 10000000
+
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+import common  # noqa: F401  (puts the repo root on sys.path)
+import repeat_sales
+
+QUARTERS = 121
+REGIONS = 120
+
+
+def synthetic_history(n_properties, sales_per_property, seed=0):
+    """
+    Sales of n_properties properties (sales_per_property on average) as
+    (postcodes, property_ids, dates, prices), the region names, and the true
+    (region x tier x quarter) log index.
+    """
+    rng = np.random.default_rng(seed)
+    n_tiers = len(repeat_sales.TIER_QUANTILES) + 1
+    # Over 30 years regions drift apart by about 0.2 in logs, the top tier
+    # gains about 0.5 on the bottom
+    region_growth = rng.normal(0.015, 0.002, REGIONS)
+    tier_growth = np.linspace(0.0, 0.004, n_tiers)
+    shocks = rng.normal(0, 0.01, (REGIONS, n_tiers, QUARTERS))
+    true_index = np.cumsum(region_growth[:, None, None] + tier_growth[None, :, None] + shocks, axis=2)
+    true_index -= true_index[:, :, -1:]
+
+    counts = rng.poisson(sales_per_property - 1, n_properties) + 1
+    property_ids = np.repeat(np.arange(n_properties, dtype="uint64"), counts)
+    region = rng.integers(0, REGIONS, n_properties)
+    effect = rng.normal(12.0, 0.6, n_properties)
+    tier = np.searchsorted(np.quantile(effect, repeat_sales.TIER_QUANTILES), effect, side="right")
+
+    quarters = rng.integers(0, QUARTERS, len(property_ids))
+    months = np.datetime64("1995-01", "M") + (quarters * 3 + rng.integers(0, 3, len(quarters)))
+    dates = months.astype("datetime64[D]") + rng.integers(0, 28, len(quarters))
+    r, t = region[property_ids], tier[property_ids]
+    prices = np.exp(effect[property_ids] + true_index[r, t, quarters] + rng.normal(0, 0.1, len(quarters)))
+
+    letters = [chr(65 + i) for i in range(26)]
+    areas = [a + b for a in letters for b in letters][:REGIONS]
+    postcodes = pd.Categorical.from_codes(r, [f"{area}11AA" for area in areas])
+    return postcodes, property_ids, dates, prices, areas, true_index
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--properties", type=int, default=1_000_000)
+    parser.add_argument("--sales-per-property", type=float, default=3.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    postcodes, property_ids, dates, prices, areas, true_index = synthetic_history(
+        args.properties, args.sales_per_property, args.seed
+    )
+    print(f"Generated {len(prices):,} sales in {time.perf_counter() - start:.1f}s")
+
+    start = time.perf_counter()
+    index = repeat_sales.build_repeat_sales_index(postcodes, property_ids, dates, prices)
+    elapsed = time.perf_counter() - start
+    print(f"Fitted {index['pairs']:,} pairs in {elapsed:.1f}s")
+
+    # The last quarter is 0 in both by construction
+    fitted = index["log_index"][pd.Index(index["regions"]).get_indexer(areas)]
+    errors = (fitted - true_index)[:, :, :-1]
+    print(f"Log index error vs truth: RMSE {np.sqrt(np.mean(errors ** 2)):.4f}, max {np.abs(errors).max():.4f}")
+    for tier in range(errors.shape[1]):
+        print(f"  tier {tier}: RMSE {np.sqrt(np.mean(errors[:, tier] ** 2)):.4f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,29 @@
+# © Tax Policy Associates 2025
+
+import importlib.util
+import sys
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+# Make the shared modules at the repo root (postcodes.py etc.) importable
+if str(REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(REPO_ROOT))
+
+PIPELINE_SCRIPTS = {
+    "read_transactions": "1_read_transaction_data_and_create_csvs.py",
+    "build_webapp_data": "2_build_data_for_webapp.py",
+    "treemap": "3_treemap_generator.py",
+}
+
+
+def load_script(key):
+    """
+    Imports one of the numbered pipeline scripts as a module (their file names
+    start with a digit, so a plain import statement cannot reach them).
+    """
+    path = REPO_ROOT / PIPELINE_SCRIPTS[key]
+    spec = importlib.util.spec_from_file_location(f"pipeline_{key}", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+
+# © Tax Policy Associates 2025
+#
+# Load test for query_service.py: many concurrent keep-alive connections
+# sending a mix of point, prefix, bounding-box and ranking queries, built
+# from the real postcodes and constituencies in the data directory. Reports
+# throughput and latency percentiles per query type:
+#
+#   python benchmarks/load_test.py --data-dir benchmarks/data/100k --spawn
+#   python benchmarks/load_test.py --port 8765 --connections 200 --duration 30
+#
+# --spawn starts the service in a child process (on --port) for the run and
+# stops it afterwards; otherwise a running service is expected.
+
+import argparse
+import asyncio
+import json
+import random
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from urllib.parse import quote
+
+import numpy as np
+
+from common import REPO_ROOT
+from query_service import DEFAULT_HOST, DEFAULT_PORT, ResultIndex
+
+# Share of requests per query type
+QUERY_MIX = {
+    "postcode": 0.40,
+    "prefix": 0.15,
+    "bbox": 0.25,
+    "constituency": 0.10,
+    "top": 0.05,
+    "search": 0.05,
+}
+# Bounding-box side lengths, in degrees (a few streets to a county)
+BBOX_SIZES = [0.01, 0.05, 0.2, 1.0]
+STARTUP_TIMEOUT_S = 60
+
+
+def build_targets(index, count, seed):
+    """
+    count request targets drawn from QUERY_MIX, using postcodes and
+    constituencies that exist in the data (plus some misses).
+    """
+    rng = random.Random(seed)
+    labels = index.columns["postcode_label"]
+    lon, lat = index.columns["long"], index.columns["lat"]
+    codes = list(index.constituencies)
+    names = [record.get("name") or code for code, record in index.constituencies.items()]
+    kinds = rng.choices(list(QUERY_MIX), weights=list(QUERY_MIX.values()), k=count)
+    targets = []
+    for kind in kinds:
+        i = rng.randrange(index.postcode_count)
+        if kind == "postcode":
+            postcode = labels[i] if rng.random() < 0.9 else "ZZ99 9ZZ"
+            target = f"/postcode/{quote(postcode)}"
+        elif kind == "prefix":
+            target = f"/postcodes?prefix={quote(labels[i][:rng.choice([2, 3, 4])])}&limit=20"
+        elif kind == "bbox":
+            size = rng.choice(BBOX_SIZES)
+            west, south = lon[i] - size * rng.random(), lat[i] - size * rng.random()
+            target = f"/bbox?west={west:.5f}&south={south:.5f}&east={west + size:.5f}&north={south + size:.5f}&limit=100"
+        elif kind == "constituency":
+            target = f"/constituency/{rng.choice(codes)}"
+        elif kind == "top":
+            target = f"/constituencies/top?n={rng.choice([10, 50])}&by={rng.choice(['estimate', 'tx_2m_plus_count'])}"
+        else:
+            target = f"/search?q={quote(rng.choice(names)[:rng.choice([3, 5])])}&limit=10"
+        targets.append((kind, target))
+    return targets
+
+
+async def read_response(reader):
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError("connection closed by server")
+    status = int(status_line.split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        if name.strip().lower() == "content-length":
+            length = int(value)
+    await reader.readexactly(length)
+    return status
+
+
+async def client(host, port, targets, deadline, latencies, errors):
+    """
+    One keep-alive connection, sending requests back to back until the
+    targets run out or the deadline passes.
+    """
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        for kind, target in targets:
+            if time.perf_counter() > deadline:
+                break
+            start = time.perf_counter()
+            writer.write(f"GET {target} HTTP/1.1\r\nHost: {host}\r\n\r\n".encode("ascii"))
+            await writer.drain()
+            status = await read_response(reader)
+            latencies[kind].append(time.perf_counter() - start)
+            if status >= 500 or (status >= 400 and not (kind == "postcode" and status == 404)):
+                errors[kind] += 1
+    finally:
+        writer.close()
+
+
+async def run_load(host, port, targets, connections, duration):
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+    deadline = time.perf_counter() + duration if duration else float("inf")
+    # Each connection gets an interleaved share of the targets
+    shares = [targets[i::connections] for i in range(connections)]
+    start = time.perf_counter()
+    await asyncio.gather(*[client(host, port, share, deadline, latencies, errors) for share in shares])
+    return latencies, errors, time.perf_counter() - start
+
+
+def summarise(latencies, errors, elapsed):
+    rows = {}
+    for kind in list(QUERY_MIX) + ["all"]:
+        values = np.concatenate([latencies[k] for k in QUERY_MIX]) if kind == "all" else np.asarray(latencies[kind])
+        if not len(values):
+            continue
+        ms = values * 1000
+        rows[kind] = {
+            "requests": int(len(ms)),
+            "errors": sum(errors.values()) if kind == "all" else errors[kind],
+            "p50_ms": float(np.percentile(ms, 50)),
+            "p95_ms": float(np.percentile(ms, 95)),
+            "p99_ms": float(np.percentile(ms, 99)),
+            "max_ms": float(ms.max()),
+        }
+    total = rows.get("all", {}).get("requests", 0)
+    print(f"{total:,} requests in {elapsed:.2f}s: {total / elapsed:,.0f} req/s")
+    print(f"{'query':<14} {'requests':>9} {'errors':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for kind, row in rows.items():
+        print(f"{kind:<14} {row['requests']:>9,} {row['errors']:>7} {row['p50_ms']:>8.2f} {row['p95_ms']:>8.2f} "
+              f"{row['p99_ms']:>8.2f} {row['max_ms']:>8.2f}")
+    return {"elapsed_s": elapsed, "requests_per_s": total / elapsed if elapsed else None, "queries": rows}
+
+
+async def wait_for_service(host, port, process):
+    deadline = time.perf_counter() + STARTUP_TIMEOUT_S
+    while time.perf_counter() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("query_service.py exited during startup")
+        try:
+            reader, writer = await asyncio.open_connection(host, port)
+        except OSError:
+            await asyncio.sleep(0.1)
+            continue
+        writer.close()
+        return
+    raise RuntimeError(f"query_service.py did not start within {STARTUP_TIMEOUT_S}s")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Load-test the query service.")
+    parser.add_argument("--data-dir", default=".", help="Directory of step 2's outputs, used to build the queries.")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--spawn", action="store_true", help="Start the service for the run.")
+    parser.add_argument("--connections", type=int, default=50, help="Concurrent connections (default 50).")
+    parser.add_argument("--requests", type=int, default=20_000, help="Requests to send in total (default 20,000).")
+    parser.add_argument("--duration", type=float, help="Stop after this many seconds even if requests remain.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the summary to this JSON file.")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    targets = build_targets(ResultIndex.load(args.data_dir), args.requests, args.seed)
+    process = None
+    if args.spawn:
+        process = subprocess.Popen([sys.executable, str(REPO_ROOT / "query_service.py"), "--data-dir", args.data_dir,
+                                    "--host", args.host, "--port", str(args.port)], stdout=subprocess.DEVNULL)
+    try:
+        if process is not None:
+            asyncio.run(wait_for_service(args.host, args.port, process))
+        latencies, errors, elapsed = asyncio.run(
+            run_load(args.host, args.port, targets, max(1, args.connections), args.duration)
+        )
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+    summary = summarise(latencies, errors, elapsed)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"connections": args.connections, **summary}, f, indent=2)
@@ -0,0 +1,375 @@
+#!/usr/bin/env python3
+
+# © Tax Policy Associates 2025
+#
+# Writes a synthetic set of pipeline inputs with the same layout as the real
+# (multi-GB, licensed) files, so the pipeline can be run and timed anywhere:
+#
+#   pp-complete.csv                    Price Paid, 16 quoted columns, no header
+#   NSPL_FEB_2025_UK.csv               postcode lookup with pcds/pcon/lat/long
+#   CTSOP_tables.xlsx                  council tax bands by constituency
+#   housepricestatisticsparlicon.xlsx  median price series, sheets 2a and 2b
+#   Westminster_..._BGC_...gpkg        constituency polygons, EPSG:27700
+#
+# Constituencies are cells of a jittered grid over Great Britain whose shared
+# edges are identical, so the boundary file has real topology. Every
+# postcode sits inside its constituency's cell. Properties are sold
+# repeatedly over 1995-2025 at prices that track their constituency's
+# median series, and about 2% of transactions are batch sales (several flats
+# with one postcode, date and price).
+#
+#   python benchmarks/synthetic_data.py 1m --out benchmarks/data/1m
+
+import argparse
+import csv
+import os
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+
+SCALES = {"100k": 100_000, "1m": 1_000_000, "10m": 10_000_000}
+
+PPD_FILE = "pp-complete.csv"
+NSPL_FILE = "NSPL_FEB_2025_UK.csv"
+CTSOP_FILE = "CTSOP_tables.xlsx"
+HOUSE_PRICE_FILE = "housepricestatisticsparlicon.xlsx"
+BOUNDARIES_FILE = "Westminster_Parliamentary_Constituencies_July_2024_Boundaries_UK_BGC_-753850996617870270.gpkg"
+
+# 650 constituencies, coded as in the July 2024 boundaries
+NATIONS = [("E14001063", 543), ("W07000081", 32), ("S14000021", 57), ("N05000001", 18)]
+GRID_COLS, GRID_ROWS = 26, 25
+GRID_BOUNDS = (-5.8, 50.0, 1.8, 55.8)  # lon/lat
+EDGE_POINTS = 40  # intermediate points on each shared edge
+LONDON_SEATS = 75  # the first English seats get London-level prices
+
+AREAS = np.array([
+    "AL", "B", "BA", "BH", "BN", "BR", "BS", "CB", "CM", "CO", "CR", "CT", "CV", "DA", "E", "EC", "EN",
+    "EX", "GL", "GU", "HA", "HP", "IG", "KT", "L", "LE", "LS", "M", "ME", "MK", "N", "NE", "NG", "NW",
+    "OX", "PE", "PO", "RG", "RH", "RM", "S", "SE", "SG", "SL", "SM", "SN", "SO", "SS", "SW", "TN", "TW",
+    "UB", "W", "WC", "WD", "YO",
+])
+UNIT_LETTERS = np.array(list("ABDEFGHJLNPQRSTUWXYZ"))
+DISTRICTS = 40
+STREETS = np.array(["HIGH STREET", "CHURCH ROAD", "STATION ROAD", "THE AVENUE", "PARK LANE", "MILL LANE",
+                    "LONDON ROAD", "VICTORIA ROAD", "GREEN LANE", "MANOR WAY"])
+TOWNS = np.array(["LONDON", "BRISTOL", "LEEDS", "YORK", "OXFORD", "CAMBRIDGE", "BATH", "EXETER", "GUILDFORD"])
+
+FIRST_DAY = np.datetime64("1995-01-01")
+LAST_DAY = np.datetime64("2025-03-31")
+PPD_CHUNK_SIZE = 1_000_000
+BATCH_SHARE = 0.02
+
+
+# ==========================================
+# CONSTITUENCIES AND BOUNDARIES
+# ==========================================
+def constituency_codes():
+    codes = []
+    for first, count in NATIONS:
+        prefix, start = first[:3], int(first[3:])
+        codes += [f"{prefix}{start + i:0{len(first) - 3}d}" for i in range(count)]
+    return np.array(codes)
+
+
+def _edge(start, end, rng, amplitude, axis):
+    """
+    Points strictly between start and end, displaced along axis by a noise
+    that tapers to zero at both ends.
+    """
+    t = np.linspace(0, 1, EDGE_POINTS + 2)[1:-1]
+    points = start + (end - start) * t[:, None]
+    points[:, axis] += amplitude * np.sin(np.pi * t) * rng.uniform(-1, 1, EDGE_POINTS)
+    return points
+
+
+def constituency_polygons(rng):
+    """
+    One polygon per grid cell, row-major from the south west. Each edge is
+    generated once and used (reversed) by both cells that share it.
+    """
+    lon0, lat0, lon1, lat1 = GRID_BOUNDS
+    xs = np.linspace(lon0, lon1, GRID_COLS + 1)
+    ys = np.linspace(lat0, lat1, GRID_ROWS + 1)
+    amp_x = 0.25 * (xs[1] - xs[0])
+    amp_y = 0.25 * (ys[1] - ys[0])
+    vertex = lambda i, j: np.array([xs[j], ys[i]])
+    horizontal = {(i, j): _edge(vertex(i, j), vertex(i, j + 1), rng, amp_y, 1)
+                  for i in range(GRID_ROWS + 1) for j in range(GRID_COLS)}
+    vertical = {(i, j): _edge(vertex(i, j), vertex(i + 1, j), rng, amp_x, 0)
+                for i in range(GRID_ROWS) for j in range(GRID_COLS + 1)}
+
+    polygons = []
+    for i in range(GRID_ROWS):
+        for j in range(GRID_COLS):
+            ring = np.vstack([
+                vertex(i, j), horizontal[i, j],
+                vertex(i, j + 1), vertical[i, j + 1],
+                vertex(i + 1, j + 1), horizontal[i + 1, j][::-1],
+                vertex(i + 1, j), vertical[i, j][::-1],
+                vertex(i, j),
+            ])
+            polygons.append(shapely.Polygon(ring))
+    return polygons, xs, ys
+
+
+def write_boundaries(out_dir, codes, polygons):
+    gdf = gpd.GeoDataFrame(
+        {"PCON24CD": codes, "PCON24NM": [f"Synthetic {code}" for code in codes]},
+        geometry=polygons[:len(codes)],
+        crs="EPSG:4326",
+    ).to_crs(epsg=27700)
+    gdf.to_file(os.path.join(out_dir, BOUNDARIES_FILE), driver="GPKG")
+
+
+# ==========================================
+# HOUSE PRICES AND COUNCIL TAX
+# ==========================================
+def quarter_labels():
+    months = ["Mar", "Jun", "Sep", "Dec"]
+    labels = ["Year ending Dec 1995"]
+    labels += [f"Year ending {m} {y}" for y in range(1996, 2025) for m in months]
+    labels.append("Year ending Mar 2025")
+    return labels
+
+
+def median_price_series(rng, n_seats, seat_level):
+    """
+    (seats x quarters) median prices: a national curve (roughly fivefold
+    since 1995, with a dip in 2008-09) with per-seat drift and noise.
+    """
+    n_quarters = len(quarter_labels())
+    t = np.arange(n_quarters) / (n_quarters - 1)
+    national = np.exp(1.6 * t) * (1 - 0.15 * np.exp(-((t - 0.45) / 0.05) ** 2))
+    drift = np.exp(np.outer(rng.normal(0, 0.3, n_seats), t))
+    noise = np.exp(rng.normal(0, 0.02, (n_seats, n_quarters)))
+    return np.round(55_000 * seat_level[:, None] * national[None, :] * drift * noise, -2)
+
+
+def write_house_prices(out_dir, codes, series, rng):
+    labels = quarter_labels()
+    table = pd.DataFrame(series, columns=labels).astype(object)
+    # The real series has suppressed cells
+    mask = rng.random(table.shape) < 0.002
+    table = table.mask(mask, ":")
+    table.insert(0, "Area Name", [f"Synthetic {code}" for code in codes])
+    table.insert(0, "Area Code", codes)
+    with pd.ExcelWriter(os.path.join(out_dir, HOUSE_PRICE_FILE)) as writer:
+        for sheet in ["2a", "2b"]:
+            pd.DataFrame([[f"Table {sheet}: median price paid by parliamentary constituency"], [""]]).to_excel(
+                writer, sheet_name=sheet, header=False, index=False)
+            table.to_excel(writer, sheet_name=sheet, startrow=2, index=False)
+
+
+def write_ctsop(out_dir, codes, seat_level, rng):
+    header = ["Geography [note 1]", "ECODE", "ONS area code [note 3]", "ONS area name"] + list("ABCDEFGHI") + ["All"]
+    # Richer seats have more dwellings in the upper bands
+    shares = np.array([0.24, 0.20, 0.22, 0.15, 0.10, 0.05, 0.03, 0.006, 0.004])
+    tilt = np.log(seat_level)[:, None] * np.linspace(-0.8, 1.6, 9)[None, :]
+    weights = shares[None, :] * np.exp(tilt)
+    bands = np.round(weights / weights.sum(axis=1, keepdims=True) * rng.integers(40_000, 60_000, (len(codes), 1)), -1)
+    rows = [["ENGWA", "", "K04000001", "England and Wales"] + list(bands.sum(axis=0)) + [bands.sum()],
+            ["CTRY", "", "E92000001", "England"] + list(bands.sum(axis=0)) + [bands.sum()]]
+    rows += [["PCON", "", code, f"Synthetic {code}"] + list(row) + [row.sum()] for code, row in zip(codes, bands)]
+    with pd.ExcelWriter(os.path.join(out_dir, CTSOP_FILE)) as writer:
+        pd.DataFrame([["Council Tax: stock of properties, 2024"], [""], [""], [""]]).to_excel(
+            writer, sheet_name="CTSOP2.0", header=False, index=False)
+        pd.DataFrame(rows, columns=header).to_excel(writer, sheet_name="CTSOP2.0", startrow=4, index=False)
+
+
+# ==========================================
+# POSTCODES
+# ==========================================
+def make_postcodes(rng, n_postcodes):
+    """
+    Distinct postcodes like "SW1A 1AA"-style "AREA<district> <sector><unit>".
+    """
+    capacity = len(AREAS) * DISTRICTS * 10 * len(UNIT_LETTERS) ** 2
+    ids = np.sort(rng.choice(capacity, n_postcodes, replace=False))
+    ids, unit2 = np.divmod(ids, len(UNIT_LETTERS))
+    ids, unit1 = np.divmod(ids, len(UNIT_LETTERS))
+    ids, sector = np.divmod(ids, 10)
+    area, district = np.divmod(ids, DISTRICTS)
+    outward = pd.Series(AREAS[area]) + pd.Series(district + 1).astype(str)
+    inward = pd.Series(sector).astype(str) + UNIT_LETTERS[unit1] + UNIT_LETTERS[unit2]
+    return (outward + " " + inward).to_numpy(dtype=object)
+
+
+def write_nspl(out_dir, postcodes, pcons, lon, lat, rng):
+    n = len(postcodes)
+    # Terminated postcodes stay in NSPL; a few have no constituency
+    doterm = np.where(rng.random(n) < 0.05, "202001", "")
+    pcon = np.where(rng.random(n) < 0.001, "", pcons)
+    nations = pd.Series(pcons).str[0].map({"E": "E92000001", "W": "W92000004", "S": "S92000003", "N": "N92000002"})
+    outward = pd.Series(postcodes).str.split(" ").str[0].str.pad(4, side="right")
+    inward = pd.Series(postcodes).str[-3:]
+    df = pd.DataFrame({
+        "pcd": outward + inward,
+        "pcd2": outward + " " + inward,
+        "pcds": postcodes,
+        "dointr": "198001",
+        "doterm": doterm,
+        "usertype": rng.integers(0, 2, n),
+        "oseast1m": rng.integers(100_000, 650_000, n),
+        "osnrth1m": rng.integers(10_000, 1_200_000, n),
+        "ctry": nations,
+        "laua": "E09000001",
+        "pcon": pcon,
+        "lat": np.round(lat, 6),
+        "long": np.round(lon, 6),
+        "imd": rng.integers(1, 32_000, n),
+    })
+    df.to_csv(os.path.join(out_dir, NSPL_FILE), index=False)
+
+
+# ==========================================
+# PRICE PAID
+# ==========================================
+def _format_dates(days):
+    return np.char.add(np.datetime_as_string(FIRST_DAY + days, unit="D").astype("U10"), " 00:00")
+
+
+def _transaction_ids(start, n):
+    return pd.Series(np.arange(start, start + n)).map("{{{0:08X}-1A2B-4C3D-E05F-{0:012X}}}".format).to_numpy()
+
+
+def ppd_chunk(rng, start, n, props, postcodes, seat_quarter_index):
+    """
+    n transactions: sales of existing properties plus batch sales of new
+    flats. Returns the 16 Price Paid columns as a DataFrame.
+    """
+    n_batch_groups = int(n * BATCH_SHARE / 5)
+    group_sizes = rng.integers(2, 9, n_batch_groups)
+    n_single = n - int(group_sizes.sum())
+
+    prop = rng.integers(0, len(props["postcode"]), n_single)
+    days = rng.integers(0, int((LAST_DAY - FIRST_DAY).astype(int)) + 1, n_single)
+    quarter = np.minimum(days // 91, seat_quarter_index.shape[1] - 1)
+    index = seat_quarter_index[props["seat"][prop], quarter]
+    price = props["value"][prop] * index * np.exp(rng.normal(0, 0.08, n_single))
+    single = pd.DataFrame({
+        "postcode": props["postcode"][prop],
+        "price": price,
+        "days": days,
+        "type": props["type"][prop],
+        "paon": props["paon"][prop],
+        "saon": props["saon"][prop],
+        "new": np.where(rng.random(n_single) < 0.1, "Y", "N"),
+        "category": np.where(rng.random(n_single) < 0.05, "B", "A"),
+    })
+
+    # Batch sales: one postcode, date and price for several flats
+    anchor = rng.integers(0, n_single, n_batch_groups)
+    rows = np.repeat(anchor, group_sizes)
+    batch = single.iloc[rows].reset_index(drop=True)
+    batch["type"] = "F"
+    batch["new"] = "Y"
+    batch["category"] = "B"
+    batch["saon"] = "FLAT " + pd.Series(np.concatenate([np.arange(1, k + 1) for k in group_sizes])).astype(str)
+
+    df = pd.concat([single, batch], ignore_index=True).sample(frac=1, random_state=int(rng.integers(1 << 31)))
+    df["postcode"] = np.where(rng.random(len(df)) < 0.002, "", postcodes[df["postcode"].to_numpy()])
+    return pd.DataFrame({
+        "tid": _transaction_ids(start, len(df)),
+        "price": np.maximum(np.round(df["price"].to_numpy(), -2), 100).astype("int64"),
+        "date": _format_dates(df["days"].to_numpy()),
+        "postcode": df["postcode"].to_numpy(),
+        "type": df["type"].to_numpy(),
+        "new": df["new"].to_numpy(),
+        "duration": np.where(df["type"].to_numpy() == "F", "L", "F"),
+        "paon": df["paon"].to_numpy(),
+        "saon": df["saon"].to_numpy(),
+        "street": STREETS[rng.integers(0, len(STREETS), len(df))],
+        "locality": "",
+        "town": TOWNS[rng.integers(0, len(TOWNS), len(df))],
+        "district": "SYNTHETIC",
+        "county": "SYNTHETIC",
+        "category": df["category"].to_numpy(),
+        "status": "A",
+    })
+
+
+def make_properties(rng, n_properties, postcode_seat, seat_level):
+    """
+    The housing stock: postcode, address, type and a 2025 value for each
+    property. Values are log-normal around the seat's level, which gives a
+    few thousand £2m+ homes per million transactions.
+    """
+    postcode = rng.integers(0, len(postcode_seat), n_properties)
+    seat = postcode_seat[postcode]
+    types = rng.choice(np.array(list("DSTFO")), n_properties, p=[0.22, 0.28, 0.28, 0.20, 0.02])
+    flat = types == "F"
+    saon = np.where(flat, "FLAT " + pd.Series(rng.integers(1, 40, n_properties)).astype(str).to_numpy(), "")
+    return {
+        "postcode": postcode,
+        "seat": seat,
+        "type": types,
+        "paon": pd.Series(rng.integers(1, 250, n_properties)).astype(str).to_numpy(),
+        "saon": saon,
+        "value": 300_000 * seat_level[seat] * np.exp(rng.normal(0, 0.65, n_properties)),
+    }
+
+
+def generate(out_dir, transactions, seed=0):
+    rng = np.random.default_rng(seed)
+    os.makedirs(out_dir, exist_ok=True)
+
+    codes = constituency_codes()
+    n_seats = len(codes)
+    polygons, xs, ys = constituency_polygons(rng)
+    english = np.char.startswith(codes.astype(str), "E")
+    seat_level = np.exp(rng.normal(0, 0.35, n_seats))
+    seat_level[np.flatnonzero(english)[:LONDON_SEATS]] *= 2.5
+    print(f"Writing boundaries for {n_seats} constituencies...")
+    write_boundaries(out_dir, codes, polygons)
+
+    series = median_price_series(rng, n_seats, seat_level)
+    write_house_prices(out_dir, codes, series, rng)
+    write_ctsop(out_dir, codes, seat_level, rng)
+    # Price relative to 2025 by seat and quarter (quarter 0 is Dec 1995)
+    seat_quarter_index = series / series[:, -1:]
+
+    n_postcodes = max(3_000, transactions // 12)
+    print(f"Writing NSPL with {n_postcodes:,} postcodes...")
+    postcodes = make_postcodes(rng, n_postcodes)
+    postcode_seat = rng.integers(0, n_seats, n_postcodes)
+    # Keep points well inside their (jittered) cell
+    col, row = postcode_seat % GRID_COLS, postcode_seat // GRID_COLS
+    lon = xs[col] + (xs[1] - xs[0]) * rng.uniform(0.3, 0.7, n_postcodes)
+    lat = ys[row] + (ys[1] - ys[0]) * rng.uniform(0.3, 0.7, n_postcodes)
+    write_nspl(out_dir, postcodes, codes[postcode_seat], lon, lat, rng)
+    # Some sales are at postcodes NSPL does not know
+    postcodes = np.concatenate([postcodes, np.array([f"ZZ99 {i % 10}ZZ" for i in range(n_postcodes // 500 + 1)], dtype=object)])
+    postcode_seat = np.concatenate([postcode_seat, rng.integers(0, n_seats, len(postcodes) - n_postcodes)])
+
+    props = make_properties(rng, max(1, int(transactions / 2.4)), postcode_seat, seat_level)
+    ppd_path = os.path.join(out_dir, PPD_FILE)
+    if os.path.exists(ppd_path):
+        os.remove(ppd_path)
+    written = 0
+    while written < transactions:
+        n = min(PPD_CHUNK_SIZE, transactions - written)
+        chunk = ppd_chunk(rng, written, n, props, postcodes, seat_quarter_index)
+        chunk.to_csv(ppd_path, mode="a", header=False, index=False, quoting=csv.QUOTE_ALL, encoding="latin1")
+        written += n
+        print(f"  {written:,} / {transactions:,} transactions")
+    print(f"Synthetic inputs written to {out_dir}/")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Write synthetic pipeline inputs at a given scale.")
+    parser.add_argument("scale", help=f"Transactions: one of {', '.join(SCALES)} or a number.")
+    parser.add_argument("--out", help="Output directory (default benchmarks/data/<scale>).")
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args()
+
+
+def transactions_for(scale):
+    return SCALES[scale.lower()] if scale.lower() in SCALES else int(scale)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    out = args.out or os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", args.scale.lower())
+    generate(out, transactions_for(args.scale), args.seed)
@@ -0,0 +1,369 @@
+#!/usr/bin/env python3
+
+# © Tax Policy Associates 2025
+#
+# Runs the numbered scripts as a dependency graph:
+#
+#   transactions (1) --> webapp (2)
+#                    \-> treemap (3)
+#
+# Each stage's inputs are its data files, its script and the local modules it
+# imports, and its command-line arguments. Their content hashes are recorded
+# in .build_state.json after a successful run, and a stage is skipped when
+# they are unchanged and its outputs are still as it left them. Because the
+# scripts' outputs are hashed too, a rerun of step 1 that writes identical
+# CSVs does not trigger steps 2 and 3. Stages whose dependencies are done run
+# concurrently (webapp and treemap, by default).
+#
+#   python build.py                       # run whatever is out of date
+#   python build.py --force webapp        # rerun one stage (and what changes)
+#   python build.py --dry-run
+#   python build.py --args transactions="--streaming --workers 4"
+
+import argparse
+import ast
+import hashlib
+import importlib.util
+import json
+import os
+import shlex
+import subprocess
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent
+BUILD_STATE_FILE = ".build_state.json"
+BUILD_LOG_DIR = "build_logs"
+HASH_BLOCK_SIZE = 1 << 20
+
+
+def _load_config(script):
+    """
+    Imports a pipeline script (without running it) to read its file names.
+    """
+    spec = importlib.util.spec_from_file_location(f"config_{Path(script).stem}", REPO_ROOT / script)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def define_stages():
+    """
+    The stages, in dependency order, with their data inputs and outputs
+    taken from the scripts' own configuration. An output may be a directory.
+    The content-hashed copies a stage publishes change name with their
+    content, so they are read from the manifest it writes instead (see
+    stage_outputs).
+    """
+    s1 = _load_config("1_read_transaction_data_and_create_csvs.py")
+    s2 = _load_config("2_build_data_for_webapp.py")
+    s3 = _load_config("3_treemap_generator.py")
+    return {
+        "transactions": {
+            "script": "1_read_transaction_data_and_create_csvs.py",
+            "after": [],
+            "inputs": list(s1.PPD_FILES) + [s1.NSPL_FILE, s1.HOUSE_PRICE_XLSX, s1.CTSOP_XLSX],
+            "outputs": [s1.OUTPUT_FILE, s1.POSTCODE_OUTPUT_FILE, s1.SALES_CUBE_FILE],
+            # Options whose value (or default, when given bare) is another input
+            "input_options": {"--incremental": s1.PPD_UPDATE_FILE},
+        },
+        "webapp": {
+            "script": "2_build_data_for_webapp.py",
+            "after": ["transactions"],
+            "inputs": [s2.CTSOP_XLSX, s2.HOUSE_PRICE_XLSX, s2.BOUNDARIES_FILE, s2.RECENT_TX_CSV, s2.POSTCODE_TX_CSV],
+            "outputs": [s2.OUTPUT_GEOJSON]
+                       + [s2.TOPOJSON_OUTPUT_TEMPLATE.format(level=level["name"]) for level in s2.TOPOJSON_LEVELS]
+                       + [s2.POSTCODE_OUTPUT_GEOJSON, s2.POSTCODE_OUTPUT_COLUMNAR, s2.POSTCODE_TILES_DIR,
+                          os.path.join(s2.POSTCODE_TILES_DIR, "index.json"), s2.MANIFEST_OUTPUT],
+            "manifest": s2.MANIFEST_OUTPUT,
+        },
+        "treemap": {
+            "script": "3_treemap_generator.py",
+            "after": ["transactions"],
+            "inputs": [str(s3.INPUT_FILE), str(s3.SALES_CUBE_FILE)],
+            "outputs": [str(s3.OUTPUT_FILE), str(s3.MANIFEST_FILE)],
+            "manifest": str(s3.MANIFEST_FILE),
+        },
+    }
+
+
+def local_modules(script):
+    """
+    The script and every repo-root module it imports, directly or through
+    other local modules.
+    """
+    seen = []
+    pending = [script]
+    while pending:
+        name = pending.pop()
+        if name in seen:
+            continue
+        seen.append(name)
+        tree = ast.parse((REPO_ROOT / name).read_text(encoding="utf-8"))
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                modules = [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+                modules = [node.module]
+            else:
+                continue
+            for module in modules:
+                path = f"{module.split('.')[0]}.py"
+                if (REPO_ROOT / path).exists():
+                    pending.append(path)
+    return sorted(seen)
+
+
+def manifest_files(path):
+    """
+    Every file a publishing manifest (see web_artifacts.py) points to: each
+    hashed copy and its compressed variants.
+    """
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding="utf-8") as f:
+        pending = [json.load(f)]
+    files = []
+    while pending:
+        node = pending.pop()
+        if isinstance(node, list):
+            pending += node
+        elif isinstance(node, dict):
+            if "encodings" in node:
+                files += [encoding["file"] for encoding in node["encodings"].values()]
+            pending += [value for key, value in node.items() if key != "encodings"]
+    return sorted(set(files))
+
+
+def stage_outputs(stage):
+    """
+    A stage's fixed outputs and the published files its manifest lists.
+    """
+    outputs = list(stage["outputs"])
+    if stage.get("manifest"):
+        outputs += [path for path in manifest_files(stage["manifest"]) if path not in outputs]
+    return outputs
+
+
+class FileHasher:
+    """
+    sha256 of files, remembered by (size, mtime) across runs so multi-GB
+    inputs are only read again when they change. A directory hashes as the
+    names and hashes of the files under it.
+    """
+
+    def __init__(self, cache):
+        self.cache = cache
+
+    def __call__(self, path):
+        if not os.path.exists(path):
+            return None
+        if os.path.isdir(path):
+            digest = hashlib.sha256()
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    file_path = os.path.join(root, name)
+                    digest.update(f"{os.path.relpath(file_path, path)}\0{self(file_path)}\n".encode())
+            return digest.hexdigest()
+        stat = os.stat(path)
+        key = [stat.st_size, stat.st_mtime_ns]
+        cached = self.cache.get(path)
+        if cached and cached["stat"] == key:
+            return cached["sha256"]
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+                digest.update(block)
+        self.cache[path] = {"stat": key, "sha256": digest.hexdigest()}
+        return digest.hexdigest()
+
+
+def load_state():
+    if not os.path.exists(BUILD_STATE_FILE):
+        return {"files": {}, "stages": {}}
+    with open(BUILD_STATE_FILE, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_state(state):
+    tmp_path = BUILD_STATE_FILE + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp_path, BUILD_STATE_FILE)
+
+
+def option_inputs(stage, args):
+    """
+    The input files named by a stage's input_options in its arguments, e.g.
+    the update file of step 1's --incremental.
+    """
+    paths = []
+    for option, default in stage.get("input_options", {}).items():
+        for i, arg in enumerate(args):
+            if arg == option:
+                value = args[i + 1] if i + 1 < len(args) and not args[i + 1].startswith("-") else default
+                paths.append(value)
+            elif arg.startswith(option + "="):
+                paths.append(arg.split("=", 1)[1])
+    return paths
+
+
+def stage_fingerprint(stage, args, file_hash):
+    """
+    Hashes of everything a stage's outputs depend on. A missing input hashes
+    as None, so its later appearance counts as a change.
+    """
+    return {
+        "args": args,
+        "code": {path: file_hash(str(REPO_ROOT / path)) for path in local_modules(stage["script"])},
+        "inputs": {path: file_hash(path) for path in stage["inputs"] + option_inputs(stage, args)},
+    }
+
+
+def why_run(name, stage, fingerprint, state, file_hash, forced):
+    """
+    The reason a stage has to run, or None if it can be skipped.
+    """
+    if name in forced:
+        return "forced"
+    previous = state["stages"].get(name)
+    if previous is None:
+        return "never built"
+    for key in ["args", "code", "inputs"]:
+        if previous["fingerprint"][key] != fingerprint[key]:
+            if key == "args":
+                return "arguments changed"
+            changed = [p for p, h in fingerprint[key].items() if previous["fingerprint"][key].get(p) != h]
+            return f"{key} changed: {', '.join(changed)}"
+    for path, digest in previous["outputs"].items():
+        if file_hash(path) != digest:
+            return f"output missing or modified: {path}"
+    return None
+
+
+def run_stage(name, stage, args):
+    os.makedirs(BUILD_LOG_DIR, exist_ok=True)
+    log_path = os.path.join(BUILD_LOG_DIR, f"{name}.log")
+    start = time.perf_counter()
+    with open(log_path, "w", encoding="utf-8") as log:
+        result = subprocess.run([sys.executable, str(REPO_ROOT / stage["script"])] + args,
+                                stdout=log, stderr=subprocess.STDOUT)
+    return result.returncode, time.perf_counter() - start, log_path
+
+
+def build(stages, forced, stage_args, jobs, dry_run):
+    state = load_state()
+    file_hash = FileHasher(state["files"])
+    status = {}
+    running = {}
+    fingerprints = {}
+    failed = False
+
+    def ready(name):
+        return name not in status and name not in running.values() and all(
+            status.get(dep) in ("built", "up to date", "would run") for dep in stages[name]["after"]
+        )
+
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        while True:
+            # A skipped stage can make its dependents ready straight away
+            while any(ready(n) for n in stages):
+                name = next(n for n in stages if ready(n))
+                stage = stages[name]
+                args = stage_args.get(name, [])
+                fingerprint = stage_fingerprint(stage, args, file_hash)
+                reason = why_run(name, stage, fingerprint, state, file_hash, forced)
+                # In a dry run, a dependency that would run would rewrite this
+                # stage's inputs, so this stage's hashes prove nothing yet
+                pending = [dep for dep in stage["after"] if status[dep] == "would run"]
+                if reason is None and pending:
+                    reason = f"after {', '.join(pending)}"
+                if reason is None:
+                    print(f"[{name}] up to date")
+                    status[name] = "up to date"
+                    continue
+                if dry_run:
+                    print(f"[{name}] would run ({reason})")
+                    status[name] = "would run"
+                    continue
+                print(f"[{name}] running {stage['script']} ({reason})")
+                future = pool.submit(run_stage, name, stage, args)
+                running[future] = name
+                fingerprints[name] = fingerprint
+
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                returncode, elapsed, log_path = future.result()
+                if returncode != 0:
+                    print(f"[{name}] failed after {elapsed:.1f}s (exit {returncode}); see {log_path}")
+                    status[name] = "failed"
+                    failed = True
+                    continue
+                print(f"[{name}] built in {elapsed:.1f}s")
+                status[name] = "built"
+                state["stages"][name] = {
+                    "fingerprint": fingerprints[name],
+                    "outputs": {path: file_hash(path) for path in stage_outputs(stages[name])},
+                }
+                save_state(state)
+
+    for name in stages:
+        if name not in status:
+            print(f"[{name}] not run (a stage it depends on failed)")
+    if not dry_run:
+        save_state(state)
+    return not failed
+
+
+def parse_stage_args(values, stage_names):
+    stage_args = {}
+    for value in values or []:
+        name, _, args = value.partition("=")
+        if name not in stage_names:
+            raise SystemExit(f"Unknown stage '{name}' in --args; choose from {', '.join(stage_names)}")
+        stage_args[name] = shlex.split(args)
+    return stage_args
+
+
+def parse_args(stage_names):
+    parser = argparse.ArgumentParser(description="Run the pipeline scripts, skipping stages whose inputs are unchanged.")
+    parser.add_argument("stages", nargs="*", metavar="STAGE",
+                        help=f"Stages to bring up to date, with what they depend on (default: all of "
+                             f"{', '.join(stage_names)}).")
+    parser.add_argument("--force", action="append", default=[], choices=stage_names + ["all"], metavar="STAGE",
+                        help="Run STAGE even if its inputs are unchanged (repeatable; 'all' for every stage).")
+    parser.add_argument("--args", action="append", metavar="STAGE=ARGS",
+                        help="Extra command-line arguments for a stage's script, e.g. transactions=\"--streaming\".")
+    parser.add_argument("--jobs", type=int, default=2, help="Stages to run at once (default 2).")
+    parser.add_argument("--dry-run", action="store_true", help="Show what would run without running it.")
+    return parser.parse_args()
+
+
+def with_dependencies(stages, selected):
+    keep = set()
+    pending = list(selected)
+    while pending:
+        name = pending.pop()
+        if name not in keep:
+            keep.add(name)
+            pending += stages[name]["after"]
+    return {name: stage for name, stage in stages.items() if name in keep}
+
+
+if __name__ == "__main__":
+    all_stages = define_stages()
+    names = list(all_stages)
+    args = parse_args(names)
+    unknown = [name for name in args.stages if name not in all_stages]
+    if unknown:
+        raise SystemExit(f"Unknown stage(s) {', '.join(unknown)}; choose from {', '.join(names)}")
+    stages = with_dependencies(all_stages, args.stages or names)
+    forced = set(names) if "all" in args.force else set(args.force)
+    ok = build(stages, forced, parse_stage_args(args.args, names), max(1, args.jobs), args.dry_run)
+    sys.exit(0 if ok else 1)
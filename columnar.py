@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+
+# © Tax Policy Associates 2025
+#
+# A small binary columnar format for tables the web app loads, so the
+# browser can view each column as a typed array instead of parsing JSON:
+#
+#   bytes 0-3   magic b"MTC1"
+#   bytes 4-7   header length, uint32 little-endian
+#   header      UTF-8 JSON: {"version", "rows", "columns": [...]}
+#   buffers     each column's data, little-endian, aligned to 8 bytes
+#
+# Numeric columns are float32/float64/int32 arrays of length rows. String columns are
+# dictionary encoded: int32 codes (length rows), plus a string table stored
+# as int32 offsets (length n + 1) into a blob of concatenated UTF-8 bytes.
+# Each column in the header records the byte offset and length of its
+# buffers, counted from the start of the file.
+
+import json
+import struct
+
+import numpy as np
+import pandas as pd
+
+MAGIC = b"MTC1"
+FORMAT_NAME = "mtc-columnar"
+VERSION = 1
+ALIGNMENT = 8
+NUMERIC_TYPES = {"float32": "<f4", "float64": "<f8", "int32": "<i4"}
+
+
+def _pad(n):
+    return -n % ALIGNMENT
+
+
+def _string_buffers(values):
+    codes, uniques = pd.factorize(pd.Series(values, dtype=object).fillna(""), sort=False)
+    encoded = [str(u).encode("utf-8") for u in uniques]
+    offsets = np.zeros(len(encoded) + 1, dtype="<i4")
+    offsets[1:] = np.cumsum([len(b) for b in encoded])
+    return {
+        "codes": codes.astype("<i4").tobytes(),
+        "offsets": offsets.tobytes(),
+        "data": b"".join(encoded),
+    }
+
+
+def encode_columns(df, column_types):
+    """
+    Encodes the columns of df named in column_types (name -> "float32",
+    "float64", "int32" or "string"), in that order. Returns the file contents as bytes.
+    """
+    buffers = []
+    columns = []
+    for name, kind in column_types.items():
+        if kind in NUMERIC_TYPES:
+            parts = {"values": df[name].to_numpy().astype(NUMERIC_TYPES[kind]).tobytes()}
+        elif kind == "string":
+            parts = _string_buffers(df[name])
+        else:
+            raise ValueError(f"Unknown column type '{kind}' for column '{name}'")
+        columns.append({"name": name, "type": kind, "buffers": parts})
+
+    # The buffer offsets depend on the header length, so lay the header out
+    # with placeholder offsets first and fix it up until it is stable
+    header_len = 0
+    while True:
+        position = 8 + header_len + _pad(8 + header_len)
+        header_columns = []
+        buffers = []
+        for column in columns:
+            entry = {"name": column["name"], "type": column["type"]}
+            for key, data in column["buffers"].items():
+                entry[key] = [position, len(data)]
+                buffers.append(data + b"\0" * _pad(len(data)))
+                position += len(data) + _pad(len(data))
+            header_columns.append(entry)
+        header = json.dumps(
+            {"version": VERSION, "rows": len(df), "columns": header_columns},
+            separators=(",", ":"),
+        ).encode("utf-8")
+        if len(header) == header_len:
+            break
+        header_len = len(header)
+
+    preamble = MAGIC + struct.pack("<I", len(header)) + header
+    return preamble + b"\0" * _pad(len(preamble)) + b"".join(buffers)
+
+
+def write_columns(path, df, column_types):
+    """
+    Writes df to path in the columnar format and returns the manifest fields
+    describing it.
+    """
+    with open(path, "wb") as f:
+        f.write(encode_columns(df, column_types))
+    return {
+        "format": FORMAT_NAME,
+        "version": VERSION,
+        "rows": len(df),
+        "columns": [{"name": name, "type": kind} for name, kind in column_types.items()],
+    }
+
+
+def read_columns(path):
+    """
+    Decodes a file written by write_columns back into a DataFrame.
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    if data[:4] != MAGIC:
+        raise ValueError(f"{path} is not a {FORMAT_NAME} file")
+    (header_len,) = struct.unpack_from("<I", data, 4)
+    header = json.loads(data[8:8 + header_len].decode("utf-8"))
+
+    def view(span, dtype):
+        offset, length = span
+        return np.frombuffer(data, dtype=dtype, count=length // np.dtype(dtype).itemsize, offset=offset)
+
+    out = {}
+    for column in header["columns"]:
+        if column["type"] == "string":
+            offsets = view(column["offsets"], "<i4")
+            start = column["data"][0]
+            table = np.array(
+                [data[start + a:start + b].decode("utf-8") for a, b in zip(offsets[:-1], offsets[1:])],
+                dtype=object,
+            )
+            out[column["name"]] = table[view(column["codes"], "<i4")]
+        else:
+            out[column["name"]] = view(column["values"], NUMERIC_TYPES[column["type"]])
+    return pd.DataFrame(out)
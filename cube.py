@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+
+# © Tax Policy Associates 2025
+#
+# Sales aggregated at every level of the postcode hierarchy and by
+# constituency, in one table (written by step 1 in the columnar format, see
+# columnar.py). For a postcode such as "SW1A 1AA":
+#
+#   area      SW          the leading letters of the outward code
+#   district  SW1A        the outward code
+#   sector    SW1A 1      the outward code and the first inward digit
+#   unit      SW1A1AA     the clean postcode
+#
+# Every row has a level, a key, the key of its parent one level up (unit ->
+# sector -> district -> area), and a pcon. Area, district and sector rows
+# come twice over: with pcon "" for the total across constituencies, and
+# split by constituency (pcon set) so a constituency can be drilled into.
+# Unit rows carry their single constituency; constituency rows have
+# key == pcon. lat/long are sales-weighted centroids.
+
+import numpy as np
+import pandas as pd
+
+CUBE_LEVELS = ["constituency", "area", "district", "sector", "unit"]
+CUBE_PARENTS = {"district": "area", "sector": "district", "unit": "sector"}
+
+
+def postcode_levels(postcodes):
+    """
+    Area, district and sector of each clean postcode (no space), as a
+    DataFrame with those columns.
+    """
+    postcodes = pd.Series(postcodes, dtype=object).astype(str)
+    outward = postcodes.str[:-3]
+    return pd.DataFrame({
+        "area": outward.str.extract(r"^([A-Z]+)", expand=False).fillna(outward).to_numpy(),
+        "district": outward.to_numpy(),
+        "sector": (outward + " " + postcodes.str[-3]).to_numpy(),
+    })
+
+
+def cube_column_types(count_columns):
+    return {
+        "level": "string",
+        "key": "string",
+        "parent": "string",
+        "pcon": "string",
+        "lat": "float32",
+        "long": "float32",
+        "postcodes": "int32",
+        **{column: "int32" for column in count_columns},
+        "Total Sales": "int32",
+        "hv_count": "int32",
+        "Mansion Tax Estimate": "float64",
+    }
+
+
+def _aggregate(units, by, value_columns):
+    grouped = units.groupby(by, sort=True)[value_columns + ["_weight", "_wlat", "_wlong"]].sum()
+    with np.errstate(invalid="ignore", divide="ignore"):
+        grouped["lat"] = grouped.pop("_wlat") / grouped["_weight"]
+        grouped["long"] = grouped.pop("_wlong") / grouped.pop("_weight")
+    return grouped.reset_index()
+
+
+def build_sales_cube(postcode_table, count_columns, charges):
+    """
+    The cube from a unit-level table (postcode_clean, lat, long, pcon and
+    the bracket count_columns). charges are the annual charges of
+    count_columns[1:], the bands above the first threshold.
+    """
+    counts = postcode_table[count_columns].to_numpy(dtype="int64")
+    valid = postcode_table["lat"].notna().to_numpy() & postcode_table["long"].notna().to_numpy()
+    weight = np.where(valid, counts.sum(axis=1), 0).astype("float64")
+
+    units = postcode_levels(postcode_table["postcode_clean"])
+    units["unit"] = postcode_table["postcode_clean"].astype(str).to_numpy()
+    units["pcon"] = postcode_table["pcon"].fillna("").astype(str).to_numpy()
+    for i, column in enumerate(count_columns):
+        units[column] = counts[:, i]
+    units["Total Sales"] = counts.sum(axis=1)
+    units["hv_count"] = counts[:, 1:].sum(axis=1)
+    units["Mansion Tax Estimate"] = (counts[:, 1:] * np.asarray(charges, dtype="float64")).sum(axis=1)
+    units["postcodes"] = 1
+    units["_weight"] = weight
+    units["_wlat"] = np.where(valid, postcode_table["lat"].to_numpy(dtype="float64"), 0) * weight
+    units["_wlong"] = np.where(valid, postcode_table["long"].to_numpy(dtype="float64"), 0) * weight
+    value_columns = ["postcodes"] + count_columns + ["Total Sales", "hv_count", "Mansion Tax Estimate"]
+
+    frames = []
+    rows = _aggregate(units, ["pcon"], value_columns)
+    frames.append(rows.assign(level="constituency", key=rows["pcon"], parent=""))
+    for level in ["area", "district", "sector", "unit"]:
+        parent = CUBE_PARENTS.get(level)
+        by = [level] + ([parent] if parent else [])
+        splits = [["pcon"]] if level == "unit" else [[], ["pcon"]]
+        for split in splits:
+            rows = _aggregate(units, by + split, value_columns)
+            frames.append(rows.assign(
+                level=level,
+                key=rows[level],
+                parent=rows[parent] if parent else "",
+                pcon=rows["pcon"] if split else "",
+            ))
+
+    columns = list(cube_column_types(count_columns))
+    return pd.concat([frame[columns] for frame in frames], ignore_index=True)
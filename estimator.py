@@ -0,0 +1,378 @@
+#!/usr/bin/env python3
+
+# © Tax Policy Associates 2025
+#
+# Scores an external list of properties (a portfolio or client list) with
+# step 1's logic: each postcode + price + sale date is matched to the NSPL,
+# uprated to the latest quarter, and given its mansion tax band and annual
+# charge.
+#
+#   python estimator.py portfolio.csv --output portfolio_scored.csv
+#   python estimator.py clients.csv --postcode-column pc --price-column value --date-column sold
+#
+# or from Python, with the NSPL index and inflation table loaded once:
+#
+#   from estimator import PropertyEstimator
+#   estimator = PropertyEstimator.load()
+#   scored = estimator.estimate(postcodes, prices, dates)   # a DataFrame
+#
+# The CSV is streamed in batches of about --batch-rows rows, so memory does
+# not grow with the input. Every input row is written out, in order, with
+# its own columns followed by:
+#
+#   pcon              constituency code
+#   inflation_factor  as step 1 applies it (1 outside the price series)
+#   uprated_price
+#   bracket           band label, e.g. "£2m - £2.5m"
+#   annual_charge
+#   status            ok, or why the row could not be scored (whose other
+#                     added columns are then empty)
+#
+# Prices are taken as given: step 1's split of portfolio sales (rows with
+# the same postcode, date and price) is not applied, as a list being scored
+# has its own price for each property.
+#
+# Each batch is scored with array operations only: postcodes are cleaned
+# and looked up once per distinct value, and everything else is a gather or
+# a searchsorted. pyarrow, when installed, parses and writes the CSV;
+# otherwise pandas does, more slowly.
+
+import argparse
+import csv
+import json
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.csv as pa_csv
+except ImportError:  # falls back to pandas for CSV input and output
+    pa = None
+
+from inflation import inflation_factors_for_rows, load_inflation_factors
+from mansion_tax import DEFAULT_SCENARIO, load_scenarios, property_charges
+from postcodes import clean_addr_col, load_nspl_index, postcode_positions
+from repeat_sales import (
+    REPEAT_SALES_CACHE_FILE, load_repeat_sales_cache, repeat_sales_cache_fingerprint, repeat_sales_factors
+)
+
+NSPL_FILE = "NSPL_FEB_2025_UK.csv"
+# The Price Paid file step 1 fits the repeat-sales index to
+PPD_FILE = "pp-complete.csv"
+PRICE_INDEXES = ["median", "repeat-sales"]
+DEFAULT_COLUMNS = {"postcode": "postcode", "price": "price", "date": "date"}
+ESTIMATE_BATCH_ROWS = 1_000_000
+# Bytes of CSV sampled from the start of the input to size pyarrow's blocks
+# to about batch_rows rows
+ROW_SIZE_SAMPLE_BYTES = 1 << 20
+
+STATUSES = ["ok", "unknown postcode", "no constituency", "invalid price", "invalid date"]
+STATUS_OK, STATUS_UNKNOWN_POSTCODE, STATUS_NO_CONSTITUENCY, STATUS_INVALID_PRICE, STATUS_INVALID_DATE = range(5)
+OUTPUT_COLUMNS = ["pcon", "inflation_factor", "uprated_price", "bracket", "annual_charge", "status"]
+
+
+def band_labels(thresholds):
+    """
+    "£0 - £2m"-style labels for the bands of a threshold list.
+    """
+    names = [f"£{threshold / 1e6:g}m" for threshold in thresholds]
+    return [f"£0 - {names[0]}"] + [f"{a} - {b}" for a, b in zip(names, names[1:])] + [f"{names[-1]}+"]
+
+
+def parse_prices(values):
+    """
+    Prices as floats from text such as "£2,500,000"; NaN where unparseable.
+    """
+    text = pd.Series(values, dtype=object).astype(str).str.replace(r"[£,\s]", "", regex=True)
+    return pd.to_numeric(text, errors="coerce").to_numpy(dtype="float64")
+
+
+def parse_dates(values):
+    """
+    Dates as datetime64 from text, each value parsed on its own so ISO and
+    UK (day first) dates can be mixed; NaT where unparseable.
+    """
+    return pd.to_datetime(pd.Series(values, dtype=object), errors="coerce", format="mixed",
+                          dayfirst=True).to_numpy(dtype="datetime64[ns]")
+
+
+class PropertyEstimator:
+    """
+    The NSPL postcode index, the uprating factors and a mansion tax scenario,
+    loaded once and applied to any number of batches.
+    """
+
+    def __init__(self, nspl_index, inflation, scenario=DEFAULT_SCENARIO):
+        self.nspl_index = nspl_index
+        self.inflation = inflation
+        self.scenario = scenario
+        self.labels = band_labels(scenario["thresholds"])
+        # Row of the factor matrix for each NSPL constituency code, with a
+        # trailing -1 for postcodes without one
+        self.pcon_rows = np.append(pd.Index(inflation["pcons"]).get_indexer(nspl_index["pcons"]), -1)
+
+    @classmethod
+    def load(cls, nspl_file=NSPL_FILE, price_index="median", scenario=DEFAULT_SCENARIO, ppd_file=PPD_FILE):
+        """
+        Loads the NSPL index and the median uprating factors (building their
+        caches if needed). With price_index "repeat-sales", step 1's cached
+        repeat-sales index is used instead of the medians. It must have been
+        fitted to ppd_file as it is now, unless ppd_file is not there to
+        check against, in which case the file it was fitted to is reported.
+        """
+        inflation = load_inflation_factors()
+        if price_index == "repeat-sales":
+            index = load_repeat_sales_cache(REPEAT_SALES_CACHE_FILE)
+            if index is None:
+                raise FileNotFoundError(
+                    f"No {REPEAT_SALES_CACHE_FILE}; run step 1 with --price-index repeat-sales first."
+                )
+            source = json.loads(index["fingerprint"])
+            if os.path.exists(ppd_file):
+                if index["fingerprint"] != json.dumps(repeat_sales_cache_fingerprint(ppd_file), sort_keys=True):
+                    raise ValueError(
+                        f"{REPEAT_SALES_CACHE_FILE} was not fitted to the current {ppd_file}; "
+                        f"rerun step 1 with --price-index repeat-sales."
+                    )
+            else:
+                print(f"  > {ppd_file} not found; using the repeat-sales index fitted to {source['source']} "
+                      f"({source['size']:,} bytes, modified "
+                      f"{pd.Timestamp(source['mtime_ns'], unit='ns'):%Y-%m-%d %H:%M})")
+            inflation["repeat_sales"] = index
+        return cls(load_nspl_index(nspl_file), inflation, scenario)
+
+    def estimate(self, postcodes, prices, dates):
+        """
+        Scores one batch given as array-likes of postcodes (any format),
+        prices and sale dates. Returns a DataFrame of OUTPUT_COLUMNS in
+        input order; bracket, pcon and status are categoricals.
+        """
+        codes, uniques = pd.factorize(np.asarray(postcodes, dtype=object))
+        prices, dates = np.asarray(prices), np.asarray(dates)
+        prices = prices.astype("float64") if prices.dtype.kind in "iuf" else parse_prices(prices)
+        dates = dates.astype("datetime64[ns]") if dates.dtype.kind == "M" else parse_dates(dates)
+        result = self.score(codes, uniques, prices, dates)
+        return pd.DataFrame({
+            "pcon": pd.Categorical.from_codes(result["pcon_code"], self.nspl_index["pcons"]),
+            "inflation_factor": result["inflation_factor"],
+            "uprated_price": result["uprated_price"],
+            "bracket": pd.Categorical.from_codes(result["band"], self.labels),
+            "annual_charge": result["annual_charge"],
+            "status": pd.Categorical.from_codes(result["status"], STATUSES),
+        })
+
+    def score(self, codes, uniques, prices, dates):
+        """
+        The array core of estimate(): postcodes as codes into uniques (-1
+        for missing), float prices (NaN where invalid) and datetime64 dates
+        (NaT where invalid). Returns a dict of arrays: pcon_code (into the
+        NSPL index's pcons), inflation_factor, uprated_price, band,
+        annual_charge and status (into STATUSES). Rows whose status is not
+        ok have pcon_code and band -1 and NaN values.
+        """
+        cleaned = clean_addr_col(pd.Series(uniques, dtype=object)).to_numpy(dtype=object)
+        unique_positions = postcode_positions(self.nspl_index, cleaned)
+        unique_pcon_codes = np.where(
+            unique_positions >= 0, self.nspl_index["pcon_code"][np.maximum(unique_positions, 0)], -1
+        )
+        found = np.append(unique_positions >= 0, False)[codes]
+        pcon_codes = np.append(unique_pcon_codes, -1)[codes].astype("int64")
+
+        status = np.full(len(codes), STATUS_OK, dtype="int8")
+        status[np.isnat(dates)] = STATUS_INVALID_DATE
+        status[~(prices > 0)] = STATUS_INVALID_PRICE
+        status[found & (pcon_codes < 0)] = STATUS_NO_CONSTITUENCY
+        status[~found] = STATUS_UNKNOWN_POSTCODE
+        ok = status == STATUS_OK
+
+        factors = np.full(len(codes), np.nan)
+        if "repeat_sales" in self.inflation:
+            factors[ok] = repeat_sales_factors(
+                self.inflation["repeat_sales"], np.append(cleaned, "")[codes][ok], dates[ok], prices[ok]
+            )
+        else:
+            factors[ok] = inflation_factors_for_rows(self.inflation, self.pcon_rows[pcon_codes[ok]], dates[ok])
+        uprated = prices * factors
+
+        band = np.full(len(codes), -1, dtype="int64")
+        band[ok] = np.searchsorted(self.scenario["thresholds"], uprated[ok] * self.scenario["uplift"], side="right")
+        charges = np.full(len(codes), np.nan)
+        charges[ok] = property_charges(uprated[ok], [self.scenario])[0]
+        return {
+            "pcon_code": np.where(ok, pcon_codes, -1),
+            "inflation_factor": factors,
+            "uprated_price": uprated,
+            "band": band,
+            "annual_charge": charges,
+            "status": status,
+        }
+
+
+def _arrow_dictionary(indices, dictionary):
+    """
+    Codes into dictionary (-1 for null) as an Arrow dictionary array, which
+    the CSV writer expands without building a Python string per row.
+    """
+    return pa.DictionaryArray.from_arrays(pa.array(indices, mask=indices < 0, type=pa.int32()),
+                                          pa.array(dictionary, type=pa.string()))
+
+
+def _arrow_floats(values):
+    return pa.array(values, mask=np.isnan(values))
+
+
+def _parse_arrow_prices(column):
+    """
+    Prices as floats, NaN where unparseable. Whole batches of plain numbers
+    cast in Arrow; a batch with "£", commas or junk goes through pandas.
+    """
+    try:
+        return pc.cast(column, pa.float64()).to_numpy(zero_copy_only=False)
+    except pa.ArrowInvalid:
+        return parse_prices(column.to_numpy(zero_copy_only=False))
+
+
+def _parse_arrow_dates(column):
+    """
+    Dates as datetime64, NaT where unparseable. ISO dates cast in Arrow;
+    anything else is parsed by pandas, day first as in UK dates.
+    """
+    try:
+        return pc.cast(column, pa.timestamp("s")).to_numpy(zero_copy_only=False)
+    except pa.ArrowInvalid:
+        return parse_dates(column.to_numpy(zero_copy_only=False))
+
+
+def _read_header(path):
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        header = next(csv.reader(f), [])
+        sample = f.read(ROW_SIZE_SAMPLE_BYTES)
+    rows = max(sample.count("\n"), 1)
+    return header, max(len(sample.encode("utf-8")) / rows, 1.0)
+
+
+def _check_columns(header, columns):
+    missing = [name for name in columns.values() if name not in header]
+    if missing:
+        raise ValueError(f"Column(s) {', '.join(missing)} not in the input; it has {', '.join(header)}")
+
+
+def _estimate_csv_arrow(estimator, input_path, output_path, columns, batch_rows, header, row_bytes):
+    read_options = pa_csv.ReadOptions(block_size=max(int(batch_rows * row_bytes), 1 << 16))
+    # Every column is read as text so the schema cannot change between
+    # blocks; the three that are scored are parsed per batch
+    convert_options = pa_csv.ConvertOptions(column_types={name: pa.string() for name in header},
+                                            strings_can_be_null=True)
+    reader = pa_csv.open_csv(input_path, read_options=read_options, convert_options=convert_options)
+    rows = 0
+    writer = None
+    try:
+        for batch in reader:
+            encoded = pc.dictionary_encode(batch.column(columns["postcode"]))
+            codes = encoded.indices.fill_null(-1).to_numpy(zero_copy_only=False).astype("int64")
+            uniques = encoded.dictionary.to_numpy(zero_copy_only=False)
+            prices = _parse_arrow_prices(batch.column(columns["price"]))
+            dates = _parse_arrow_dates(batch.column(columns["date"]))
+            result = estimator.score(codes, uniques, prices, dates)
+
+            added = [
+                _arrow_dictionary(result["pcon_code"], estimator.nspl_index["pcons"].astype(str)),
+                _arrow_floats(result["inflation_factor"]),
+                _arrow_floats(result["uprated_price"]),
+                _arrow_dictionary(result["band"], estimator.labels),
+                _arrow_floats(result["annual_charge"]),
+                _arrow_dictionary(result["status"].astype("int64"), STATUSES),
+            ]
+            table = pa.Table.from_arrays(batch.columns + added, names=batch.schema.names + OUTPUT_COLUMNS)
+            if writer is None:
+                writer = pa_csv.CSVWriter(output_path, table.schema)
+            writer.write_table(table)
+            rows += batch.num_rows
+    finally:
+        if writer is not None:
+            writer.close()
+    return rows
+
+
+def _estimate_csv_pandas(estimator, input_path, output_path, columns, batch_rows):
+    rows = 0
+    reader = pd.read_csv(input_path, dtype=str, keep_default_na=False, na_values=[""], chunksize=batch_rows,
+                         encoding="utf-8-sig")
+    for i, chunk in enumerate(reader):
+        scored = estimator.estimate(chunk[columns["postcode"]], parse_prices(chunk[columns["price"]]),
+                                    parse_dates(chunk[columns["date"]]))
+        scored.index = chunk.index
+        pd.concat([chunk, scored], axis=1).to_csv(output_path, mode="w" if i == 0 else "a", header=i == 0,
+                                                  index=False)
+        rows += len(chunk)
+    return rows
+
+
+def estimate_csv(estimator, input_path, output_path, columns=None, batch_rows=ESTIMATE_BATCH_ROWS):
+    """
+    Streams input_path through the estimator into output_path, batch by
+    batch. columns maps "postcode", "price" and "date" to the input's column
+    names (DEFAULT_COLUMNS otherwise). Returns the number of rows written.
+    """
+    columns = {**DEFAULT_COLUMNS, **(columns or {})}
+    header, row_bytes = _read_header(input_path)
+    _check_columns(header, columns)
+    tmp_path = output_path + ".tmp"
+    if pa is not None:
+        rows = _estimate_csv_arrow(estimator, input_path, tmp_path, columns, batch_rows, header, row_bytes)
+    else:
+        rows = _estimate_csv_pandas(estimator, input_path, tmp_path, columns, batch_rows)
+    if rows == 0:
+        with open(tmp_path, "w", newline="", encoding="utf-8") as f:
+            csv.writer(f).writerow(header + OUTPUT_COLUMNS)
+    os.replace(tmp_path, output_path)
+    return rows
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Score a CSV of properties (postcode, price, sale date) with the "
+                                                 "pipeline's uprating and mansion tax bands.")
+    parser.add_argument("input", help="CSV with a header row.")
+    parser.add_argument("--output", help="Output CSV (default: the input name with _scored added).")
+    parser.add_argument("--postcode-column", default=DEFAULT_COLUMNS["postcode"])
+    parser.add_argument("--price-column", default=DEFAULT_COLUMNS["price"])
+    parser.add_argument("--date-column", default=DEFAULT_COLUMNS["date"])
+    parser.add_argument("--batch-rows", type=int, default=ESTIMATE_BATCH_ROWS,
+                        help=f"Approximate rows per batch (default {ESTIMATE_BATCH_ROWS:,}).")
+    parser.add_argument("--nspl", default=NSPL_FILE, help=f"NSPL CSV the postcode index is built from (default {NSPL_FILE}).")
+    parser.add_argument("--price-index", choices=PRICE_INDEXES, default="median",
+                        help="Uprate by constituency medians (default) or by step 1's cached repeat-sales index.")
+    parser.add_argument("--ppd", default=PPD_FILE,
+                        help=f"Price Paid file the repeat-sales index must have been fitted to (default {PPD_FILE}).")
+    parser.add_argument("--scenarios", help="JSON list of scenarios (see mansion_tax.py) to pick --scenario from.")
+    parser.add_argument("--scenario", help="Name of the scenario in --scenarios to apply (default: the first).")
+    return parser.parse_args()
+
+
+def select_scenario(path, name):
+    if path is None:
+        return DEFAULT_SCENARIO
+    scenarios = load_scenarios(path)
+    if name is None:
+        return scenarios[0]
+    for scenario in scenarios:
+        if scenario["name"] == name:
+            return scenario
+    raise SystemExit(f"No scenario '{name}' in {path}; choose from {', '.join(s['name'] for s in scenarios)}")
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    output = args.output or "{}_scored{}".format(*os.path.splitext(args.input))
+    columns = {"postcode": args.postcode_column, "price": args.price_column, "date": args.date_column}
+    try:
+        estimator = PropertyEstimator.load(args.nspl, args.price_index, select_scenario(args.scenarios, args.scenario),
+                                           args.ppd)
+        rows = estimate_csv(estimator, args.input, output, columns, max(1, args.batch_rows))
+    except (FileNotFoundError, ValueError) as e:
+        sys.exit(f"Error: {e}")
+    print(f"Scored {rows:,} rows into {output}")
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+
+# © Tax Policy Associates 2025
+#
+# Uprating factors from the constituency median price series in the house
+# price workbook (see reference_data.py): a sale is uprated to the latest
+# quarter by latest median / median in the quarter it sold. The factor
+# matrix is cached in INFLATION_CACHE_FILE and rebuilt whenever the workbook
+# changes. Used by step 1 and by estimator.py.
+#
+# Factors loaded by step 1 with --price-index repeat-sales also carry the
+# repeat-sales index (repeat_sales.py) as "repeat_sales", and
+# uprating_factors then uses that instead.
+
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from reference_data import HOUSE_PRICE_XLSX, read_reference_sheet
+from repeat_sales import repeat_sales_factors
+
+HOUSE_PRICE_SHEET = "2b"
+
+# Uprating factors (constituency x quarter) derived from HOUSE_PRICE_XLSX,
+# rebuilt whenever the spreadsheet changes
+INFLATION_CACHE_FILE = "inflation_factors.npz"
+INFLATION_CACHE_VERSION = 2
+
+QUARTER_MONTHS = {"Mar": 3, "Jun": 6, "Sep": 9, "Dec": 12}
+
+
+def quarter_numbers(years, months):
+    """
+    Consecutive integer per calendar quarter (year * 4 + quarter - 1), so
+    quarters can index matrix columns directly.
+    """
+    return np.asarray(years, dtype="int64") * 4 + (np.asarray(months, dtype="int64") - 1) // 3
+
+
+def parse_quarter_headers(columns):
+    """
+    Quarter numbers for "Year ending Mar 2024"-style column headers. An
+    unrecognised month is treated as December.
+    """
+    parts = pd.Series(columns, dtype="object").str.extract(r"(\w+)\s+(\d{4})\s*$")
+    months = parts[0].map(QUARTER_MONTHS).fillna(12)
+    return quarter_numbers(parts[1].astype(int), months)
+
+
+def build_inflation_factors():
+    """
+    Reads the constituency median price series and returns a dict holding a
+    dense (constituency x quarter) matrix of uprating factors, latest median
+    price / median price in that quarter:
+      pcons          constituency code for each row
+      first_quarter  quarter number of column 0
+      factors        float64 matrix; 1 where either price is missing
+      prices         the median prices themselves, NaN where missing
+    The latest quarter is the last one with any prices.
+    """
+    df = read_reference_sheet(HOUSE_PRICE_XLSX, HOUSE_PRICE_SHEET)
+    df.rename(columns={"Area Code": "pcon", "Area Name": "name"}, inplace=True)
+    df.dropna(subset=["pcon"], inplace=True)
+    df.drop_duplicates(subset=["pcon"], inplace=True)
+
+    date_cols = [col for col in df.columns if "Year ending" in str(col)]
+    quarters = parse_quarter_headers([str(col) for col in date_cols])
+    prices = df[date_cols].apply(pd.to_numeric, errors="coerce").to_numpy(dtype="float64")
+
+    first_quarter = int(quarters.min()) if len(quarters) else 0
+    n_quarters = int(quarters.max()) - first_quarter + 1 if len(quarters) else 0
+    historical = np.full((len(df), n_quarters), np.nan)
+    historical[:, quarters - first_quarter] = prices
+
+    priced_quarters = np.flatnonzero(~np.isnan(historical).all(axis=0))
+    if len(priced_quarters):
+        latest = historical[:, priced_quarters[-1]]
+    else:
+        latest = np.full(len(df), np.nan)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        factors = latest[:, None] / historical
+    factors[np.isnan(factors)] = 1.0
+
+    return {
+        "pcons": df["pcon"].astype(str).to_numpy(),
+        "first_quarter": first_quarter,
+        "factors": factors,
+        "prices": historical,
+    }
+
+
+def inflation_cache_fingerprint():
+    stat = os.stat(HOUSE_PRICE_XLSX)
+    return {
+        "version": INFLATION_CACHE_VERSION,
+        "source": os.path.basename(HOUSE_PRICE_XLSX),
+        "sheet": HOUSE_PRICE_SHEET,
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+    }
+
+
+def load_inflation_factors():
+    """
+    The inflation factor matrix, from the .npz cache when it was built from
+    the current spreadsheet (same size and mtime), otherwise rebuilt from the
+    xlsx and cached.
+    """
+    print("Loading and preparing house price inflation data...")
+    fingerprint = json.dumps(inflation_cache_fingerprint(), sort_keys=True)
+    if os.path.exists(INFLATION_CACHE_FILE):
+        with np.load(INFLATION_CACHE_FILE) as cached:
+            if str(cached["fingerprint"]) == fingerprint:
+                print(f"  > Using cached factors from {INFLATION_CACHE_FILE}")
+                return {
+                    "pcons": cached["pcons"].astype(object),
+                    "first_quarter": int(cached["first_quarter"]),
+                    "factors": cached["factors"],
+                    "prices": cached["prices"],
+                }
+
+    inflation = build_inflation_factors()
+    tmp_path = INFLATION_CACHE_FILE + ".tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez(
+            f,
+            fingerprint=np.array(fingerprint),
+            pcons=inflation["pcons"].astype("U"),
+            first_quarter=np.array(inflation["first_quarter"]),
+            factors=inflation["factors"],
+            prices=inflation["prices"],
+        )
+    os.replace(tmp_path, INFLATION_CACHE_FILE)
+    inflation["pcons"] = inflation["pcons"].astype(object)
+    return inflation
+
+
+def inflation_factors_for(inflation, pcon, dates):
+    """
+    Uprating factor for each (constituency, transaction date) pair, gathered
+    from the factor matrix. Unknown constituencies and quarters outside the
+    series get a factor of 1.
+    """
+    return inflation_factors_for_rows(inflation, pd.Index(inflation["pcons"]).get_indexer(pcon), dates)
+
+
+def inflation_factors_for_rows(inflation, rows, dates):
+    """
+    As inflation_factors_for, for constituencies given as rows of the factor
+    matrix (-1 where unknown).
+    """
+    dates = pd.DatetimeIndex(dates)
+    factors = inflation["factors"]
+    cols = quarter_numbers(dates.year, dates.month) - inflation["first_quarter"]
+    valid = (rows >= 0) & (cols >= 0) & (cols < factors.shape[1])
+    out = np.ones(len(rows))
+    out[valid] = factors[rows[valid], cols[valid]]
+    return out
+
+
+def latest_priced_quarter(inflation):
+    """
+    Quarter number of the last quarter with any median prices, or None.
+    """
+    priced = np.flatnonzero(~np.isnan(inflation["prices"]).all(axis=0))
+    return int(priced[-1]) + inflation["first_quarter"] if len(priced) else None
+
+
+def uprating_factors_to(inflation, rows, dates, quarter):
+    """
+    Uprating factor from each sale's quarter to the given quarter, for sales
+    in constituency rows of the price matrix (-1 where unknown): median price
+    in quarter / median price when sold. 1 where either price is missing.
+    """
+    dates = pd.DatetimeIndex(dates)
+    prices = inflation["prices"]
+    cols = quarter_numbers(dates.year, dates.month) - inflation["first_quarter"]
+    target = quarter - inflation["first_quarter"]
+    out = np.ones(len(rows))
+    if not 0 <= target < prices.shape[1]:
+        return out
+    valid = (rows >= 0) & (cols >= 0) & (cols < prices.shape[1])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        factors = prices[rows[valid], target] / prices[rows[valid], cols[valid]]
+    out[valid] = np.where(np.isnan(factors), 1.0, factors)
+    return out
+
+
+def uprating_factors(inflation, pcon, postcodes, dates, prices):
+    """
+    Uprating factor to the latest quarter for each sale: from the
+    repeat-sales index when the factors carry one, otherwise from the
+    constituency median series. The latest quarter is that source's own:
+    the last quarter of Price Paid sales for the repeat-sales index, the
+    last priced quarter for the medians.
+    """
+    if "repeat_sales" in inflation:
+        return repeat_sales_factors(inflation["repeat_sales"], postcodes, dates, prices)
+    return inflation_factors_for(inflation, pcon, dates)
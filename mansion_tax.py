@@ -0,0 +1,350 @@
+#!/usr/bin/env python3
+
+# © Tax Policy Associates 2025
+#
+# Mansion tax estimation engine. The band thresholds and annual charges used
+# by the pipeline live here, and any number of alternative schedules
+# ("scenarios") can be evaluated against the per-property uprated prices that
+# step 1 caches, without rerunning the pipeline:
+#
+#   import mansion_tax
+#   properties = mansion_tax.load_uprated_prices()
+#   scenarios = [
+#       mansion_tax.DEFAULT_SCENARIO,
+#       mansion_tax.make_scenario("£1.5m start", [1_500_000, 2_000_000], [1_000, 2_500]),
+#       mansion_tax.make_scenario("10% revaluation", mansion_tax.DEFAULT_THRESHOLDS,
+#                                 mansion_tax.DEFAULT_CHARGES, uplift=1.1),
+#   ]
+#   revenue = mansion_tax.estimate_revenue(properties, scenarios)
+#   revenue["constituency"]   # pcon x scenario, £ per year
+#   revenue["postcode"]       # postcode x scenario
+#
+# or from the command line, with a JSON list of scenarios:
+#   python mansion_tax.py scenarios.json
+
+import argparse
+import json
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+# A property is in band i when its value is at least DEFAULT_THRESHOLDS[i]
+# (and below the next threshold); the charge for that band is DEFAULT_CHARGES[i]
+DEFAULT_THRESHOLDS = [2_000_000, 2_500_000, 3_500_000, 5_000_000]
+DEFAULT_CHARGES = [2_500, 3_500, 5_000, 7_500]
+DEFAULT_BAND_LABELS = ["£0 - £2m", "£2m - £2.5m", "£2.5m - £3.5m", "£3.5m - £5m", "£5m+"]
+
+# Per-property uprated prices written by step 1: one .npz per partition, plus
+# a JSON file listing the complete set of parts
+UPRATED_PRICES_DIR = "uprated_prices"
+UPRATED_PRICES_META = "parts.json"
+
+SCENARIO_OUTPUT_PREFIX = "scenario_revenue"
+REVENUE_CHUNK_SIZE = 1_000_000
+
+# Bootstrap replicates are drawn in blocks of at most this many
+# (replicate x constituency x charge group) weights, each block with its own
+# seed, so results depend on the seed but not on the number of workers
+BOOTSTRAP_BLOCK_CELLS = 20_000_000
+BOOTSTRAP_METHODS = ["multinomial", "poisson"]
+
+
+def make_scenario(name, thresholds, charges, rates=None, uplift=1.0):
+    """
+    A band/rate schedule. Each band starts at its threshold and carries a flat
+    annual charge plus, optionally, a rate on the value above the threshold.
+    uplift scales every property value first (e.g. 1.1 for a revaluation 10%
+    above the uprated prices).
+    """
+    thresholds = [float(t) for t in thresholds]
+    charges = [float(c) for c in charges]
+    rates = [0.0] * len(thresholds) if rates is None else [float(r) for r in rates]
+    if not (len(thresholds) == len(charges) == len(rates)):
+        raise ValueError(f"Scenario '{name}': thresholds, charges and rates must be the same length")
+    if any(b <= a for a, b in zip(thresholds, thresholds[1:])):
+        raise ValueError(f"Scenario '{name}': thresholds must be strictly increasing")
+    return {"name": name, "thresholds": thresholds, "charges": charges, "rates": rates, "uplift": float(uplift)}
+
+
+DEFAULT_SCENARIO = make_scenario("default", DEFAULT_THRESHOLDS, DEFAULT_CHARGES)
+
+
+def load_scenarios(path):
+    """
+    Reads a JSON list of scenarios, each an object with the make_scenario
+    arguments as keys.
+    """
+    with open(path, encoding="utf-8") as f:
+        return [make_scenario(**entry) for entry in json.load(f)]
+
+
+def _scenario_tables(scenarios):
+    """
+    Stacks the schedules into (scenarios x bands + 1) arrays, where column 0 is
+    "below the first threshold". Shorter schedules are padded with
+    thresholds no property reaches.
+    """
+    n_bands = max(len(s["thresholds"]) for s in scenarios)
+    shape = (len(scenarios), n_bands + 1)
+    lower = np.zeros(shape)
+    lower[:, 1:] = np.inf
+    charges = np.zeros(shape)
+    rates = np.zeros(shape)
+    for i, scenario in enumerate(scenarios):
+        n = len(scenario["thresholds"])
+        lower[i, 1:n + 1] = scenario["thresholds"]
+        charges[i, 1:n + 1] = scenario["charges"]
+        rates[i, 1:n + 1] = scenario["rates"]
+    uplift = np.array([s["uplift"] for s in scenarios])
+    return lower, charges, rates, uplift
+
+
+def property_charges(prices, scenarios):
+    """
+    Annual charge for every (scenario, property) pair, as a
+    (len(scenarios) x len(prices)) matrix.
+    """
+    lower, charges, rates, uplift = _scenario_tables(scenarios)
+    values = uplift[:, None] * np.asarray(prices, dtype="float64")[None, :]
+    band = np.zeros(values.shape, dtype="int64")
+    for b in range(1, lower.shape[1]):
+        band += values >= lower[:, b:b + 1]
+    base = np.take_along_axis(lower, band, axis=1)
+    return np.take_along_axis(charges, band, axis=1) + np.take_along_axis(rates, band, axis=1) * (values - base)
+
+
+def _grouped_sums(matrix, codes, n_groups):
+    """
+    Row-wise sums of a (scenarios x properties) matrix over property groups,
+    as one bincount.
+    """
+    n_scenarios = matrix.shape[0]
+    flat = (np.arange(n_scenarios)[:, None] * n_groups + codes[None, :]).ravel()
+    return np.bincount(flat, weights=matrix.ravel(), minlength=n_scenarios * n_groups).reshape(n_scenarios, n_groups)
+
+
+def estimate_revenue(properties, scenarios, chunk_size=REVENUE_CHUNK_SIZE):
+    """
+    Evaluates every scenario against every property in one pass over the
+    prices (in chunks, to bound the size of the charge matrix). properties is
+    the frame from load_uprated_prices. Returns a dict of DataFrames indexed by
+    constituency code and by postcode, one revenue column per scenario.
+    """
+    if not scenarios:
+        raise ValueError("At least one scenario is required")
+    names = [s["name"] for s in scenarios]
+    if len(set(names)) != len(names):
+        raise ValueError("Scenario names must be unique")
+
+    prices = properties["price"].to_numpy(dtype="float64")
+    groupings = {"constituency": properties["pcon"], "postcode": properties["postcode"]}
+    totals = {key: np.zeros((len(scenarios), len(col.cat.categories))) for key, col in groupings.items()}
+    codes = {key: col.cat.codes.to_numpy() for key, col in groupings.items()}
+
+    for start in range(0, len(prices), chunk_size):
+        stop = start + chunk_size
+        charges = property_charges(prices[start:stop], scenarios)
+        for key in totals:
+            totals[key] += _grouped_sums(charges, codes[key][start:stop], totals[key].shape[1])
+
+    index_names = {"constituency": "pcon", "postcode": "postcode_clean"}
+    return {
+        key: pd.DataFrame(
+            totals[key].T,
+            index=pd.Index(groupings[key].cat.categories, name=index_names[key]),
+            columns=names,
+        )
+        for key in totals
+    }
+
+
+# ==========================================
+# BOOTSTRAP INTERVALS
+# ==========================================
+def _charge_groups(properties, scenario, chunk_size=REVENUE_CHUNK_SIZE):
+    """
+    Properties collapsed to (constituency, annual charge) groups, as two
+    (constituencies x max groups) arrays: the charge of each group and how
+    many properties share it, zero-padded. Resampling properties then only
+    needs new counts per group. With a flat-charge schedule there is one
+    group per band.
+    """
+    prices = properties["price"].to_numpy(dtype="float64")
+    charges = np.concatenate([
+        property_charges(prices[start:start + chunk_size], [scenario])[0]
+        for start in range(0, len(prices), chunk_size)
+    ]) if len(prices) else np.zeros(0)
+    groups = pd.DataFrame({"pcon": properties["pcon"].cat.codes.to_numpy(), "charge": charges})
+    groups = groups.groupby(["pcon", "charge"]).size().reset_index(name="count")
+    slot = groups.groupby("pcon").cumcount().to_numpy()
+
+    shape = (len(properties["pcon"].cat.categories), int(slot.max()) + 1 if len(slot) else 1)
+    group_charges = np.zeros(shape)
+    group_counts = np.zeros(shape, dtype="int64")
+    group_charges[groups["pcon"], slot] = groups["charge"]
+    group_counts[groups["pcon"], slot] = groups["count"]
+    return group_charges, group_counts
+
+
+def _bootstrap_block(task):
+    """
+    Revenue per constituency for one block of replicates, as a (replicates x
+    constituencies) array.
+    """
+    group_charges, group_counts, replicates, method, seed = task
+    rng = np.random.default_rng(seed)
+    if method == "poisson":
+        # Each property gets a Poisson(1) weight, so a group of n gets Poisson(n)
+        weights = rng.poisson(group_counts, size=(replicates,) + group_counts.shape)
+    else:
+        # Resample each constituency's properties with replacement, keeping
+        # its number of properties fixed
+        totals = group_counts.sum(axis=1)
+        pvals = group_counts / np.maximum(totals, 1)[:, None]
+        pvals[totals == 0, 0] = 1.0
+        weights = rng.multinomial(totals, pvals, size=(replicates, len(totals)))
+    return np.einsum("rcg,cg->rc", weights, group_charges)
+
+
+def bootstrap_revenue(properties, scenario=DEFAULT_SCENARIO, replicates=1000, method="multinomial", seed=0,
+                      workers=1):
+    """
+    Bootstrap replicates of the revenue per constituency under scenario.
+    properties (from load_uprated_prices) are resampled with replacement,
+    either within each constituency ("multinomial") or as independent
+    Poisson(1) weights ("poisson"). Blocks of replicates run in parallel
+    across workers processes. Returns a (replicates x constituencies)
+    DataFrame.
+    """
+    if method not in BOOTSTRAP_METHODS:
+        raise ValueError(f"Unknown bootstrap method '{method}'; choose from {BOOTSTRAP_METHODS}")
+    group_charges, group_counts = _charge_groups(properties, scenario)
+    block = max(1, min(replicates, BOOTSTRAP_BLOCK_CELLS // group_counts.size))
+    sizes = [min(block, replicates - start) for start in range(0, replicates, block)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    tasks = [(group_charges, group_counts, size, method, block_seed) for size, block_seed in zip(sizes, seeds)]
+
+    if workers > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(tasks))) as executor:
+            blocks = list(executor.map(_bootstrap_block, tasks))
+    else:
+        blocks = [_bootstrap_block(task) for task in tasks]
+    samples = np.concatenate(blocks) if blocks else np.zeros((0, group_counts.shape[0]))
+    return pd.DataFrame(samples, columns=pd.Index(properties["pcon"].cat.categories, name="pcon"))
+
+
+def revenue_percentiles(samples, percentiles=(5, 50, 95)):
+    """
+    Percentiles of bootstrap replicates per constituency, one column per
+    percentile ("p5", "p50", ...).
+    """
+    values = np.percentile(samples.to_numpy(), percentiles, axis=0).T if len(samples) else np.nan
+    return pd.DataFrame(values, index=samples.columns, columns=[f"p{p:g}" for p in percentiles])
+
+
+# ==========================================
+# PER-PROPERTY PRICE CACHE
+# ==========================================
+def _part_path(part_id, out_dir):
+    return os.path.join(out_dir, f"part-{part_id:05d}.npz")
+
+
+def reset_uprated_prices(out_dir=UPRATED_PRICES_DIR):
+    shutil.rmtree(out_dir, ignore_errors=True)
+    os.makedirs(out_dir)
+
+
+def write_uprated_prices(merged_df, part_id, out_dir=UPRATED_PRICES_DIR, replaces=None):
+    """
+    Saves one part of the per-property cache: uprated price, clean postcode
+    and constituency for each row of merged_df. replaces lists postcodes whose
+    rows in earlier parts this part supersedes (used by incremental updates).
+    """
+    postcode_codes, postcodes = pd.factorize(merged_df["Postcode_Clean"])
+    pcon_codes, pcons = pd.factorize(merged_df["pcon"])
+    with open(_part_path(part_id, out_dir), "wb") as f:
+        np.savez(
+            f,
+            price=merged_df["Uprated_Price"].to_numpy(dtype="float64"),
+            postcode_codes=postcode_codes.astype("int32"),
+            postcodes=np.asarray(postcodes, dtype=object).astype("U"),
+            pcon_codes=pcon_codes.astype("int16"),
+            pcons=np.asarray(pcons, dtype=object).astype("U"),
+            replaces=np.array(sorted(replaces or []), dtype="U"),
+        )
+
+
+def finalize_uprated_prices(part_ids, out_dir=UPRATED_PRICES_DIR, append=False):
+    """
+    Records the parts that make up a complete cache. With append, the parts
+    are added after those already listed.
+    """
+    meta_path = os.path.join(out_dir, UPRATED_PRICES_META)
+    parts = []
+    if append:
+        with open(meta_path, encoding="utf-8") as f:
+            parts = json.load(f)["parts"]
+    parts += [os.path.basename(_part_path(part_id, out_dir)) for part_id in sorted(part_ids)]
+    with open(meta_path, "w", encoding="utf-8") as f:
+        json.dump({"parts": parts}, f, indent=2)
+
+
+def uprated_prices_available(out_dir=UPRATED_PRICES_DIR):
+    return os.path.exists(os.path.join(out_dir, UPRATED_PRICES_META))
+
+
+def load_uprated_prices(out_dir=UPRATED_PRICES_DIR):
+    """
+    The cached per-property prices as a DataFrame with categorical postcode
+    and pcon columns and a float price column.
+    """
+    if not uprated_prices_available(out_dir):
+        raise FileNotFoundError(
+            f"No per-property price cache in {out_dir}/; run 1_read_transaction_data_and_create_csvs.py first."
+        )
+    with open(os.path.join(out_dir, UPRATED_PRICES_META), encoding="utf-8") as f:
+        parts = json.load(f)["parts"]
+
+    frames = []
+    for part in parts:
+        with np.load(os.path.join(out_dir, part)) as data:
+            if len(data["replaces"]):
+                frames = [df[~df["postcode"].isin(data["replaces"])] for df in frames]
+            frames.append(pd.DataFrame({
+                "postcode": pd.Categorical.from_codes(data["postcode_codes"], data["postcodes"].astype(object)),
+                "pcon": pd.Categorical.from_codes(data["pcon_codes"], data["pcons"].astype(object)),
+                "price": data["price"],
+            }))
+
+    frames = [df for df in frames if len(df)]
+    if not frames:
+        return pd.DataFrame({
+            "postcode": pd.Categorical([]), "pcon": pd.Categorical([]), "price": np.array([], dtype="float64"),
+        })
+    return pd.DataFrame({
+        "postcode": pd.api.types.union_categoricals([df["postcode"] for df in frames], sort_categories=True),
+        "pcon": pd.api.types.union_categoricals([df["pcon"] for df in frames], sort_categories=True),
+        "price": np.concatenate([df["price"].to_numpy() for df in frames]),
+    })
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Estimate mansion tax revenue for a set of band/rate scenarios.")
+    parser.add_argument("scenarios", nargs="?",
+                        help="JSON list of scenarios (name, thresholds, charges, optional rates and uplift). "
+                             "Defaults to the current schedule.")
+    parser.add_argument("--prices-dir", default=UPRATED_PRICES_DIR)
+    parser.add_argument("--output-prefix", default=SCENARIO_OUTPUT_PREFIX)
+    args = parser.parse_args()
+
+    scenario_list = load_scenarios(args.scenarios) if args.scenarios else [DEFAULT_SCENARIO]
+    revenue = estimate_revenue(load_uprated_prices(args.prices_dir), scenario_list)
+    for key, table in revenue.items():
+        path = f"{args.output_prefix}_by_{key}.csv"
+        table.to_csv(path)
+        print(f"Saved to {path}")
+    print("\nTotal revenue by scenario:")
+    print(revenue["constituency"].sum().map("£{:,.0f}".format).to_string())
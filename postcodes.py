@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+
+# © Tax Policy Associates 2025
+#
+# Postcode cleaning and a prebuilt NSPL lookup index shared by the pipeline
+# scripts. The index is a directory of .npy arrays sorted by clean postcode,
+# loaded memory-mapped, so lookups are a searchsorted/take rather than a
+# pandas merge against the full NSPL CSV.
+#
+# Build (or rebuild) it once with:
+#   python postcodes.py NSPL_FEB_2025_UK.csv
+
+import argparse
+import json
+import os
+import re
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+NSPL_INDEX_DIR = "nspl_index"
+NSPL_INDEX_VERSION = 1
+NSPL_COLUMNS = ["pcds", "pcon", "lat", "long"]
+
+# ASCII bytes other than A-Z and 0-9, deleted after upper-casing. NUL is kept
+# because it separates values in the joined fast path below.
+_ASCII_DELETE = bytes(i for i in range(1, 128) if not (48 <= i <= 57 or 65 <= i <= 90))
+_NON_ALNUM = re.compile(r'[^A-Z0-9]')
+
+
+def _clean_unique_values(values):
+    """
+    Cleans an object array of distinct strings. ASCII values (the usual case)
+    are joined and cleaned with a single upper()/bytes.translate over the whole
+    block; anything else falls back to the regex one value at a time.
+    """
+    simple = np.fromiter((v.isascii() and '\x00' not in v for v in values), dtype=bool, count=len(values))
+    cleaned = np.empty(len(values), dtype=object)
+    if simple.any():
+        joined = '\x00'.join(values[simple]).upper().encode('ascii')
+        cleaned[simple] = joined.translate(None, _ASCII_DELETE).decode('ascii').split('\x00')
+    cleaned[~simple] = [_NON_ALNUM.sub('', value.upper()) for value in values[~simple]]
+    return cleaned
+
+
+def clean_addr_col(series):
+    """
+    Standardizes address strings: Upper case, removes special chars/spaces.
+
+    Each distinct value is cleaned once and the result broadcast back to the
+    rows, so heavily repeated columns (postcodes, house numbers) cost a pass
+    over their unique values rather than a regex per row.
+    """
+    codes, uniques = pd.factorize(series)
+    # Missing values get code -1, which picks up the trailing ''
+    cleaned = np.append(_clean_unique_values(uniques.astype(str).to_numpy(dtype=object)), '')
+    return pd.Series(cleaned[codes], index=series.index, name=series.name)
+
+
+def read_nspl_csv(nspl_file):
+    """
+    Reads the NSPL columns we need. Older releases call the postcode column
+    'pcd' rather than 'pcds'; the header is checked first so the file is only
+    parsed once.
+    """
+    header = pd.read_csv(nspl_file, nrows=0).columns
+    postcode_col = "pcds" if "pcds" in header else "pcd"
+    df_nspl = pd.read_csv(
+        nspl_file,
+        usecols=[postcode_col, "pcon", "lat", "long"],
+        dtype={postcode_col: "str", "pcon": "str"},
+        low_memory=False,
+    )
+    return df_nspl.rename(columns={postcode_col: "pcds"})[NSPL_COLUMNS]
+
+
+def nspl_index_dir(nspl_file, index_root=NSPL_INDEX_DIR):
+    stem = os.path.splitext(os.path.basename(nspl_file))[0]
+    return os.path.join(index_root, stem)
+
+
+def _source_fingerprint(nspl_file):
+    stat = os.stat(nspl_file)
+    return {"source": os.path.basename(nspl_file), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def nspl_index_is_valid(nspl_file, index_root=NSPL_INDEX_DIR):
+    meta_path = os.path.join(nspl_index_dir(nspl_file, index_root), "meta.json")
+    if not os.path.exists(meta_path):
+        return False
+    with open(meta_path, encoding="utf-8") as f:
+        meta = json.load(f)
+    return meta.get("version") == NSPL_INDEX_VERSION and meta.get("fingerprint") == _source_fingerprint(nspl_file)
+
+
+def build_nspl_index(nspl_file, index_root=NSPL_INDEX_DIR):
+    """
+    Writes the index for an NSPL CSV:
+      postcode.npy   clean postcode, fixed-width bytes, sorted
+      pcds.npy       display postcode, fixed-width bytes
+      pcon_code.npy  int16 code into pcons.npy (-1 where NSPL has no pcon)
+      lat.npy/long.npy
+    Where NSPL repeats a clean postcode, the first row in the file wins.
+    """
+    print(f"Building NSPL index from {nspl_file}...")
+    df_nspl = read_nspl_csv(nspl_file)
+    df_nspl["Postcode_Clean"] = clean_addr_col(df_nspl["pcds"])
+    df_nspl.drop_duplicates(subset=["Postcode_Clean"], inplace=True)
+
+    keys = df_nspl["Postcode_Clean"].to_numpy(dtype=object).astype("S")
+    order = np.argsort(keys, kind="stable")
+    pcon_codes, pcons = pd.factorize(df_nspl["pcon"])
+
+    out_dir = nspl_index_dir(nspl_file, index_root)
+    os.makedirs(out_dir, exist_ok=True)
+    np.save(os.path.join(out_dir, "postcode.npy"), keys[order])
+    np.save(os.path.join(out_dir, "pcds.npy"), df_nspl["pcds"].fillna("").to_numpy(dtype=object).astype("S")[order])
+    np.save(os.path.join(out_dir, "pcon_code.npy"), pcon_codes.astype("int16")[order])
+    np.save(os.path.join(out_dir, "pcons.npy"), pcons.to_numpy(dtype=object).astype("U"))
+    np.save(os.path.join(out_dir, "lat.npy"), df_nspl["lat"].to_numpy(dtype="float64")[order])
+    np.save(os.path.join(out_dir, "long.npy"), df_nspl["long"].to_numpy(dtype="float64")[order])
+    with open(os.path.join(out_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump({
+            "version": NSPL_INDEX_VERSION,
+            "fingerprint": _source_fingerprint(nspl_file),
+            "postcodes": int(len(keys)),
+        }, f, indent=2)
+    print(f"  > Indexed {len(keys):,} postcodes in {out_dir}/")
+
+
+@lru_cache(maxsize=None)
+def load_nspl_index(nspl_file, index_root=NSPL_INDEX_DIR):
+    """
+    Returns the index as a dict of arrays (memory-mapped where possible),
+    building it first if it is missing or older than the NSPL CSV. Cached per
+    process, so pool workers pay the load once.
+    """
+    if not nspl_index_is_valid(nspl_file, index_root):
+        build_nspl_index(nspl_file, index_root)
+    index_dir = nspl_index_dir(nspl_file, index_root)
+
+    def load(name, mmap_mode="r"):
+        return np.load(os.path.join(index_dir, f"{name}.npy"), mmap_mode=mmap_mode)
+
+    return {
+        "postcode": load("postcode"),
+        "pcds": load("pcds"),
+        "pcon_code": load("pcon_code"),
+        "pcons": load("pcons", mmap_mode=None).astype(object),
+        "lat": load("lat"),
+        "long": load("long"),
+    }
+
+
+def postcode_positions(index, postcodes):
+    """
+    Row of each clean postcode in the index, or -1 where it is not present.
+    Only the distinct postcodes are searched.
+    """
+    codes, uniques = pd.factorize(postcodes)
+    keys = index["postcode"]
+    width = keys.dtype.itemsize
+    uniques = np.asarray(uniques, dtype=object)
+    if len(keys) == 0 or len(uniques) == 0:
+        return np.full(len(codes), -1, dtype="int64")
+    # Fixed-width conversion would truncate longer strings into false matches
+    fits = np.fromiter((len(u) <= width for u in uniques), dtype=bool, count=len(uniques))
+    probe = uniques.astype(f"S{width}")
+    pos = np.minimum(np.searchsorted(keys, probe), len(keys) - 1)
+    unique_pos = np.where(fits & (keys[pos] == probe), pos, -1)
+    return np.append(unique_pos, -1)[codes]
+
+
+def lookup_postcodes(index, positions):
+    """
+    NSPL columns (pcon, pcds, lat, long) for rows of the index. positions must
+    all be valid (>= 0).
+    """
+    pcds = np.char.decode(index["pcds"][positions], "ascii").astype(object)
+    pcds[pcds == ""] = np.nan
+    pcon_code = index["pcon_code"][positions]
+    pcon = np.where(pcon_code >= 0, index["pcons"][np.maximum(pcon_code, 0)], np.nan)
+    return {
+        "pcon": pcon,
+        "pcds": pcds,
+        "lat": np.asarray(index["lat"][positions]),
+        "long": np.asarray(index["long"][positions]),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the memory-mapped NSPL postcode index.")
+    parser.add_argument("nspl_file")
+    parser.add_argument("--index-dir", default=NSPL_INDEX_DIR)
+    args = parser.parse_args()
+    build_nspl_index(args.nspl_file, args.index_dir)
@@ -0,0 +1,470 @@
+#!/usr/bin/env python3
+
+# © Tax Policy Associates 2025
+#
+# A small local HTTP service for point queries against the pipeline's
+# outputs, so tools do not have to download and scan whole files. Step 2's
+# outputs are loaded once into indexes:
+#
+#   postcodes      sorted array of cleaned postcodes (exact and prefix lookups
+#                  by binary search)
+#   points         uniform lon/lat grid, stored as postcode order sorted by
+#                  cell, so a bounding box is a few contiguous slices
+#   constituencies dict by pcon code, with their postcodes grouped by code
+#                  and a presorted order per ranking field
+#
+# Endpoints (GET, JSON responses):
+#
+#   /health
+#   /postcode/<postcode>                    e.g. /postcode/SW1A%201AA
+#   /postcodes?prefix=SW1A&limit=20
+#   /bbox?west=&south=&east=&north=&limit=  postcodes in the box, most
+#                                           high-value sales first
+#   /constituency/<pcon code>
+#   /constituency/<pcon code>/postcodes?limit=
+#   /constituencies/top?n=10&by=estimate
+#   /search?q=&limit=                       constituency names/codes and
+#                                           postcode prefixes
+#
+#   python query_service.py --data-dir . --port 8765
+#
+# The HTTP handling is plain asyncio streams (HTTP/1.1 with keep-alive), so
+# nothing beyond the pipeline's own dependencies is needed.
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import time
+from http import HTTPStatus
+from urllib.parse import parse_qs, unquote, urlsplit
+
+import numpy as np
+import pandas as pd
+
+from columnar import read_columns
+from mansion_tax import DEFAULT_BAND_LABELS, DEFAULT_CHARGES
+
+# Step 2's outputs (see 2_build_data_for_webapp.py)
+CONSTITUENCY_GEOJSON = "constituency_council_tax_bands.geojson"
+POSTCODE_COLUMNAR = "postcode_sales_by_bracket.mtc"
+POSTCODE_GEOJSON = "postcode_sales_by_bracket.geojson"
+DATA_MANIFEST = "map_data_manifest.json"
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+
+# Transaction-count fields and their annual charge, used for the revenue
+# estimate when the data manifest has no surcharge_rates
+ESTIMATE_COUNT_FIELDS = ["tx_2m_to_2_5m_count", "tx_2_5m_to_3_5m_count", "tx_3_5m_to_5m_count", "tx_over_5m_count"]
+DEFAULT_SURCHARGE_RATES = dict(zip(ESTIMATE_COUNT_FIELDS, DEFAULT_CHARGES))
+
+POSTCODE_FIELDS = [
+    "postcode_label", "postcode_clean", "lat", "long", "pcon_code", "hv_count",
+] + DEFAULT_BAND_LABELS + ["Total Sales", "rejected_multiple_transactions"]
+POSTCODE_FLOAT_FIELDS = {"lat", "long"}
+POSTCODE_STRING_FIELDS = {"postcode_label", "postcode_clean", "pcon_code"}
+
+# About 2km north-south; England fits in roughly 500 x 550 cells
+GRID_CELL_DEGREES = 0.02
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 10_000
+MAX_REQUEST_LINE = 8192
+
+
+class QueryError(Exception):
+    """
+    A request that cannot be answered; becomes an HTTP error response.
+    """
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+def clean_postcode(value):
+    return "".join(value.split()).upper()
+
+
+def _geometry_bounds(geometry):
+    """
+    [west, south, east, north] of a GeoJSON geometry, or None if it is empty.
+    """
+    coordinates = []
+    pending = [geometry.get("coordinates", []) if geometry else []]
+    while pending:
+        item = pending.pop()
+        if item and isinstance(item[0], (int, float)):
+            coordinates.append(item[:2])
+        else:
+            pending.extend(item)
+    if not coordinates:
+        return None
+    xy = np.asarray(coordinates, dtype=float)
+    return [float(xy[:, 0].min()), float(xy[:, 1].min()), float(xy[:, 0].max()), float(xy[:, 1].max())]
+
+
+def _python_value(value):
+    if isinstance(value, np.integer):
+        return int(value)
+    if isinstance(value, np.floating):
+        return None if np.isnan(value) else float(value)
+    return value
+
+
+class ResultIndex:
+    """
+    Step 2's postcode and constituency results, indexed for the service's
+    queries. Every query method returns plain JSON-ready Python objects.
+    """
+
+    def __init__(self, postcodes, constituencies):
+        self._load_postcodes(postcodes)
+        self._load_constituencies(constituencies)
+
+    @classmethod
+    def load(cls, data_dir="."):
+        """
+        Reads the postcode table (the columnar file if there is one, otherwise
+        the GeoJSON) and the constituency GeoJSON from data_dir.
+        """
+        columnar_path = os.path.join(data_dir, POSTCODE_COLUMNAR)
+        if os.path.exists(columnar_path):
+            postcodes = read_columns(columnar_path)
+        else:
+            with open(os.path.join(data_dir, POSTCODE_GEOJSON), encoding="utf-8") as f:
+                features = json.load(f)["features"]
+            postcodes = pd.DataFrame([feature["properties"] for feature in features])
+
+        with open(os.path.join(data_dir, CONSTITUENCY_GEOJSON), encoding="utf-8") as f:
+            features = json.load(f)["features"]
+        rates = DEFAULT_SURCHARGE_RATES
+        manifest_path = os.path.join(data_dir, DATA_MANIFEST)
+        if os.path.exists(manifest_path):
+            with open(manifest_path, encoding="utf-8") as f:
+                rates = json.load(f).get("surcharge_rates") or rates
+        constituencies = []
+        for feature in features:
+            record = dict(feature["properties"])
+            record["estimate"] = sum(rate * (record.get(field) or 0) for field, rate in rates.items())
+            record["bbox"] = _geometry_bounds(feature.get("geometry"))
+            constituencies.append(record)
+        return cls(postcodes, constituencies)
+
+    def _load_postcodes(self, postcodes):
+        postcodes = postcodes.reset_index(drop=True)
+        self.columns = {}
+        for field in POSTCODE_FIELDS:
+            if field in POSTCODE_STRING_FIELDS:
+                self.columns[field] = postcodes[field].fillna("").astype(str).to_numpy()
+            elif field in POSTCODE_FLOAT_FIELDS:
+                # The columnar file stores float32; round away the widening noise
+                self.columns[field] = postcodes[field].to_numpy(dtype=np.float64).round(6)
+            else:
+                self.columns[field] = postcodes[field].fillna(0).to_numpy(dtype=np.int64)
+        self.postcode_count = len(postcodes)
+
+        # Exact and prefix lookups: binary search over the sorted keys
+        keys = np.array([clean_postcode(p) for p in self.columns["postcode_clean"]], dtype=str)
+        self.key_order = np.argsort(keys, kind="stable")
+        self.sorted_keys = keys[self.key_order]
+
+        # Bounding boxes: postcodes sorted by grid cell (row-major), so the
+        # cells of one grid row within a box are a single contiguous slice
+        lon, lat = self.columns["long"], self.columns["lat"]
+        valid = np.flatnonzero(np.isfinite(lon) & np.isfinite(lat))
+        if len(valid):
+            self.grid_origin = (float(lon[valid].min()), float(lat[valid].min()))
+            self.grid_cols = int((lon[valid].max() - self.grid_origin[0]) // GRID_CELL_DEGREES) + 1
+            self.grid_rows = int((lat[valid].max() - self.grid_origin[1]) // GRID_CELL_DEGREES) + 1
+        else:
+            self.grid_origin, self.grid_cols, self.grid_rows = (0.0, 0.0), 0, 0
+        cells = self._cell_ids(lon[valid], lat[valid])
+        order = np.argsort(cells, kind="stable")
+        self.grid_points = valid[order]
+        self.grid_cells = cells[order]
+
+        # Postcodes by constituency, as slices of one array grouped by code
+        pcon = self.columns["pcon_code"]
+        by_pcon = np.argsort(pcon, kind="stable")
+        codes, starts, counts = np.unique(pcon[by_pcon], return_index=True, return_counts=True)
+        self.pcon_postcodes = {
+            code: by_pcon[start:start + count] for code, start, count in zip(codes, starts, counts)
+        }
+
+    def _cell_ids(self, lon, lat):
+        col = ((lon - self.grid_origin[0]) // GRID_CELL_DEGREES).astype(np.int64)
+        row = ((lat - self.grid_origin[1]) // GRID_CELL_DEGREES).astype(np.int64)
+        return row * self.grid_cols + col
+
+    def _load_constituencies(self, constituencies):
+        self.constituencies = {}
+        for record in constituencies:
+            code = record["pcon_code"]
+            postcodes = self.pcon_postcodes.get(code, np.empty(0, dtype=np.int64))
+            record["postcodes"] = len(postcodes)
+            record["postcode_hv_count"] = int(self.columns["hv_count"][postcodes].sum())
+            self.constituencies[code] = {key: _python_value(value) for key, value in record.items()}
+        self.ranking_fields = sorted(
+            key for key, value in next(iter(self.constituencies.values()), {}).items()
+            if isinstance(value, (int, float)) and not isinstance(value, bool)
+        )
+        self._rankings = {}
+        self._search_keys = [
+            (f"{record.get('name', '')} {code}".lower(), code) for code, record in self.constituencies.items()
+        ]
+
+    def postcode_record(self, i):
+        return {field: _python_value(self.columns[field][i]) for field in POSTCODE_FIELDS}
+
+    def _key_range(self, prefix):
+        start = np.searchsorted(self.sorted_keys, prefix, side="left")
+        end = np.searchsorted(self.sorted_keys, prefix + "\uffff", side="left")
+        return int(start), int(end)
+
+    def postcode(self, postcode):
+        key = clean_postcode(postcode)
+        start = np.searchsorted(self.sorted_keys, key, side="left")
+        if start == len(self.sorted_keys) or self.sorted_keys[start] != key:
+            raise QueryError(HTTPStatus.NOT_FOUND, f"No results for postcode '{postcode}'")
+        return self.postcode_record(self.key_order[start])
+
+    def postcodes_with_prefix(self, prefix, limit):
+        key = clean_postcode(prefix)
+        if not key:
+            raise QueryError(HTTPStatus.BAD_REQUEST, "prefix must not be empty")
+        start, end = self._key_range(key)
+        return {
+            "total": end - start,
+            "postcodes": [self.postcode_record(i) for i in self.key_order[start:min(end, start + limit)]],
+        }
+
+    def bbox(self, west, south, east, north, limit):
+        if west > east or south > north:
+            raise QueryError(HTTPStatus.BAD_REQUEST, "bbox must have west <= east and south <= north")
+        # Huge coordinates would overflow the grid cell arithmetic below
+        if not (-180 <= west and east <= 180 and -90 <= south and north <= 90):
+            raise QueryError(HTTPStatus.BAD_REQUEST,
+                             "bbox must lie within longitude -180 to 180 and latitude -90 to 90")
+        ox, oy = self.grid_origin
+        col0 = max(int((west - ox) // GRID_CELL_DEGREES), 0)
+        col1 = min(int((east - ox) // GRID_CELL_DEGREES), self.grid_cols - 1)
+        row0 = max(int((south - oy) // GRID_CELL_DEGREES), 0)
+        row1 = min(int((north - oy) // GRID_CELL_DEGREES), self.grid_rows - 1)
+        slices = []
+        for row in range(row0, row1 + 1) if col0 <= col1 else []:
+            start = np.searchsorted(self.grid_cells, row * self.grid_cols + col0, side="left")
+            end = np.searchsorted(self.grid_cells, row * self.grid_cols + col1, side="right")
+            if end > start:
+                slices.append(self.grid_points[start:end])
+        candidates = np.concatenate(slices) if slices else np.empty(0, dtype=np.int64)
+
+        lon, lat = self.columns["long"][candidates], self.columns["lat"][candidates]
+        inside = candidates[(lon >= west) & (lon <= east) & (lat >= south) & (lat <= north)]
+        total = len(inside)
+        hv = self.columns["hv_count"][inside]
+        if total > limit:
+            top = np.argpartition(-hv, limit - 1)[:limit]
+            inside, hv = inside[top], hv[top]
+        ranked = inside[np.lexsort((inside, -hv))]
+        return {"total": total, "postcodes": [self.postcode_record(i) for i in ranked]}
+
+    def constituency(self, code):
+        record = self.constituencies.get(code.upper())
+        if record is None:
+            raise QueryError(HTTPStatus.NOT_FOUND, f"No constituency with code '{code}'")
+        return record
+
+    def constituency_postcodes(self, code, limit):
+        record = self.constituency(code)
+        postcodes = self.pcon_postcodes.get(record["pcon_code"], np.empty(0, dtype=np.int64))
+        hv = self.columns["hv_count"][postcodes]
+        ranked = postcodes[np.lexsort((postcodes, -hv))][:limit]
+        return {
+            "pcon_code": record["pcon_code"],
+            "total": int(len(postcodes)),
+            "postcodes": [self.postcode_record(i) for i in ranked],
+        }
+
+    def top_constituencies(self, n, by):
+        if by not in self.ranking_fields:
+            raise QueryError(HTTPStatus.BAD_REQUEST,
+                             f"Cannot rank by '{by}'; choose from {', '.join(self.ranking_fields)}")
+        if by not in self._rankings:
+            self._rankings[by] = sorted(
+                self.constituencies,
+                key=lambda code: (-(self.constituencies[code].get(by) or 0), code),
+            )
+        return {"by": by, "constituencies": [self.constituencies[code] for code in self._rankings[by][:n]]}
+
+    def search(self, query, limit):
+        query = query.strip().lower()
+        if not query:
+            raise QueryError(HTTPStatus.BAD_REQUEST, "q must not be empty")
+        # There are only a few hundred constituencies; a scan is fine
+        constituencies = [
+            {"pcon_code": code, "name": self.constituencies[code].get("name")}
+            for key, code in self._search_keys if query in key
+        ][:limit]
+        postcodes = []
+        key = clean_postcode(query)
+        if key:
+            start, end = self._key_range(key)
+            postcodes = [
+                {"postcode_label": self.columns["postcode_label"][i], "lat": float(self.columns["lat"][i]),
+                 "long": float(self.columns["long"][i])}
+                for i in self.key_order[start:min(end, start + limit)]
+            ]
+        return {"constituencies": constituencies, "postcodes": postcodes}
+
+    def summary(self):
+        return {
+            "postcodes": self.postcode_count,
+            "constituencies": len(self.constituencies),
+            "grid": {"cell_degrees": GRID_CELL_DEGREES, "cols": self.grid_cols, "rows": self.grid_rows},
+            "ranking_fields": self.ranking_fields,
+        }
+
+
+def _int_param(params, name, default, maximum=MAX_LIMIT):
+    try:
+        value = int(params.get(name, [default])[0])
+    except ValueError:
+        raise QueryError(HTTPStatus.BAD_REQUEST, f"{name} must be an integer")
+    if not 0 < value <= maximum:
+        raise QueryError(HTTPStatus.BAD_REQUEST, f"{name} must be between 1 and {maximum}")
+    return value
+
+
+def _float_param(params, name):
+    try:
+        value = float(params[name][0])
+    except KeyError:
+        raise QueryError(HTTPStatus.BAD_REQUEST, f"{name} is required")
+    except ValueError:
+        raise QueryError(HTTPStatus.BAD_REQUEST, f"{name} must be a number")
+    # float() accepts "nan" and "inf", which no grid cell can be found for
+    if not math.isfinite(value):
+        raise QueryError(HTTPStatus.BAD_REQUEST, f"{name} must be a finite number")
+    return value
+
+
+def answer(index, target):
+    """
+    The JSON result for a request target (path and query string).
+    """
+    url = urlsplit(target)
+    parts = [unquote(part) for part in url.path.strip("/").split("/") if part]
+    params = parse_qs(url.query)
+
+    if parts == ["health"]:
+        return {"status": "ok", **index.summary()}
+    if len(parts) == 2 and parts[0] == "postcode":
+        return index.postcode(parts[1])
+    if parts == ["postcodes"]:
+        return index.postcodes_with_prefix(params.get("prefix", [""])[0], _int_param(params, "limit", DEFAULT_LIMIT))
+    if parts == ["bbox"]:
+        return index.bbox(*[_float_param(params, name) for name in ["west", "south", "east", "north"]],
+                          limit=_int_param(params, "limit", DEFAULT_LIMIT))
+    if len(parts) == 2 and parts[0] == "constituency":
+        return index.constituency(parts[1])
+    if len(parts) == 3 and parts[0] == "constituency" and parts[2] == "postcodes":
+        return index.constituency_postcodes(parts[1], _int_param(params, "limit", DEFAULT_LIMIT))
+    if parts == ["constituencies", "top"]:
+        return index.top_constituencies(_int_param(params, "n", 10), params.get("by", ["estimate"])[0])
+    if parts == ["search"]:
+        return index.search(params.get("q", [""])[0], _int_param(params, "limit", 20))
+    raise QueryError(HTTPStatus.NOT_FOUND, f"Unknown endpoint '{url.path}'")
+
+
+def _response(status, body, keep_alive):
+    payload = json.dumps(body, separators=(",", ":"), allow_nan=False).encode("utf-8")
+    head = (
+        f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+        "Content-Type: application/json; charset=utf-8\r\n"
+        f"Content-Length: {len(payload)}\r\n"
+        "Access-Control-Allow-Origin: *\r\n"
+        f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n"
+        "\r\n"
+    )
+    return head.encode("ascii") + payload
+
+
+async def handle_connection(index, reader, writer):
+    """
+    Serves requests on one connection until the client closes it or asks
+    for Connection: close.
+    """
+    try:
+        while True:
+            request_line = await reader.readline()
+            if not request_line:
+                break
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+
+            fields = request_line.decode("latin-1").split()
+            keep_alive = (len(fields) == 3 and fields[2] == "HTTP/1.1"
+                          and headers.get("connection", "").lower() != "close")
+            if len(fields) != 3 or len(request_line) > MAX_REQUEST_LINE:
+                keep_alive = False
+                response = _response(HTTPStatus.BAD_REQUEST, {"error": "Malformed request"}, keep_alive)
+            elif fields[0] != "GET":
+                # Any request body is not read, so the connection cannot be reused
+                keep_alive = False
+                response = _response(HTTPStatus.METHOD_NOT_ALLOWED, {"error": "Only GET is supported"}, keep_alive)
+            else:
+                try:
+                    response = _response(HTTPStatus.OK, answer(index, fields[1]), keep_alive)
+                except QueryError as e:
+                    response = _response(e.status, {"error": e.message}, keep_alive)
+                except Exception as e:
+                    # A bug in a query (or a result json.dumps refuses) still gets a reply
+                    print(f"Error answering {fields[1]}: {type(e).__name__}: {e}")
+                    response = _response(HTTPStatus.INTERNAL_SERVER_ERROR, {"error": "Internal server error"},
+                                         keep_alive)
+            writer.write(response)
+            await writer.drain()
+            if not keep_alive:
+                break
+    except (ConnectionError, asyncio.LimitOverrunError, ValueError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(index, host, port):
+    server = await asyncio.start_server(
+        lambda reader, writer: handle_connection(index, reader, writer), host, port, limit=MAX_REQUEST_LINE * 2,
+    )
+    addresses = ", ".join(f"http://{s.getsockname()[0]}:{s.getsockname()[1]}" for s in server.sockets)
+    print(f"Serving on {addresses}")
+    async with server:
+        await server.serve_forever()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Serve point queries over the pipeline's outputs.")
+    parser.add_argument("--data-dir", default=".", help="Directory holding step 2's outputs (default: current).")
+    parser.add_argument("--host", default=DEFAULT_HOST, help=f"Address to listen on (default {DEFAULT_HOST}).")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help=f"Port to listen on (default {DEFAULT_PORT}).")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    start = time.perf_counter()
+    index = ResultIndex.load(args.data_dir)
+    print(f"Loaded {index.postcode_count:,} postcodes and {len(index.constituencies):,} constituencies "
+          f"in {time.perf_counter() - start:.2f}s")
+    try:
+        asyncio.run(serve(index, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
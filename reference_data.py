@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+
+# © Tax Policy Associates 2025
+#
+# The reference workbooks (ONS council tax stock and house price statistics)
+# that steps 1 and 2 both read. Opening an xlsx is slow, so each workbook is
+# opened once, every sheet the pipeline uses from it is parsed, and the
+# parsed sheets are cached as Arrow files keyed by the workbook's sha256:
+#
+#   reference_cache/<workbook>.json                     sha256, engine, sheets
+#   reference_cache/<workbook>.<sha256[:16]>.<n>.arrow  one per sheet
+#
+# The calamine engine (python-calamine) is used when it is installed and
+# openpyxl otherwise. Without pyarrow the cache is disabled and workbooks
+# are parsed on every run (still once per run for all their sheets).
+
+import hashlib
+import json
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+except ImportError:  # the reference cache is optional
+    pa = None
+
+try:
+    import python_calamine
+except ImportError:  # falls back to openpyxl
+    python_calamine = None
+
+CTSOP_XLSX = "CTSOP_tables.xlsx"
+CTSOP_SHEET = "CTSOP2.0"
+CTSOP_HEADER_ROW = 4  # zero-indexed: A5 is the header row
+
+HOUSE_PRICE_XLSX = "housepricestatisticsparlicon.xlsx"
+HOUSE_PRICE_HEADER_ROW = 2  # zero-indexed header row
+
+# Every sheet the pipeline reads from each workbook and its header row. All
+# of a workbook's sheets are parsed together, so whichever step reads the
+# workbook first caches what the other step needs.
+WORKBOOK_SHEETS = {
+    CTSOP_XLSX: {CTSOP_SHEET: CTSOP_HEADER_ROW},
+    HOUSE_PRICE_XLSX: {"2a": HOUSE_PRICE_HEADER_ROW, "2b": HOUSE_PRICE_HEADER_ROW},
+}
+
+REFERENCE_CACHE_DIR = "reference_cache"
+REFERENCE_CACHE_VERSION = 1
+
+# Object columns can mix text and numbers (e.g. ":" for suppressed values),
+# which Arrow cannot store in one column, so each cell is written as text
+# with a type code alongside
+CELL_MISSING, CELL_STR, CELL_INT, CELL_FLOAT, CELL_BOOL, CELL_TIMESTAMP = range(6)
+_CELL_PARSERS = {
+    CELL_STR: str,
+    CELL_INT: int,
+    CELL_FLOAT: float,
+    CELL_BOOL: lambda text: text == "True",
+    CELL_TIMESTAMP: pd.Timestamp,
+}
+
+# Sheets already read by this process, so a step that reads a sheet twice
+# does not go back to the cache
+_loaded = {}
+
+
+def excel_engine():
+    return "calamine" if python_calamine is not None else "openpyxl"
+
+
+def _file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _sheet_layout(path, sheet, header):
+    """
+    The sheets to parse from path, with their header rows, including the
+    requested one.
+    """
+    sheets = dict(WORKBOOK_SHEETS.get(os.path.basename(path), {}))
+    if header is not None:
+        sheets[sheet] = header
+    elif sheet not in sheets:
+        raise ValueError(f"No header row known for sheet '{sheet}' of {path}; pass header=")
+    return sheets
+
+
+def _cell_kind(value):
+    if value is None or (isinstance(value, float) and np.isnan(value)) or value is pd.NaT:
+        return CELL_MISSING
+    if isinstance(value, str):
+        return CELL_STR
+    if isinstance(value, (bool, np.bool_)):
+        return CELL_BOOL
+    if isinstance(value, (int, np.integer)):
+        return CELL_INT
+    if isinstance(value, (float, np.floating)):
+        return CELL_FLOAT
+    if isinstance(value, (pd.Timestamp, np.datetime64)) or hasattr(value, "isoformat"):
+        return CELL_TIMESTAMP
+    return CELL_STR
+
+
+def _sheet_to_arrow(df):
+    """
+    The sheet as an Arrow table with positional column names; the original
+    names and column encodings go in the schema metadata.
+    """
+    arrays, names, columns = [], [], []
+    for i, (name, series) in enumerate(df.items()):
+        if series.dtype == object:
+            values = series.to_numpy()
+            kinds = np.fromiter((_cell_kind(v) for v in values), dtype=np.int8, count=len(values))
+            text = [None if kind == CELL_MISSING else (v.isoformat() if kind == CELL_TIMESTAMP else str(v))
+                    for v, kind in zip(values, kinds)]
+            arrays += [pa.array(text, type=pa.string()), pa.array(kinds)]
+            names += [f"c{i}", f"c{i}.kind"]
+            columns.append({"name": name, "encoding": "cells"})
+        else:
+            arrays.append(pa.array(series.to_numpy()))
+            names.append(f"c{i}")
+            columns.append({"name": name, "encoding": "values", "dtype": str(series.dtype)})
+    metadata = {"columns": json.dumps(columns, default=str)}
+    return pa.Table.from_arrays(arrays, names=names).replace_schema_metadata(metadata)
+
+
+def _sheet_from_arrow(table):
+    columns = json.loads(table.schema.metadata[b"columns"])
+    out = {}
+    for i, column in enumerate(columns):
+        if column["encoding"] == "cells":
+            text = table.column(f"c{i}").to_pylist()
+            kinds = table.column(f"c{i}.kind").to_numpy()
+            values = np.empty(len(kinds), dtype=object)
+            for j, (value, kind) in enumerate(zip(text, kinds)):
+                values[j] = np.nan if kind == CELL_MISSING else _CELL_PARSERS[kind](value)
+            out[column["name"]] = values
+        else:
+            out[column["name"]] = table.column(f"c{i}").to_numpy(zero_copy_only=False).astype(column["dtype"])
+    return pd.DataFrame(out, index=pd.RangeIndex(table.num_rows))
+
+
+def _cache_paths(path, digest):
+    stem = os.path.basename(path)
+    meta_path = os.path.join(REFERENCE_CACHE_DIR, f"{stem}.json")
+    return meta_path, os.path.join(REFERENCE_CACHE_DIR, f"{stem}.{digest[:16]}.{{}}.arrow")
+
+
+def _read_cached(path, digest, sheet, header):
+    meta_path, data_template = _cache_paths(path, digest)
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path, encoding="utf-8") as f:
+        meta = json.load(f)
+    if (meta.get("version"), meta.get("sha256"), meta.get("engine")) != (
+            REFERENCE_CACHE_VERSION, digest, excel_engine()):
+        return None
+    for n, entry in enumerate(meta["sheets"]):
+        if entry["sheet"] == sheet and entry["header"] == header:
+            with pa.memory_map(data_template.format(n), "r") as source:
+                return _sheet_from_arrow(pa.ipc.open_file(source).read_all())
+    return None
+
+
+def _write_cache(path, digest, sheets):
+    """
+    Writes the parsed sheets ({(sheet, header): frame}) and replaces any
+    cache of an earlier version of the workbook.
+    """
+    os.makedirs(REFERENCE_CACHE_DIR, exist_ok=True)
+    meta_path, data_template = _cache_paths(path, digest)
+    stale = re.compile(rf"^{re.escape(os.path.basename(path))}\.[0-9a-f]{{16}}\.\d+\.arrow$")
+    for name in os.listdir(REFERENCE_CACHE_DIR):
+        if stale.match(name):
+            os.remove(os.path.join(REFERENCE_CACHE_DIR, name))
+
+    entries = []
+    for n, ((sheet, header), df) in enumerate(sheets.items()):
+        table = _sheet_to_arrow(df)
+        with pa.OSFile(data_template.format(n), "wb") as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        entries.append({"sheet": sheet, "header": header, "rows": len(df)})
+    meta = {
+        "version": REFERENCE_CACHE_VERSION,
+        "source": os.path.basename(path),
+        "sha256": digest,
+        "engine": excel_engine(),
+        "sheets": entries,
+    }
+    tmp_path = meta_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=2)
+    os.replace(tmp_path, meta_path)
+
+
+def _parse_workbook(path, sheets):
+    """
+    Opens the workbook once and parses each of sheets ({sheet: header row}).
+    """
+    with pd.ExcelFile(path, engine=excel_engine()) as workbook:
+        return {(sheet, header): workbook.parse(sheet, header=header) for sheet, header in sheets.items()}
+
+
+def read_reference_sheet(path, sheet, header=None, use_cache=True):
+    """
+    One sheet of a reference workbook as a DataFrame, as pd.read_excel(path,
+    sheet_name=sheet, header=header) would return it. header defaults to the
+    row given in WORKBOOK_SHEETS. The result is a fresh copy the caller may
+    modify.
+    """
+    sheets = _sheet_layout(path, sheet, header)
+    header = sheets[sheet]
+    digest = _file_sha256(path)
+    key = (os.path.abspath(path), digest, sheet, header)
+    if key in _loaded:
+        return _loaded[key].copy()
+
+    cache = use_cache and pa is not None
+    df = _read_cached(path, digest, sheet, header) if cache else None
+    if df is None:
+        print(f"  > Parsing {os.path.basename(path)} ({', '.join(sheets)}) with {excel_engine()}")
+        parsed = _parse_workbook(path, sheets)
+        for (name, name_header), frame in parsed.items():
+            _loaded[(os.path.abspath(path), digest, name, name_header)] = frame
+        if cache:
+            _write_cache(path, digest, parsed)
+        df = parsed[(sheet, header)]
+    else:
+        _loaded[key] = df
+    return df.copy()
@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+
+# © Tax Policy Associates 2025
+#
+# Repeat-sales house price index, an alternative to uprating by the ratio of
+# constituency median prices. Every pair of consecutive sales of the same
+# property gives an observed price change between two quarters, and a
+# quarterly log index is fitted to them by least squares (Bailey, Muth and
+# Nourse):
+#
+#   log(price2 / price1) = b[q2] - b[q1] + error
+#
+# There is an index per region (postcode area, e.g. "SW") and price tier. A
+# tier is a band of the price distribution in the quarter of sale (see
+# TIER_QUANTILES). A pair is placed by the average of its two sales'
+# percentiles: tiering on the first sale alone would put sales that happened
+# to go for more than the property was worth in the upper tiers, and their
+# resales would make those tiers look as if prices had fallen. The log index
+# of region r and tier t is fitted in three steps, each to what the previous
+# ones leave unexplained:
+#
+#   a[t, q]      a national index for the tier
+#   d[r, q]      the region's deviation, shared by its tiers
+#   e[r, t, q]   the deviation of the region's tier from both
+#
+# and each step's quarter-to-quarter changes are shrunk towards zero by a
+# penalty worth SMOOTHING[step] pairs. Where a region's tier has plenty of
+# pairs the penalties make no difference; where it has few (prime properties
+# outside London, say) its index falls back to the national tier index plus
+# the region's general trend, and quarters with no pairs at all are
+# interpolated rather than treated as zero inflation.
+#
+# The design matrix is never formed. A series' normal equations depend on
+# the pairs only through how many link each two quarters and the net log
+# change into each quarter, which one bincount each gives for every segment
+# (region and tier) at once. Each step is then a batch of small dense
+# (quarter x quarter) solves, so once the pairs are counted the fit takes
+# the same time for a thousand pairs as for tens of millions.
+
+import os
+
+import numpy as np
+import pandas as pd
+
+from cube import postcode_levels
+
+# Upper bounds of the lower tiers, as quantiles of the price distribution
+# in the quarter of sale: below the median, to the 90th percentile, to the
+# 99th, and the top 1%
+TIER_QUANTILES = [0.5, 0.9, 0.99]
+# Penalty weight, in pairs, on each quarter-to-quarter change of the
+# national tier index, the regional deviation and the region-tier deviation
+SMOOTHING = {"tier": 1.0, "region": 4.0, "region_tier": 16.0}
+# Where step 1 caches the index it fitted (see save_repeat_sales_cache)
+REPEAT_SALES_CACHE_FILE = "repeat_sales_index.npz"
+REPEAT_SALES_CACHE_VERSION = 1
+# Pairs whose price changed by more than this factor either way are dropped
+# as likely data errors or substantially altered properties
+MAX_PRICE_RATIO = 10.0
+
+
+def sale_quarters(dates):
+    dates = pd.DatetimeIndex(dates)
+    return dates.year.to_numpy(dtype="int64") * 4 + (dates.month.to_numpy(dtype="int64") - 1) // 3
+
+
+def postcode_regions(postcodes):
+    """
+    Region code of each clean postcode, and the region names: the postcode
+    area, computed once per distinct postcode.
+    """
+    postcode_codes, uniques = pd.factorize(pd.Series(postcodes))
+    region_codes, regions = pd.factorize(postcode_levels(uniques)["area"])
+    return np.where(postcode_codes >= 0, region_codes[np.maximum(postcode_codes, 0)], -1), regions.to_numpy()
+
+
+def quarter_percentiles(quarters, prices, first_quarter, n_quarters, quantiles=TIER_QUANTILES):
+    """
+    Each sale's percentile (0 to 1) among the sales of its quarter, and the
+    (quarter x len(quantiles)) matrix of price quantiles per quarter, NaN for
+    quarters with no sales. Quantiles are the lower-nearest sale, so one
+    sorted pass gives both.
+    """
+    order = np.lexsort((prices, quarters))
+    sorted_quarters = quarters[order] - first_quarter
+    starts = np.searchsorted(sorted_quarters, np.arange(n_quarters), side="left")
+    counts = np.searchsorted(sorted_quarters, np.arange(n_quarters), side="right") - starts
+
+    percentiles = np.empty(len(prices))
+    ranks = np.arange(len(prices)) - starts[sorted_quarters]
+    percentiles[order] = ranks / np.maximum(counts[sorted_quarters] - 1, 1)
+
+    bounds = np.full((n_quarters, len(quantiles)), np.nan)
+    has_sales = counts > 0
+    positions = starts[has_sales, None] + np.floor(np.outer(counts[has_sales] - 1, quantiles)).astype("int64")
+    bounds[has_sales] = prices[order][positions]
+    return percentiles, bounds
+
+
+def price_tiers(bounds, first_quarter, quarters, prices):
+    """
+    Tier of each sale given its quarter and price; -1 where the quarter is
+    outside the index.
+    """
+    cols = quarters - first_quarter
+    valid = (cols >= 0) & (cols < len(bounds))
+    tiers = np.full(len(prices), -1, dtype="int64")
+    tiers[valid] = (prices[valid, None] >= bounds[cols[valid]]).sum(axis=1)
+    return tiers
+
+
+def repeat_sale_pairs(property_ids, dates):
+    """
+    Row positions (first, second) of every pair of consecutive sales of the
+    same property. Sales of a property on the same day are ordered by row
+    position, and pairs within one quarter are left out as they carry no
+    information about the index.
+    """
+    order = np.lexsort((np.arange(len(dates)), dates, property_ids))
+    same_property = property_ids[order][1:] == property_ids[order][:-1]
+    first, second = order[:-1][same_property], order[1:][same_property]
+    quarters = sale_quarters(dates)
+    keep = quarters[first] != quarters[second]
+    return first[keep], second[keep]
+
+
+def _smoothed_fit(laplacian, net_change, weight):
+    """
+    Solves (laplacian + weight * D'D) x = net_change for a batch of series
+    (leading axes), with D the quarter-to-quarter difference matrix and each
+    series pinned to 0 in its last quarter. weight > 0 makes every system
+    positive definite, so series with no pairs come out as 0.
+    """
+    n_quarters = laplacian.shape[-1]
+    penalty = np.diag(np.r_[1.0, np.full(n_quarters - 2, 2.0), 1.0]) if n_quarters > 1 else np.zeros((1, 1))
+    if n_quarters > 1:
+        penalty -= np.eye(n_quarters, k=1) + np.eye(n_quarters, k=-1)
+    system = (laplacian + weight * penalty)[..., :-1, :-1]
+    x = np.zeros(net_change.shape)
+    if n_quarters > 1:
+        x[..., :-1] = np.linalg.solve(system, net_change[..., :-1, None])[..., 0]
+    return x
+
+
+def fit_log_index(regions, tiers, first_quarters, second_quarters, log_returns,
+                  n_regions, n_tiers, n_quarters, smoothing=SMOOTHING):
+    """
+    Fits the log index to pairs given as quarter columns (0..n_quarters-1)
+    with their region, tier and log price change. Returns the
+    (region x tier x quarter) log index, 0 in the last quarter.
+    """
+    # The least-squares fit of a series needs only how many pairs link each
+    # two quarters (as a graph Laplacian) and the net log change into each
+    # quarter, per segment (region and tier)
+    n_segments = n_regions * n_tiers
+    segments = regions * n_tiers + tiers
+    links = np.bincount((segments * n_quarters + first_quarters) * n_quarters + second_quarters,
+                        minlength=n_segments * n_quarters * n_quarters).reshape(n_segments, n_quarters, n_quarters)
+    links = (links + links.transpose(0, 2, 1)).astype("float64")
+    laplacian = -links
+    laplacian[:, np.arange(n_quarters), np.arange(n_quarters)] += links.sum(axis=2)
+    laplacian = laplacian.reshape(n_regions, n_tiers, n_quarters, n_quarters)
+    net_change = (np.bincount(segments * n_quarters + second_quarters, weights=log_returns,
+                              minlength=n_segments * n_quarters)
+                  - np.bincount(segments * n_quarters + first_quarters, weights=log_returns,
+                                minlength=n_segments * n_quarters)).reshape(n_regions, n_tiers, n_quarters)
+
+    def residual(fitted):
+        # Net log change left over once the fitted index is taken out
+        return net_change - np.einsum("rtij,rtj->rti", laplacian, fitted)
+
+    tier_index = _smoothed_fit(laplacian.sum(axis=0), net_change.sum(axis=0), smoothing["tier"])
+    fitted = np.broadcast_to(tier_index, net_change.shape)
+    region_index = _smoothed_fit(laplacian.sum(axis=1), residual(fitted).sum(axis=1), smoothing["region"])
+    fitted = fitted + region_index[:, None, :]
+    return fitted + _smoothed_fit(laplacian, residual(fitted), smoothing["region_tier"])
+
+
+def build_repeat_sales_index(postcodes, property_ids, dates, prices, smoothing=SMOOTHING):
+    """
+    The index from a cleaned Price Paid history (one entry per sale). Returns
+    a dict:
+      regions        region name for each row of log_index
+      first_quarter  quarter number of column 0 (year * 4 + quarter - 1)
+      tier_bounds    (quarter x tier - 1) price bounds between tiers
+      log_index      (region x tier x quarter), 0 in the last quarter
+      pairs          number of repeat-sale pairs used
+    """
+    property_ids = np.asarray(property_ids)
+    dates = np.asarray(dates, dtype="datetime64[ns]")
+    prices = np.asarray(prices, dtype="float64")
+    quarters = sale_quarters(dates)
+    first_quarter = int(quarters.min())
+    n_quarters = int(quarters.max()) - first_quarter + 1
+
+    region_codes, regions = postcode_regions(postcodes)
+    percentiles, bounds = quarter_percentiles(quarters, prices, first_quarter, n_quarters)
+
+    first, second = repeat_sale_pairs(property_ids, dates)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        log_returns = np.log(prices[second] / prices[first])
+    keep = np.isfinite(log_returns) & (np.abs(log_returns) <= np.log(MAX_PRICE_RATIO)) & (region_codes[first] >= 0)
+    first, second, log_returns = first[keep], second[keep], log_returns[keep]
+
+    tiers = np.searchsorted(TIER_QUANTILES, (percentiles[first] + percentiles[second]) / 2, side="right")
+    log_index = fit_log_index(
+        region_codes[first], tiers, quarters[first] - first_quarter, quarters[second] - first_quarter,
+        log_returns, len(regions), len(TIER_QUANTILES) + 1, n_quarters, smoothing,
+    )
+    return {
+        "regions": regions.astype(object),
+        "first_quarter": first_quarter,
+        "tier_bounds": bounds,
+        "log_index": log_index,
+        "pairs": int(len(log_returns)),
+    }
+
+
+def last_index_quarter(index):
+    """
+    Quarter number that repeat_sales_factors uprates to.
+    """
+    return index["first_quarter"] + index["log_index"].shape[2] - 1
+
+
+def repeat_sales_factors(index, postcodes, dates, prices):
+    """
+    Uprating factor from each sale's quarter to the index's last quarter,
+    for its region and tier. Sales in unknown regions or outside the index
+    get a factor of 1.
+
+    The last quarter is the last one with sales in the Price Paid file (see
+    last_index_quarter), not the last quarter of the constituency median
+    series that median uprating targets (inflation.latest_priced_quarter).
+    The median series is published later, so the two usually differ by a
+    quarter or more.
+    """
+    quarters = sale_quarters(dates)
+    prices = np.asarray(prices, dtype="float64")
+    region_codes, regions = postcode_regions(postcodes)
+    rows = pd.Index(index["regions"]).get_indexer(regions)
+    rows = np.where(region_codes >= 0, rows[np.maximum(region_codes, 0)], -1)
+    tiers = price_tiers(index["tier_bounds"], index["first_quarter"], quarters, prices)
+    cols = quarters - index["first_quarter"]
+    valid = (rows >= 0) & (tiers >= 0)
+    out = np.ones(len(prices))
+    out[valid] = np.exp(-index["log_index"][rows[valid], tiers[valid], cols[valid]])
+    return out
+
+
+def repeat_sales_cache_fingerprint(ppd_file):
+    """
+    What an index fitted to ppd_file depends on: the file (by name, size and
+    mtime) and the fitting parameters.
+    """
+    stat = os.stat(ppd_file)
+    return {
+        "version": REPEAT_SALES_CACHE_VERSION,
+        "source": os.path.basename(ppd_file),
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "tier_quantiles": TIER_QUANTILES,
+        "smoothing": SMOOTHING,
+        "max_price_ratio": MAX_PRICE_RATIO,
+    }
+
+
+def save_repeat_sales_cache(path, index, fingerprint):
+    """
+    Writes the index to an .npz file along with fingerprint, a string
+    identifying what it was fitted to.
+    """
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez(
+            f,
+            fingerprint=np.array(fingerprint),
+            regions=index["regions"].astype("U"),
+            first_quarter=np.array(index["first_quarter"]),
+            tier_bounds=index["tier_bounds"],
+            log_index=index["log_index"],
+            pairs=np.array(index["pairs"]),
+        )
+    os.replace(tmp_path, path)
+
+
+def load_repeat_sales_cache(path, fingerprint=None):
+    """
+    The index saved in path, or None if there is none or (when fingerprint
+    is given) it was fitted to something else. The index's "fingerprint" is
+    the one it was saved with.
+    """
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as cached:
+        if fingerprint is not None and str(cached["fingerprint"]) != fingerprint:
+            return None
+        return {
+            "regions": cached["regions"].astype(object),
+            "first_quarter": int(cached["first_quarter"]),
+            "tier_bounds": cached["tier_bounds"],
+            "log_index": cached["log_index"],
+            "pairs": int(cached["pairs"]),
+            "fingerprint": str(cached["fingerprint"]),
+        }
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+
+# © Tax Policy Associates 2025
+#
+# Per-stage timing and memory instrumentation for the pipeline scripts. Each
+# named step is run inside RunReport.stage(), which records wall time, CPU
+# time, peak RSS and (where the script supplies them) row counts in and out.
+# The report is written as JSON to run_reports/ so runs against different
+# data releases can be compared; optionally each stage is also profiled with
+# cProfile (or pyinstrument, if installed) and the profile saved alongside.
+
+import cProfile
+import json
+import os
+import platform
+import re
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyinstrument
+except ImportError:  # pyinstrument profiles are optional
+    pyinstrument = None
+
+try:
+    import resource
+except ImportError:  # Unix only; memory and child CPU are reported as null elsewhere
+    resource = None
+
+RUN_REPORT_DIR = "run_reports"
+PROFILERS = ["cprofile", "pyinstrument"]
+
+
+def peak_rss_mb(children=False):
+    """
+    Peak resident set size of this process so far, in MB. With children, the
+    peak of the largest finished child process (e.g. a pool worker) instead.
+    None where the platform has no resource module (Windows).
+    """
+    if resource is None:
+        return None
+    who = resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF
+    peak = resource.getrusage(who).ru_maxrss
+    # Linux reports kilobytes, macOS reports bytes
+    if sys.platform == "darwin":
+        return peak / (1024 * 1024)
+    return peak / 1024
+
+
+def peak_rss_text(children=False):
+    """
+    peak_rss_mb for printing: "1,234 MB", or "unavailable".
+    """
+    peak = peak_rss_mb(children)
+    return "unavailable" if peak is None else f"{peak:,.0f} MB"
+
+
+def _round(value, digits):
+    return None if value is None else round(value, digits)
+
+
+def _children_cpu_s():
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _slug(name):
+    return re.sub(r"[^a-z0-9]+", "_", name.lower()).strip("_")
+
+
+def _describe_input(path):
+    if not os.path.exists(path):
+        return {"file": path, "available": False}
+    stat = os.stat(path)
+    return {"file": path, "available": True, "bytes": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+class RunReport:
+    """
+    Collects one record per pipeline stage and writes them as a JSON report on
+    exit. Used as a context manager around a script's main body:
+
+        with RunReport("1_read_transaction_data", inputs=[...]) as report:
+            with report.stage("Loading Price Paid Data", pbar) as stage:
+                df = ...
+                stage["rows_out"] = len(df)
+    """
+
+    def __init__(self, script, inputs=(), report_path=None, profiler=None, mode=None):
+        if profiler is not None and profiler not in PROFILERS:
+            raise ValueError(f"Unknown profiler '{profiler}'; choose from {PROFILERS}")
+        if profiler == "pyinstrument" and pyinstrument is None:
+            print("Warning: pyinstrument is not installed; profiling stages with cProfile instead.")
+            profiler = "cprofile"
+        self.script = script
+        self.profiler = profiler
+        self.started = datetime.now(timezone.utc)
+        run_id = f"{_slug(script)}-{self.started.strftime('%Y%m%dT%H%M%SZ')}"
+        self.report_path = report_path or os.path.join(RUN_REPORT_DIR, f"{run_id}.json")
+        self.profile_dir = os.path.splitext(self.report_path)[0] + "_profiles"
+        self.report = {
+            "script": script,
+            "mode": mode,
+            "started": self.started.isoformat(),
+            "python": platform.python_version(),
+            "pandas": pd.__version__,
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "inputs": [_describe_input(path) for path in inputs],
+            "stages": [],
+        }
+
+    @property
+    def failed(self):
+        """
+        Whether the run raised or marked a stage as failed. A stage that was
+        skipped (e.g. an update already applied) does not count.
+        """
+        return any(str(record.get("status", "")).startswith("failed")
+                   for record in [self.report] + self.report["stages"])
+
+    def __enter__(self):
+        self._wall_start = time.perf_counter()
+        self._cpu_start = time.process_time()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.report["status"] = f"failed: {exc_type.__name__}: {exc}"
+        else:
+            # A stage can end the run early (e.g. a missing input) without raising
+            stage_status = [stage["status"] for stage in self.report["stages"] if stage["status"] != "ok"]
+            self.report["status"] = stage_status[-1] if stage_status else "ok"
+        self.report["wall_s"] = round(time.perf_counter() - self._wall_start, 3)
+        self.report["cpu_s"] = round(time.process_time() - self._cpu_start, 3)
+        self.report["peak_rss_mb"] = _round(peak_rss_mb(), 1)
+        self.report["peak_rss_children_mb"] = _round(peak_rss_mb(children=True), 1)
+        self.write()
+        return False
+
+    @contextmanager
+    def stage(self, name, pbar=None):
+        """
+        Times one named step. Yields a dict the caller can add row counts (or
+        any other JSON-serialisable details) to. With a tqdm bar, also sets its
+        description on entry and advances it on successful exit.
+        """
+        if pbar is not None:
+            pbar.set_description(name)
+        record = {"stage": name, "rows_in": None, "rows_out": None}
+        rss_before = peak_rss_mb()
+        children_cpu_before = _children_cpu_s()
+        profiler = self._start_profiler()
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield record
+            record.setdefault("status", "ok")
+        except BaseException as exc:
+            record["status"] = f"failed: {type(exc).__name__}"
+            raise
+        finally:
+            record["wall_s"] = round(time.perf_counter() - wall_start, 3)
+            record["cpu_s"] = round(time.process_time() - cpu_start, 3)
+            record["cpu_children_s"] = (
+                None if children_cpu_before is None else round(_children_cpu_s() - children_cpu_before, 3)
+            )
+            # ru_maxrss is a high-water mark: the growth is what this stage added
+            record["peak_rss_mb"] = _round(peak_rss_mb(), 1)
+            record["peak_rss_growth_mb"] = None if rss_before is None else round(record["peak_rss_mb"] - rss_before, 1)
+            record["profile"] = self._stop_profiler(profiler, name)
+            self.report["stages"].append(record)
+        if pbar is not None:
+            pbar.update(1)
+
+    def _start_profiler(self):
+        if self.profiler == "cprofile":
+            profiler = cProfile.Profile()
+            profiler.enable()
+            return profiler
+        if self.profiler == "pyinstrument":
+            profiler = pyinstrument.Profiler()
+            profiler.start()
+            return profiler
+        return None
+
+    def _stop_profiler(self, profiler, name):
+        if profiler is None:
+            return None
+        os.makedirs(self.profile_dir, exist_ok=True)
+        stem = os.path.join(self.profile_dir, f"{len(self.report['stages']) + 1:02d}_{_slug(name)}")
+        if self.profiler == "cprofile":
+            profiler.disable()
+            path = stem + ".prof"
+            profiler.dump_stats(path)
+        else:
+            profiler.stop()
+            path = stem + ".html"
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(profiler.output_html())
+        return path
+
+    def write(self):
+        os.makedirs(os.path.dirname(self.report_path) or ".", exist_ok=True)
+        with open(self.report_path, "w", encoding="utf-8") as f:
+            json.dump(self.report, f, indent=2)
+        print(f"Run report written to {self.report_path}")
+
+
+def add_report_arguments(parser):
+    """
+    The --report/--profile-stages options shared by the pipeline scripts.
+    """
+    parser.add_argument("--report", metavar="PATH",
+                        help=f"Where to write the JSON run report (default: a timestamped file in {RUN_REPORT_DIR}/).")
+    parser.add_argument("--profile-stages", nargs="?", const="cprofile", choices=PROFILERS,
+                        help="Also profile each stage (cProfile by default) and save the profiles next to the report.")
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+
+# © Tax Policy Associates 2025
+#
+# Precomputed point clusters for the postcode layer, written as a static
+# z/x/y pyramid of small JSON tiles (Web Mercator, 256px tiles). At each zoom
+# below the detail zoom, points are grouped into square pixel cells and each
+# group is written as one cluster with summed counts; at the detail zoom every
+# point is written individually. The client fetches only the tiles in view.
+#
+# Like the other published files (see web_artifacts.py), the tiles can be
+# cached forever: the pyramid is written under a directory named by a hash of
+# every tile, so new content always has new URLs, and each tile has .gz (and
+# .br) variants beside it. Only index.json keeps a fixed name, and is
+# published under a hashed one.
+
+import hashlib
+import json
+import math
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from web_artifacts import HASH_LENGTH, write_compressed_variants
+
+TILE_SIZE = 256
+MAX_LATITUDE = 85.0511287798
+# Where the pyramid is assembled before it is moved under its hash
+PARTIAL_DIR = ".partial"
+
+
+def lonlat_to_pixels(lon, lat, zoom):
+    """
+    Global Web Mercator pixel coordinates at a zoom level.
+    """
+    world = TILE_SIZE * 2 ** zoom
+    lat = np.clip(np.asarray(lat, dtype="float64"), -MAX_LATITUDE, MAX_LATITUDE)
+    x = (np.asarray(lon, dtype="float64") + 180.0) / 360.0 * world
+    sin_lat = np.sin(np.radians(lat))
+    y = (0.5 - np.log((1 + sin_lat) / (1 - sin_lat)) / (4 * math.pi)) * world
+    return x, y
+
+
+def _json_rows(df):
+    # to_json turns NaN into null and numpy scalars into plain numbers
+    return json.loads(df.to_json(orient="values", double_precision=6))
+
+
+def _write_tile(out_dir, zoom, x, y, tile):
+    """
+    Writes one tile and its compressed variants; returns the tile's bytes
+    and the size of each encoding.
+    """
+    tile_dir = os.path.join(out_dir, str(zoom), str(x))
+    os.makedirs(tile_dir, exist_ok=True)
+    path = os.path.join(tile_dir, f"{y}.json")
+    data = json.dumps(tile, separators=(",", ":")).encode("utf-8")
+    with open(path, "wb") as f:
+        f.write(data)
+    encodings = write_compressed_variants(path, data)
+    return data, {name: encoding["bytes"] for name, encoding in encodings.items()}
+
+
+def _remove_stale_versions(out_dir, keep):
+    """
+    Deletes every pyramid directory in out_dir but keep (including a layout
+    from before versioning, with zoom directories at the top).
+    """
+    for name in os.listdir(out_dir):
+        path = os.path.join(out_dir, name)
+        if name != keep and os.path.isdir(path):
+            shutil.rmtree(path)
+
+
+def build_cluster_tiles(points, out_dir, lon_col, lat_col, sum_cols, point_cols,
+                        min_zoom, detail_zoom, cell_px):
+    """
+    Writes the pyramid for a DataFrame of points to out_dir/<version>/
+    (removing any previous version) and returns the tiling scheme for the
+    manifest. version is a hash of every tile's position and content.
+
+    Each tile is {"clusters": [[lon, lat, points, *sum_cols], ...],
+    "points": [[lon, lat, *point_cols], ...]}. Cells holding a single point
+    are written as points, so a lone postcode is clickable at every zoom.
+    cell_px must divide TILE_SIZE so every cell sits inside one tile. The
+    non-empty tiles are listed in index.json as {zoom: {x: [y, ...]}}.
+    """
+    if TILE_SIZE % cell_px:
+        raise ValueError(f"cell_px must divide {TILE_SIZE}")
+    partial_dir = os.path.join(out_dir, PARTIAL_DIR)
+    shutil.rmtree(partial_dir, ignore_errors=True)
+    os.makedirs(partial_dir)
+
+    points = points.reset_index(drop=True)
+    lon = points[lon_col].to_numpy(dtype="float64")
+    lat = points[lat_col].to_numpy(dtype="float64")
+    point_rows = points[[lon_col, lat_col] + point_cols]
+    cell_scale = TILE_SIZE // cell_px
+
+    index = {}
+    digest = hashlib.sha256()
+    encoded_bytes = {}
+    n_tiles = 0
+    for zoom in range(min_zoom, detail_zoom + 1):
+        px, py = lonlat_to_pixels(lon, lat, zoom)
+        if zoom == detail_zoom:
+            cell_x, cell_y = np.floor(px).astype("int64"), np.floor(py).astype("int64")
+            group = np.arange(len(points))
+            tile_x, tile_y = cell_x // TILE_SIZE, cell_y // TILE_SIZE
+        else:
+            cell_x, cell_y = np.floor(px / cell_px).astype("int64"), np.floor(py / cell_px).astype("int64")
+            group = pd.factorize(pd.MultiIndex.from_arrays([cell_x, cell_y]))[0]
+            tile_x, tile_y = cell_x // cell_scale, cell_y // cell_scale
+
+        sizes = np.bincount(group, minlength=group.max() + 1 if len(group) else 0)
+        single = sizes[group] == 1
+
+        frame = points[sum_cols].copy()
+        frame["_group"] = group
+        clusters = frame[~single].groupby("_group").sum()
+        clusters.insert(0, "points", sizes[clusters.index])
+        clusters.insert(0, lat_col, pd.Series(lat[~single]).groupby(group[~single]).mean())
+        clusters.insert(0, lon_col, pd.Series(lon[~single]).groupby(group[~single]).mean())
+        first_row = pd.Series(np.arange(len(group))).groupby(group).first()
+        clusters["_tile_x"] = tile_x[first_row[clusters.index].to_numpy()]
+        clusters["_tile_y"] = tile_y[first_row[clusters.index].to_numpy()]
+
+        singles = point_rows[single].copy()
+        singles["_tile_x"] = tile_x[single]
+        singles["_tile_y"] = tile_y[single]
+
+        tiles = {}
+        for (x, y), rows in clusters.groupby(["_tile_x", "_tile_y"]):
+            tiles.setdefault((int(x), int(y)), {"clusters": [], "points": []})["clusters"] = _json_rows(
+                rows.drop(columns=["_tile_x", "_tile_y"])
+            )
+        for (x, y), rows in singles.groupby(["_tile_x", "_tile_y"]):
+            tiles.setdefault((int(x), int(y)), {"clusters": [], "points": []})["points"] = _json_rows(
+                rows.drop(columns=["_tile_x", "_tile_y"])
+            )
+
+        for (x, y), tile in sorted(tiles.items()):
+            data, sizes = _write_tile(partial_dir, zoom, x, y, tile)
+            digest.update(f"{zoom}/{x}/{y}:{len(data)}\n".encode("ascii") + data)
+            for name, size in sizes.items():
+                encoded_bytes[name] = encoded_bytes.get(name, 0) + size
+        zoom_index = index.setdefault(str(zoom), {})
+        for x, y in sorted(tiles):
+            zoom_index.setdefault(str(x), []).append(y)
+        n_tiles += len(tiles)
+
+    version = digest.hexdigest()[:HASH_LENGTH]
+    version_dir = os.path.join(out_dir, version)
+    if os.path.exists(version_dir):
+        # Identical tiles were published before; keep the copy already served
+        shutil.rmtree(partial_dir)
+    else:
+        os.rename(partial_dir, version_dir)
+    _remove_stale_versions(out_dir, keep=version)
+
+    index_path = os.path.join(out_dir, "index.json")
+    with open(index_path, "w", encoding="utf-8") as f:
+        json.dump(index, f, separators=(",", ":"))
+
+    return {
+        "format": "xyz-json",
+        "version": version,
+        "url_template": f"{out_dir}/{version}/{{z}}/{{x}}/{{y}}.json",
+        "index": index_path,
+        "projection": "EPSG:3857",
+        "tile_size": TILE_SIZE,
+        "min_zoom": min_zoom,
+        "max_zoom": detail_zoom,
+        "detail_zoom": detail_zoom,
+        "cluster_cell_px": cell_px,
+        "cluster_columns": [lon_col, lat_col, "points"] + list(sum_cols),
+        "point_columns": [lon_col, lat_col] + list(point_cols),
+        "tiles": n_tiles,
+        "bytes": encoded_bytes.get("identity", 0),
+        # Every tile has these precompressed variants beside it (.gz, .br)
+        "encoded_bytes": encoded_bytes,
+    }
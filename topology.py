@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+
+# © Tax Policy Associates 2025
+#
+# Minimal TopoJSON encoder for the constituency boundaries. Coordinates are
+# quantized to an integer grid, rings are cut at junctions into arcs and every
+# border shared by two constituencies is stored once. Simplifying the arcs
+# (rather than each polygon) keeps neighbouring constituencies' edges
+# identical, so coarse levels have no slivers or gaps.
+
+import json
+
+import numpy as np
+import pandas as pd
+import shapely
+
+# Grid the full-detail topology is built on (per axis)
+BASE_QUANTIZATION = 100_000
+METRES_PER_DEGREE = 111_320
+
+
+def _polygon_rings(geom):
+    """
+    Rings of a Polygon/MultiPolygon as [[exterior, *interiors], ...], each a
+    coordinate array.
+    """
+    if geom is None or geom.is_empty:
+        return []
+    polygons = geom.geoms if geom.geom_type == "MultiPolygon" else [geom]
+    return [
+        [np.asarray(poly.exterior.coords)] + [np.asarray(ring.coords) for ring in poly.interiors]
+        for poly in polygons
+        if poly.geom_type == "Polygon"
+    ]
+
+
+def _quantize_ring(coords, translate, k, q):
+    """
+    Quantized ring as an open cycle of int64 keys (x * q + y), with repeated
+    points removed. None if fewer than three distinct points remain.
+    """
+    grid = np.round((coords[:, :2] - translate) * k).astype("int64")
+    keys = grid[:, 0] * q + grid[:, 1]
+    keys = keys[np.r_[True, keys[1:] != keys[:-1]]]
+    if len(keys) > 1 and keys[0] == keys[-1]:
+        keys = keys[:-1]
+    return keys if len(keys) >= 3 else None
+
+
+def _junctions(rings):
+    """
+    Points where rings diverge: any point visited with more than one distinct
+    pair of neighbours. Borders between two junctions are then identical
+    sequences in both rings that share them.
+    """
+    if not rings:
+        return np.array([], dtype="int64")
+    keys = np.concatenate(rings)
+    prev = np.concatenate([np.roll(r, 1) for r in rings])
+    nxt = np.concatenate([np.roll(r, -1) for r in rings])
+    visits = pd.DataFrame({"key": keys, "lo": np.minimum(prev, nxt), "hi": np.maximum(prev, nxt)})
+    counts = visits.drop_duplicates()["key"].value_counts()
+    return counts.index[counts.to_numpy() > 1].to_numpy(dtype="int64")
+
+
+def build_topology(geometries, quantization=BASE_QUANTIZATION):
+    """
+    Shared-arc topology for a sequence of Polygon/MultiPolygon geometries.
+    Returns a dict with:
+      arcs        list of int64 key arrays (absolute, on the quantized grid)
+      geometries  per input geometry, a list of polygons, each a list of rings,
+                  each a list of arc indices (~i for arc i reversed)
+      translate/scale/quantization  the grid
+    """
+    rings_by_geom = [_polygon_rings(geom) for geom in geometries]
+    all_coords = [ring for polys in rings_by_geom for poly in polys for ring in poly]
+    if all_coords:
+        stacked = np.concatenate([c[:, :2] for c in all_coords])
+        translate = stacked.min(axis=0)
+        extent = np.maximum(stacked.max(axis=0) - translate, 1e-12)
+    else:
+        translate, extent = np.zeros(2), np.ones(2)
+    k = (quantization - 1) / extent
+
+    quantized = []
+    for polys in rings_by_geom:
+        q_polys = []
+        for poly in polys:
+            q_rings = [_quantize_ring(ring, translate, k, quantization) for ring in poly]
+            # A polygon whose exterior collapses on the grid is dropped
+            if q_rings[0] is not None:
+                q_polys.append([r for r in q_rings if r is not None])
+        quantized.append(q_polys)
+
+    flat_rings = [ring for polys in quantized for poly in polys for ring in poly]
+    junctions = _junctions(flat_rings)
+
+    arcs = []
+    arc_ids = {}
+
+    def arc_index(seq):
+        seq = tuple(seq)
+        if seq in arc_ids:
+            return arc_ids[seq]
+        reverse = seq[::-1]
+        if reverse in arc_ids:
+            return ~arc_ids[reverse]
+        arc_ids[seq] = len(arcs)
+        arcs.append(np.array(seq, dtype="int64"))
+        return arc_ids[seq]
+
+    def cut_ring(ring):
+        cuts = np.flatnonzero(np.isin(ring, junctions))
+        if not len(cuts):
+            # Closed loop with no junctions: start at the smallest point so a
+            # ring shared with another polygon (an enclave) matches
+            ring = np.roll(ring, -int(np.argmin(ring)))
+            return [arc_index(np.r_[ring, ring[:1]])]
+        ring = np.roll(ring, -int(cuts[0]))
+        cuts = np.r_[cuts - cuts[0], len(ring)]
+        closed = np.r_[ring, ring[:1]]
+        return [arc_index(closed[start:stop + 1]) for start, stop in zip(cuts[:-1], cuts[1:])]
+
+    geometries_out = [[[cut_ring(ring) for ring in poly] for poly in polys] for polys in quantized]
+    return {
+        "arcs": arcs,
+        "geometries": geometries_out,
+        "translate": translate,
+        "scale": 1 / k,
+        "quantization": quantization,
+    }
+
+
+def _arc_points(arc, quantization):
+    return np.column_stack([arc // quantization, arc % quantization]).astype("float64")
+
+
+def simplify_arcs(topology, tolerance):
+    """
+    Douglas-Peucker simplification of every arc, in grid units. Arc endpoints
+    (the junctions) never move. Closed arcs that would collapse below a
+    valid ring keep their original points.
+    """
+    arcs = [_arc_points(arc, topology["quantization"]) for arc in topology["arcs"]]
+    if tolerance <= 0 or not arcs:
+        return arcs
+    lines = shapely.linestrings(np.concatenate(arcs), indices=np.repeat(np.arange(len(arcs)), [len(a) for a in arcs]))
+    simplified = shapely.simplify(lines, tolerance, preserve_topology=False)
+    out = []
+    for original, line in zip(arcs, simplified):
+        coords = shapely.get_coordinates(line)
+        closed = len(original) > 2 and np.array_equal(original[0], original[-1])
+        out.append(original if closed and len(coords) < 4 else coords)
+    return out
+
+
+def topology_level(topology, properties, object_name, tolerance=0.0, factor=1):
+    """
+    The TopoJSON document for one resolution: arcs simplified with tolerance
+    (grid units) and then requantized onto a grid factor times coarser.
+    properties is a list of dicts, one per input geometry.
+    """
+    arcs = []
+    for points in simplify_arcs(topology, tolerance):
+        grid = np.round(points / factor).astype("int64")
+        keep = np.r_[True, np.any(grid[1:] != grid[:-1], axis=1)]
+        grid = grid[keep]
+        if len(grid) < 2:
+            grid = np.vstack([grid, grid])
+        delta = np.vstack([grid[:1], np.diff(grid, axis=0)])
+        arcs.append(delta.tolist())
+
+    geometries = []
+    for polys, props in zip(topology["geometries"], properties):
+        if not polys:
+            geometries.append({"type": None, "properties": props})
+        elif len(polys) == 1:
+            geometries.append({"type": "Polygon", "arcs": polys[0], "properties": props})
+        else:
+            geometries.append({"type": "MultiPolygon", "arcs": polys, "properties": props})
+
+    scale = topology["scale"] * factor
+    translate = topology["translate"]
+    extent = (topology["quantization"] - 1) * topology["scale"]
+    return {
+        "type": "Topology",
+        "bbox": [float(translate[0]), float(translate[1]),
+                 float(translate[0] + extent[0]), float(translate[1] + extent[1])],
+        "transform": {"scale": [float(scale[0]), float(scale[1])],
+                      "translate": [float(translate[0]), float(translate[1])]},
+        "objects": {object_name: {"type": "GeometryCollection", "geometries": geometries}},
+        "arcs": arcs,
+    }
+
+
+def tolerance_in_grid_units(topology, tolerance_m):
+    """
+    Converts a tolerance in metres to grid units, for geographic (degree)
+    coordinates. Uses the mean of the two axes' cell sizes.
+    """
+    cell_deg = float(np.mean(topology["scale"]))
+    return tolerance_m / (cell_deg * METRES_PER_DEGREE)
+
+
+def write_topojson_levels(gdf, prop_cols, path_template, levels, object_name):
+    """
+    Writes one TopoJSON file per level (dicts with name, tolerance_m,
+    quantization and max_zoom) for a GeoDataFrame in EPSG:4326. Returns the
+    manifest entries for the levels, coarsest first.
+    """
+    topology = build_topology(gdf.geometry.to_numpy())
+    properties = json.loads(pd.DataFrame(gdf[prop_cols]).to_json(orient="records"))
+    entries = []
+    for level in levels:
+        factor = max(1, BASE_QUANTIZATION // level["quantization"])
+        tolerance = tolerance_in_grid_units(topology, level["tolerance_m"])
+        doc = topology_level(topology, properties, object_name, tolerance, factor)
+        path = path_template.format(level=level["name"])
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(doc, f, separators=(",", ":"))
+        entries.append({
+            "name": level["name"],
+            "file": path,
+            "tolerance_m": level["tolerance_m"],
+            "quantization": BASE_QUANTIZATION // factor,
+            "max_zoom": level["max_zoom"],
+            "arcs": len(doc["arcs"]),
+        })
+    return entries
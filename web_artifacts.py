@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+
+# © Tax Policy Associates 2025
+#
+# Publishing of the files the web app (and the treemap embed) download. Each
+# output is copied to a content-hashed name (stem.<hash>.ext) that can be
+# served with a long-lived immutable Cache-Control, alongside pre-built
+# .gz and .br variants for servers that serve precompressed files (e.g.
+# nginx gzip_static/brotli_static). The fixed-name output is left in place;
+# the manifest entry says which hashed file to fetch and how big each
+# encoding is.
+
+import gzip
+import hashlib
+import os
+import re
+import shutil
+
+try:
+    import brotli
+except ImportError:  # brotli variants are optional
+    brotli = None
+
+HASH_LENGTH = 16
+GZIP_LEVEL = 9
+BROTLI_QUALITY = 11
+
+_warned_no_brotli = False
+
+
+def _hashed_name(path, digest):
+    stem, ext = os.path.splitext(path)
+    return f"{stem}.{digest[:HASH_LENGTH]}{ext}"
+
+
+def _remove_stale_versions(path, keep):
+    """
+    Deletes earlier hashed copies (and their compressed variants) of path.
+    """
+    directory = os.path.dirname(path) or "."
+    stem, ext = os.path.splitext(os.path.basename(path))
+    pattern = re.compile(rf"^{re.escape(stem)}\.[0-9a-f]{{{HASH_LENGTH}}}{re.escape(ext)}(\.gz|\.br)?$")
+    for name in os.listdir(directory):
+        if pattern.match(name) and not name.startswith(os.path.basename(keep)):
+            os.remove(os.path.join(directory, name))
+
+
+def _write_variant(path, data):
+    with open(path, "wb") as f:
+        f.write(data)
+    return {"file": path, "bytes": len(data)}
+
+
+def write_compressed_variants(path, data):
+    """
+    Writes path.gz (and path.br, with brotli) holding data compressed, and
+    returns the encodings for a manifest entry, identity (path) included.
+    """
+    global _warned_no_brotli
+    # mtime=0 keeps the gzip output identical for identical content
+    encodings = {
+        "identity": {"file": path, "bytes": len(data)},
+        "gzip": _write_variant(path + ".gz", gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)),
+    }
+    if brotli is not None:
+        encodings["br"] = _write_variant(path + ".br", brotli.compress(data, quality=BROTLI_QUALITY))
+    elif not _warned_no_brotli:
+        print("Warning: brotli is not installed; writing gzip variants only.")
+        _warned_no_brotli = True
+    return encodings
+
+
+def publish_artifact(path):
+    """
+    Writes the hashed copy of path and its compressed variants, and returns
+    the manifest entry: the hashed file to fetch, the sha256 of its content,
+    and the size of each available encoding. A missing path gives an entry
+    with available False.
+    """
+    if not path or not os.path.exists(path):
+        return {"file": path or "", "bytes": 0, "available": False}
+
+    with open(path, "rb") as f:
+        data = f.read()
+    digest = hashlib.sha256(data).hexdigest()
+    hashed = _hashed_name(path, digest)
+    _remove_stale_versions(path, keep=hashed)
+    shutil.copyfile(path, hashed)
+
+    encodings = write_compressed_variants(hashed, data)
+
+    return {
+        "file": hashed,
+        "source": path,
+        "sha256": digest,
+        "bytes": len(data),
+        "available": True,
+        "encodings": encodings,
+    }